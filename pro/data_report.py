@@ -20,17 +20,23 @@
 # the DST framework used by all the analysis code.
 
 import argparse
-import gzip
+import collections
 import logging
 import os
 import re
+import sqlite3
 import time
 
+from db import migrations, profiler
 from db.database_wrapper import DatabaseWrapper
+from db import timecorr_index
+from db.fdplane_summary import SummaryCache
 from utils import log, tawiki
+from utils.dircache import DirectoryCache
 
 
 MAX_DATE = 20171201
+WRITE_FLUSH_SIZE = 500 # rows per commit when adding many rows at once
 db_wiki = 'db/tafd_status.db'
 db_fadc = 'db/fadc_data.db'
 
@@ -41,8 +47,6 @@ site_to_site_id = {
 }
 
 YMDPS = re.compile('(\d{4})(\d{2})(\d{2})(\d{2})(\d)')
-EVENTS_READ = re.compile('(?<=Events read) *\d+')
-NOT_FOUND = re.compile('not found in attached DST file')
 TIMECORRS = {
     '0': '/tama_{4}/black-rock/{0}{1}{2}/y{0}m{1}d{2}p{3}_site{4}_timecorr.txt',
     '1': '/tama_{4}/long-ridge/{0}{1}{2}/y{0}m{1}d{2}p{3}_site{4}_timecorr.txt',
@@ -69,6 +73,12 @@ class Status(object):
     def __init__(self):
         pass
 
+    def name(self, value):
+        for name, status in self.__dict__.items():
+            if status == value:
+                return name
+        return str(value)
+
 night_statuses = Status()
 night_statuses.WIKI_EXISTS = 0 # Wiki indicates detector may have run
 
@@ -107,7 +117,81 @@ part_statuses.CALIBRATION_COMPLETE = 5 # FDPlane processing mentions no "missing
 part_statuses.CALIBRATION_INCOMPLETE = -5 # calibration permanently unavailable for some or all of data part
 
 
-def data_report(reset=False, console_mirror=False, check_wiki_log=False):
+# Promotion stages, applied in order by run_stages. Each moves rows of a status table
+# from status source to status target. A stage with a predicate does so in a single
+# UPDATE inside SQLite, for every row where the predicate (SQL that may refer to the
+# attached FDDB) holds. A stage with a probe instead selects the candidate rows with
+# select (its one placeholder is the source status; the key comes first in each row),
+# calls probe(context, *row) on each, and promotes the rows for which it returns True;
+# a probe may also return another status to move the row there instead, or None to leave it.
+Stage = collections.namedtuple('Stage', ['table', 'source', 'target', 'predicate', 'select', 'probe'])
+
+def sql_stage(table, source, target, predicate):
+    return Stage(table, source, target, predicate, None, None)
+
+def probe_stage(table, source, target, select, probe):
+    return Stage(table, source, target, None, select, probe)
+
+
+NIGHT_STAGES = [
+    sql_stage('NightStatus', night_statuses.WIKI_EXISTS, night_statuses.LOG_EXISTS,
+        'EXISTS (SELECT 1 FROM FDDB.Runnights AS r WHERE r.date=NightStatus.date AND r.site=NightStatus.site)'),
+    sql_stage('NightStatus', night_statuses.LOG_EXISTS, night_statuses.SIXSIGMA,
+        'EXISTS (SELECT 1 FROM FDDB.Parts AS p WHERE p.date=NightStatus.date AND p.site=NightStatus.site AND p.daqsigma=6.0)'),
+    sql_stage('NightStatus', night_statuses.SIXSIGMA, night_statuses.DAQ_EXISTS,
+        'EXISTS (SELECT 1 FROM FDDB.Parts AS p JOIN FDDB.Filesets AS f ON p.part11=f.part11 WHERE p.date=NightStatus.date AND p.site=NightStatus.site AND p.daqsigma=6.0)'),
+    sql_stage('NightStatus', night_statuses.DAQ_EXISTS, night_statuses.DAQ_COMPLETE,
+        'site<2 AND NOT EXISTS (SELECT 1 FROM FDDB.Parts AS p LEFT OUTER JOIN FDDB.Filesets AS f ON p.part11=f.part11 WHERE p.date=NightStatus.date AND p.site=NightStatus.site AND p.daqsigma=6.0 AND f.ctdprefix IS NULL)'),
+]
+
+PART_STAGES = [
+    sql_stage('PartStatus', part_statuses.LOG_EXISTS, part_statuses.DAQ_EXISTS,
+        'EXISTS (SELECT 1 FROM FDDB.Filesets AS f WHERE f.part11=PartStatus.part11)'),
+    probe_stage('PartStatus', part_statuses.DAQ_EXISTS, part_statuses.TIMECORR_EXISTS,
+        'SELECT part11 FROM PartStatus WHERE status=? ORDER BY part11',
+        lambda context, part11: context.listing.exists(_timecorr_file(part11))),
+    probe_stage('PartStatus', part_statuses.TIMECORR_EXISTS, part_statuses.DST_EXISTS,
+        'SELECT f.part11, f.ctdprefix FROM FDDB.Filesets AS f WHERE f.part11 IN (SELECT part11 FROM PartStatus WHERE status=?) ORDER BY f.part11',
+        lambda context, part11, ctd_prefix: context.listing.exists(_dst0_file(part11, ctd_prefix))),
+    probe_stage('PartStatus', part_statuses.DST_EXISTS, part_statuses.FDPED_EXISTS,
+        'SELECT part11 FROM PartStatus WHERE status=? ORDER BY part11',
+        lambda context, part11: context.listing.exists(_fdped_part_file(part11))),
+    probe_stage('PartStatus', part_statuses.FDPED_EXISTS, part_statuses.CALIBRATION_COMPLETE,
+        'SELECT s.part11, p.daqtrig FROM PartStatus AS s JOIN FDDB.Parts AS p ON s.part11=p.part11 WHERE s.status=? ORDER BY s.part11',
+        lambda context, part11, daqtrig: _probe_calibration(context, part11, daqtrig)),
+]
+
+STATUSES = {
+    'NightStatus': night_statuses,
+    'PartStatus': part_statuses,
+}
+KEYS = {
+    'NightStatus': 'wikilog',
+    'PartStatus': 'part11',
+}
+
+
+class ReportContext(object):
+    """
+    What probes may consult: a DirectoryCache for file existence and a SummaryCache
+    of FDPlane stderr files.
+    """
+    def __init__(self, listing=None, summaries=None):
+        self.listing = listing or DirectoryCache()
+        self.summaries = summaries
+
+
+# Representative report queries and the index each is expected to use (None: any index,
+# as long as no table is fully scanned); see check_query_plans.
+PLAN_CHECKS = [
+    ('SELECT count() FROM NightStatus WHERE status=? AND site<2', (night_statuses.LOG_EXISTS,), 'NightStatus_status_site'),
+    ('SELECT date, site FROM NightStatus WHERE status=? AND ' + NIGHT_STAGES[1].predicate, (night_statuses.LOG_EXISTS,), None),
+    ('SELECT f.part11, f.date, f.part, f.site from FDDB.Parts AS f WHERE f.daqsigma=6.0', (), 'Parts_daqsigma'),
+    ('SELECT part11 FROM PartStatus WHERE status=?', (part_statuses.DAQ_EXISTS,), 'PartStatus_status'),
+]
+
+
+def data_report(reset=False, console_mirror=False, check_wiki_log=False, explain=False, prefetch_threads=0, full=False, ephemeris=False):
     log_name = log.set_up_log(name='report_log.txt', console_mirror=console_mirror)
     logging.info('MAX_DATE: %s', MAX_DATE)
     is_db_new = False
@@ -116,9 +200,14 @@ def data_report(reset=False, console_mirror=False, check_wiki_log=False):
         init_db(db_wiki)
         is_db_new = True
 
-    db = DatabaseWrapper(db_wiki)
+    migrations.migrate(db_wiki, 'tafd_status')
+    migrations.migrate(db_fadc, 'fadc_data')
+
+    db = DatabaseWrapper(db_wiki, persistent=True)
 
     if is_db_new:
+        if ephemeris:
+            fill_dates_from_ephemeris(db)
         update_from_wiki(db)
 
     sql = 'SELECT count() FROM NightStatus WHERE status={} AND site<2'.format(night_statuses.WIKI_EXISTS)
@@ -126,158 +215,147 @@ def data_report(reset=False, console_mirror=False, check_wiki_log=False):
     logging.info('FADC FD runs in state WIKI_EXISTS: %s', num_wiki)
 
     db.attach(db_fadc, 'FDDB')
-    sql = 'SELECT n.date, n.site FROM NightStatus AS n JOIN FDDB.Runnights AS r ON n.date=r.date AND n.site=r.site WHERE n.status={}'.format(night_statuses.WIKI_EXISTS)
-    rows = db.retrieve(sql)
-    if rows:
-        logging.info('Log files found for %s FD runs; promoting status', len(rows))
-        db.update_rows('UPDATE NightStatus SET status={} WHERE date=? AND site=?'.format(night_statuses.LOG_EXISTS), tuple(rows))
-
-    sql = 'SELECT count() FROM NightStatus WHERE status={} AND site<2'.format(night_statuses.LOG_EXISTS)
-    num_log = db.retrieve(sql)[0][0]
-    logging.info('FADC FD runs in state LOG_EXISTS: %s', num_log)
-
-    sql = 'SELECT n.date, n.site FROM FDDB.Parts AS p JOIN NightStatus AS n ON n.date=p.date AND n.site=p.site WHERE p.daqsigma=6.0 AND n.status={}'.format(night_statuses.LOG_EXISTS)
-    rows = db.retrieve(sql)
-    unique_rows = set(rows)
-    if unique_rows:
-        logging.info('Six-sigma parts in LOG_EXISTS: %s in %s runs; promoting status', len(rows), len(unique_rows))
-        db.update_rows('UPDATE NightStatus SET status={} WHERE date=? AND site=?'.format(night_statuses.SIXSIGMA), tuple(unique_rows))
-
-    sql = 'SELECT count() FROM NightStatus WHERE status={} AND site<2'.format(night_statuses.SIXSIGMA)
-    num_six = db.retrieve(sql)[0][0]
-    logging.info('FADC FD runs in state SIXSIGMA: %s', num_six)
-
-    sql = 'SELECT n.date, n.site FROM FDDB.Filesets AS f JOIN FDDB.Parts AS p ON p.part11=f.part11 JOIN NightStatus AS n ON n.date=p.date AND n.site=p.site WHERE p.daqsigma=6.0 AND n.status={}'.format(night_statuses.SIXSIGMA)
-    rows = db.retrieve(sql)
-    unique_rows = set(rows)
-    if unique_rows:
-        logging.info('Filesets in SIXSIGMA: %s in %s runs; promoting status', len(rows), len(unique_rows))
-        db.update_rows('UPDATE NightStatus SET status={} WHERE date=? AND site=?'.format(night_statuses.DAQ_EXISTS), tuple(unique_rows))
-
-    sql = 'SELECT date, site FROM NightStatus WHERE status={} AND site<2'.format(night_statuses.DAQ_EXISTS)
-    any_daq_exists = db.retrieve(sql)
-    logging.info('FADC FD runs in state DAQ_EXISTS: %s', len(any_daq_exists))
-
-    sql = 'SELECT n.date, n.site FROM FDDB.Parts AS p LEFT OUTER JOIN FDDB.Filesets AS f ON p.part11=f.part11 JOIN NightStatus AS n ON p.date=n.date AND p.site=n.site WHERE n.status={} AND p.daqsigma=6.0 AND f.ctdprefix IS NULL'.format(night_statuses.DAQ_EXISTS)
-    rows = db.retrieve(sql)
-    complete_rows = set(any_daq_exists) - set(rows)
-    if complete_rows:
-        logging.info('DAQ found for all parts on %s DAQ_EXISTS runs; promoting status', len(complete_rows))
-        db.update_rows('UPDATE NightStatus SET status={} WHERE date=? AND site=?'.format(night_statuses.DAQ_COMPLETE), tuple(complete_rows))
-
-    sql = 'SELECT date, site FROM NightStatus WHERE status={} AND site<2'.format(night_statuses.DAQ_COMPLETE)
-    all_daq_exists = db.retrieve(sql)
-    logging.info('FADC FD runs in state DAQ_COMPLETE: %s', len(all_daq_exists))
-
-    sql = 'SELECT f.part11, f.date, f.part, f.site from FDDB.Parts AS f WHERE f.daqsigma=6.0 AND f.part11 NOT IN (SELECT part11 FROM PartStatus)'
-    new_parts = db.retrieve(sql)
-    if new_parts:
-        logging.info('Found %s new 6-sigma part(s); adding to status DB with status LOG_EXISTS', len(new_parts))
-        for part11, date, part, site in new_parts:
-            try:
-                db.insert_row('INSERT INTO PartStatus VALUES(?, ?, ?, ?, ?)', (part11, date, part, site, part_statuses.LOG_EXISTS))
-            except Exception as err:
-                logging.error('Error adding %s: %s', part11, err)
-
-    sql = 'SELECT part11 FROM PartStatus WHERE status={}'.format(part_statuses.LOG_EXISTS)
-    logged_parts = db.retrieve(sql)
-    logging.info('Six-sigma parts in state LOG_EXISTS: %s', len(logged_parts))
-
-    sql = 'SELECT part11 FROM FDDB.Filesets WHERE part11 IN ({})'.format(sql)
-    rows = db.retrieve(sql)
-    if rows:
-        logging.info('DAQ found for %s LOG_EXISTS part(s); promoting status', len(rows))
-        db.update_rows('UPDATE PartStatus SET status={} WHERE part11=?'.format(part_statuses.DAQ_EXISTS), tuple(rows))
-
-    sql = 'SELECT part11 FROM PartStatus WHERE status={}'.format(part_statuses.DAQ_EXISTS)
-    daq_parts = db.retrieve(sql)
-    logging.info('Six-sigma parts in state DAQ_EXISTS: %s', len(daq_parts))
-
-    timecorr_found = set()
-    for part11, in daq_parts:
-        timecorr = _timecorr_file(part11)
-        logging.info('Searching for %s', timecorr)
-        if os.path.exists(timecorr):
-            timecorr_found.add((part11,))
-    if timecorr_found:
-        logging.info('Found timecorr for %s DAQ_EXISTS part(s); promoting status', len(timecorr_found))
-        db.update_rows('UPDATE PartStatus SET status={} WHERE part11=?'.format(part_statuses.TIMECORR_EXISTS), tuple(timecorr_found))
-
-    sql = 'SELECT f.part11, f.ctdprefix FROM FDDB.Filesets AS f WHERE f.part11 IN (SELECT part11 FROM PartStatus WHERE status={}) ORDER BY f.part11'.format(part_statuses.TIMECORR_EXISTS)
-    tc_parts = db.retrieve(sql)
-    logging.info('Six-sigma parts in state TIMECORR_EXISTS: %s', len(tc_parts))
-
-    dst0_found = set()
-    for part11, ctd_prefix in tc_parts:
-        dst0 = _dst0_file(part11, ctd_prefix)
-        logging.info('Searching for %s', dst0)
-        if os.path.exists(dst0):
-            dst0_found.add((part11,))
-    if dst0_found:
-        logging.info('Found dst0 for %s TIMECORR_EXISTS part(s); promoting status', len(dst0_found))
-        db.update_rows('UPDATE PartStatus SET status={} WHERE part11=?'.format(part_statuses.DST_EXISTS), tuple(dst0_found))
-
-    sql = 'SELECT part11 FROM PartStatus WHERE status={} ORDER BY part11'.format(part_statuses.DST_EXISTS)
-    dst_parts = db.retrieve(sql)
-    logging.info('Six-sigma parts in state DST_EXISTS: %s', len(dst_parts))
-
-    fdped_found = set()
-    for part11, in dst_parts:
-        fdped = _fdped_part_file(part11)
-        logging.info('Searching for %s', fdped)
-        if os.path.exists(fdped):
-            fdped_found.add((part11,))
-    if fdped_found:
-        logging.info('Found fdped for %s DST_EXISTS part(s); promoting status', len(fdped_found))
-        db.update_rows('UPDATE PartStatus SET status={} WHERE part11=?'.format(part_statuses.FDPED_EXISTS), tuple(fdped_found))
-
-    sql = 'SELECT s.part11, p.daqtrig FROM PartStatus AS s JOIN FDDB.Parts AS p ON s.part11=p.part11 WHERE s.status={} ORDER BY s.part11'.format(part_statuses.FDPED_EXISTS)
-    fdped_parts = db.retrieve(sql)
-    logging.info('Six-sigma parts in state FDPED_EXISTS: %s', len(fdped_parts))
-
-# search for complete calibration the easy way first:
-# FDPlane has been run, it has read all the triggers we expect from the log, and no calibration errors were found.
-    good_calib_via_fdplane = set()
-    bad_calib_via_fdplane = set()
-    for part11, daqtrig in fdped_parts:
-        stderr = _fdplane_stderr_file(part11)
-        if os.path.exists(stderr):
-            logging.info('Checking %s', stderr)
-            with gzip.open(stderr, 'r') as gzerr:
-                err = gzerr.read()
-            if NOT_FOUND.search(err):
-                bad_calib_via_fdplane.add((part11,))
-            else:
-                input = EVENTS_READ.findall(err)
-                events_read = sum([int(i) for i in input])
-                if events_read == daqtrig:
-                    good_calib_via_fdplane.add((part11,))
-                else:
+    if explain:
+        check_query_plans(db)
+
+    run_stages(db, NIGHT_STAGES)
+    add_new_parts(db)
+
+    listing = DirectoryCache()
+    if prefetch_threads:
+        _prefetch_night_dirs(db, listing, prefetch_threads)
+    context = ReportContext(listing, SummaryCache(db, full=full))
+    run_stages(db, PART_STAGES, context)
+    context.summaries.save()
+
+    log_status_counts(db)
+    db.close()
+
+
+def run_stages(db, stages, context=None):
+    """
+    Apply each promotion stage in turn (see Stage) and log how many rows each one moved.
+    """
+    for stage in stages:
+        statuses = STATUSES[stage.table]
+        source = statuses.name(stage.source)
+        if stage.predicate is not None:
+            sql = 'UPDATE {} SET status=? WHERE status=? AND {}'.format(stage.table, stage.predicate)
+            moved = db.update_row(sql, (stage.target, stage.source))
+            if moved:
+                logging.info('%s: promoted %s row(s) from %s to %s', stage.table, moved, source, statuses.name(stage.target))
+            continue
+
+        moves = collections.defaultdict(set)
+        for row in db.retrieve(stage.select, (stage.source,)):
+            result = stage.probe(context, *row)
+            if result is True:
+                result = stage.target
+            if result is not None and result is not False:
+                moves[result].add(row[:1])
+        for target, keys in sorted(moves.items()):
+            logging.info('%s: moving %s row(s) from %s to %s', stage.table, len(keys), source, statuses.name(target))
+            db.update_rows('UPDATE {} SET status={} WHERE {}=?'.format(stage.table, target, KEYS[stage.table]), tuple(sorted(keys)))
+
+
+def add_new_parts(db):
+    """
+    Add every six-sigma part not yet in PartStatus, with status LOG_EXISTS.
+    """
+    sql = 'INSERT INTO PartStatus SELECT part11, date, part, site, ? FROM FDDB.Parts WHERE daqsigma=6.0 AND part11 NOT IN (SELECT part11 FROM PartStatus)'
+    try:
+        added = db.insert_row(sql, (part_statuses.LOG_EXISTS,))
+    except sqlite3.IntegrityError as err:
+        logging.warn('Adding new parts one at a time: %s', err)
+        added = 0
+        new_parts = db.retrieve('SELECT part11, date, part, site FROM FDDB.Parts WHERE daqsigma=6.0 AND part11 NOT IN (SELECT part11 FROM PartStatus)')
+        with db.write_session(flush_size=WRITE_FLUSH_SIZE):
+            for part11, date, part, site in new_parts:
+                try:
+                    added += db.insert_row('INSERT INTO PartStatus VALUES(?, ?, ?, ?, ?)', (part11, date, part, site, part_statuses.LOG_EXISTS))
+                except Exception as err:
+                    logging.error('Error adding %s: %s', part11, err)
+    if added:
+        logging.info('Found %s new 6-sigma part(s); adding to status DB with status LOG_EXISTS', added)
+
+
+def log_status_counts(db):
+    logging.info('FADC FD runs by state: %s', _status_counts(db, 'NightStatus', 'site<2'))
+    logging.info('Six-sigma parts by state: %s', _status_counts(db, 'PartStatus'))
+
+
+def _status_counts(db, table, where='1'):
+    sql = 'SELECT status, count() FROM {} WHERE {} GROUP BY status ORDER BY status'.format(table, where)
+    return ', '.join('{}={}'.format(STATUSES[table].name(status), count) for status, count in db.retrieve(sql))
+
+
+def _probe_calibration(context, part11, daqtrig):
+    """
+    Decide from FDPlane output whether calibration is complete for a part:
+    FDPlane has been run, it has read all the triggers we expect from the log
+    (or at least all those in the timecorr), and no calibration errors were found.
+    """
+    stderr = _fdplane_stderr_file(part11)
+    if not context.listing.exists(stderr):
+        logging.info('Missing %s', stderr)
+        return None
+    logging.info('Checking %s', stderr)
+    outcome = _judge_calibration(context, stderr, _timecorr_file(part11), daqtrig)
+    return True if outcome == part_statuses.CALIBRATION_COMPLETE else outcome
+
+
+def _judge_calibration(context, stderr, timecorr, daqtrig):
+    """
+    Return CALIBRATION_COMPLETE or CALIBRATION_INCOMPLETE as decided from the FDPlane
+    stderr of a part, or None if neither can be concluded yet.
+    """
+    summary = context.summaries.get(stderr)
+    if summary.missing:
+        return part_statuses.CALIBRATION_INCOMPLETE
+    input = summary.events
+    events_read = sum(input)
+    if events_read == daqtrig:
+        return part_statuses.CALIBRATION_COMPLETE
 # now see if maybe we didn't get what the DAQ log said to expect, but nevertheless got everything we could
-                    timecorr = _timecorr_file(part11)
-                    with open(timecorr, 'r') as tc:
-                        ctdtrig = len(tc.readlines())
-                    if events_read == ctdtrig:
-                        good_calib_via_fdplane.add((part11,))
-                    elif err.count('gzclose') <= 1 and (
-                            len(input) == ctdtrig / 256 + 1 or
-                            (len(input) == 1 and events_read / 256 == ctdtrig / 256)
-                        ):
-                        logging.warn('adding despite mismatch: CTD %s, fdplane %s', ctdtrig, events_read)
-                        good_calib_via_fdplane.add((part11,))
-        else:
-            logging.info('Missing %s', stderr)
-    if good_calib_via_fdplane:
-        logging.info('Found fully processed FDPlane with no calibration missing for %s FDPED_EXISTS part(s); promoting status', len(good_calib_via_fdplane))
-        db.update_rows('UPDATE PartStatus SET status={} WHERE part11=?'.format(part_statuses.CALIBRATION_COMPLETE), tuple(good_calib_via_fdplane))
-    if bad_calib_via_fdplane:
-        logging.info('Found fully processed FDPlane with some calibration missing for %s FDPED_EXISTS part(s); updating status', len(bad_calib_via_fdplane))
-        db.update_rows('UPDATE PartStatus SET status={} WHERE part11=?'.format(part_statuses.CALIBRATION_INCOMPLETE), tuple(bad_calib_via_fdplane))
-
-
-    sql = 'SELECT part11 FROM PartStatus WHERE status={}'.format(part_statuses.CALIBRATION_COMPLETE)
-    calib_parts = db.retrieve(sql)
-    logging.info('Six-sigma parts in state CALIBRATION_COMPLETE: %s', len(calib_parts))
+    ctdtrig = timecorr_index.lookup(timecorr).lines
+    if events_read == ctdtrig:
+        return part_statuses.CALIBRATION_COMPLETE
+    if summary.gzclose <= 1 and (
+            len(input) == ctdtrig / 256 + 1 or
+            (len(input) == 1 and events_read / 256 == ctdtrig / 256)
+        ):
+        logging.warn('adding despite mismatch: CTD %s, fdplane %s', ctdtrig, events_read)
+        return part_statuses.CALIBRATION_COMPLETE
+    return None
+
+
+def check_query_plans(db):
+    """
+    Log the EXPLAIN QUERY PLAN of each query in PLAN_CHECKS, warning about any that
+    would not use its intended index. Return True if all of them do.
+    """
+    all_indexed = True
+    for sql, params, index in PLAN_CHECKS:
+        plan = db.explain(sql, params)
+        logging.info('Query plan for %s: %s', sql, [row[-1] for row in plan])
+        if not migrations.uses_index(plan, index):
+            logging.warn('Query does not use index %s: %s', index or '(any)', sql)
+            all_indexed = False
+    return all_indexed
+
+
+def _prefetch_night_dirs(db, listing, threads):
+    """
+    List, in parallel, every per-night directory that the report may search for
+    parts not yet at CALIBRATION_COMPLETE.
+    """
+    sql = 'SELECT s.part11, f.ctdprefix FROM PartStatus AS s JOIN FDDB.Filesets AS f ON s.part11=f.part11 WHERE s.status BETWEEN ? AND ?'
+    dirs = set()
+    for part11, ctd_prefix in db.iter_rows(sql, (part_statuses.LOG_EXISTS, part_statuses.FDPED_EXISTS)):
+        for path in [_timecorr_file(part11), _dst0_file(part11, ctd_prefix), _fdped_part_file(part11), _fdplane_stderr_file(part11)]:
+            dirs.add(os.path.dirname(path))
+    logging.info('Listing %s night directories with %s threads', len(dirs), threads)
+    listing.prefetch(dirs, threads)
 
 
 def _timecorr_file(part11):
@@ -337,6 +415,8 @@ def extra_code(db):
         if site_id == 2:
             continue
         logging.info('Pre-%s nights (hours) missing from tadserv', MAX_DATE)
+        if check_wiki_log:
+            tawiki.get_log_pages(sorted(missing_nights))
         for night in sorted(list(missing_nights)):
             logging.info('%s (%s hours):', night, site_hours[night])
             if check_wiki_log:
@@ -354,23 +434,51 @@ def init_db(dbfile):
         for table, structure in fd_daq_tables:
             cur.execute('DROP TABLE IF EXISTS {0}'.format(table))
             cur.execute('CREATE TABLE {0}({1})'.format(table, structure))
+        # created and altered by early migrations, which reset applies again
+        cur.execute('DROP TABLE IF EXISTS ProbeLedger')
 
         cur.executemany('INSERT INTO Sites VALUES(?, ?, ?, ?)', static_data.sites)
 
+    migrations.migrate(dbfile, 'tafd_status', reset=True)
+
 
 START_YEAR = 2007
 CUTOFF_YEAR = 2018 # will not be included in range()
 
 
+DARK_TOLERANCE = 0.25 # hours of disagreement between wiki and ephemeris worth reporting
+
+def fill_dates_from_ephemeris(db, start=START_YEAR * 10000 + 101, end=CUTOFF_YEAR * 10000 + 101):
+    """
+    Add each date from start up to end to Dates, with moonless dark hours computed
+    locally by utils/ephemeris.py instead of scraped from the wiki. Dark hours the
+    wiki reports later are then only checked against these. Return False if NumPy
+    is not available.
+    """
+    try:
+        from utils import ephemeris
+    except ImportError as err:
+        logging.warn('Cannot compute dark hours locally (%s); using wiki values', err)
+        return False
+    existing_rows = set(r[0] for r in db.retrieve('SELECT date FROM Dates'))
+    dates = [date for date in ephemeris.date_range(start, end) if date not in existing_rows]
+    dark = ephemeris.dark_hours(dates)
+    logging.info('Computed %s dark hours for %s night(s) from %s to %s', sum(dark.values()), len(dates), start, end)
+    db.insert_rows('INSERT INTO Dates VALUES(?, ?)', tuple(sorted(dark.items())))
+    return True
+
+
 def update_from_wiki(db):
-    existing_rows = [r[0] for r in db.retrieve('SELECT date FROM Dates')]
+    existing_rows = dict(db.retrieve('SELECT date, darkhours FROM Dates'))
+    pages = tawiki.get_pages(range(START_YEAR, CUTOFF_YEAR))
     for year in range(START_YEAR, CUTOFF_YEAR):
-        html = tawiki.get_page(year)
+        html = pages[year]
         dark, site_logs = get_dark_hours_logs_by_date(html)
 
         nights = sorted(dark.keys())
         logging.info('Found %s dark hours for %s night(s) from %s to %s', sum(dark.values()), len(nights), nights[0], nights[-1])
-        new_dark_tuples = [(night, dark[night]) for night in nights if night not in existing_rows]
+        new_dark_tuples = [(night, dark[night]) for night in nights if int(night) not in existing_rows]
+        _cross_check_dark_hours(dark, existing_rows)
 
         db.insert_rows('INSERT INTO Dates VALUES(?, ?)', tuple(new_dark_tuples))
 
@@ -384,6 +492,20 @@ def update_from_wiki(db):
                     logging.error('Exception: %s executing SQL for %s, %s', err, date, sites)
 
 
+def _cross_check_dark_hours(wiki_dark, known_dark):
+    """
+    Warn about nights whose wiki dark hours differ from those already in Dates by more than DARK_TOLERANCE.
+    """
+    checked = [(night, hours, known_dark[int(night)]) for night, hours in sorted(wiki_dark.items()) if int(night) in known_dark]
+    mismatches = [(night, wiki_hours, known_hours) for night, wiki_hours, known_hours in checked
+        if abs(wiki_hours - known_hours) > DARK_TOLERANCE]
+    for night, wiki_hours, known_hours in mismatches:
+        logging.warn('Dark hours for %s: wiki %s, Dates %s', night, wiki_hours, known_hours)
+    if checked:
+        logging.info('Dark hours agree within %s hours for %s of %s night(s)', DARK_TOLERANCE,
+            len(checked) - len(mismatches), len(checked))
+
+
 DARK = re.compile('<td>([0-9]{1,2}\.[0-9]{2})</td>') # matches cells like <td>6.84</td>
 LOG = re.compile('y([0-9]{4})m([0-9]{2})d([0-9]{2})\.(?:brm?|lr|md|sd)\.log') # like y2018m01d10.brm.log
 TIME = re.compile('\w{3} (\w{3} \d+ \d{4}) \d{2}:\d{2} (?:UT|GMT)') # like Thu Jan 10 2018 05:33 GMT
@@ -443,8 +565,8 @@ def get_wiki_log_content(log_file):
 def query_part(part):
     assert 20000000000 < int(part) < 30000000000, 'Part must be 11-digit YYYYMMDDPPS'
     db = DatabaseWrapper(db_wiki)
-    sql = 'SELECT status FROM PartStatus WHERE part11={}'.format(part)
-    results = db.retrieve(sql)
+    sql = 'SELECT status FROM PartStatus WHERE part11=?'
+    results = db.retrieve(sql, (int(part),))
     if not results:
         return None
 
@@ -455,5 +577,16 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-r', '--reset', action='store_true')
     parser.add_argument('-w', '--wiki', action='store_true')
+    parser.add_argument('-e', '--explain', action='store_true', help='check that report queries use their indexes')
+    parser.add_argument('-o', '--offline', action='store_true', help='read wiki pages only from the local cache')
+    parser.add_argument('--ephemeris', action='store_true', help='compute dark hours locally (requires NumPy) for a new database')
+    parser.add_argument('-f', '--full', action='store_true', help='re-read every FDPlane stderr file, even if unchanged since the last report')
+    parser.add_argument('-p', '--prefetch', type=int, default=0, metavar='THREADS', help='list all night directories up front with this many threads')
+    parser.add_argument('--profile', action='store_true', help='log a summary of time spent per SQL statement')
+    parser.add_argument('--slow', type=float, default=None, help='log each SQL statement taking at least this many seconds')
     args = parser.parse_args()
-    data_report(reset=args.reset, console_mirror=True, check_wiki_log=args.wiki)
+    if args.offline:
+        tawiki.configure(offline=True)
+    if args.profile or args.slow is not None:
+        profiler.enable(slow_threshold=args.slow, summary_at_exit=args.profile)
+    data_report(reset=args.reset, console_mirror=True, check_wiki_log=args.wiki, explain=args.explain, prefetch_threads=args.prefetch, full=args.full, ephemeris=args.ephemeris)
@@ -3,19 +3,60 @@
 # Class definition for wrapping an sqlite3 connection with some useful commands.
 
 import sqlite3
+import time
+
+from contextlib import contextmanager
+
+# number of compiled statements kept by each persistent connection
+STATEMENT_CACHE_SIZE = 256
+
+# rows written in a write session between commits
+DEFAULT_FLUSH_SIZE = 500
+
+# rows fetched at a time by iter_rows
+DEFAULT_BATCH_SIZE = 1000
+
+# seconds to wait for another connection's lock before raising "database is locked"
+BUSY_TIMEOUT = 30.0
 
 class DatabaseWrapper(object):
+    """
+    By default every call opens (and closes) its own connection. Use the wrapper
+    as a context manager, or call open() and close(), to hold one connection
+    with all attachments in place for the duration:
+
+        with DatabaseWrapper(dbfile) as db:
+            db.retrieve(...)
+
+    With read_only=True, every connection refuses writes; this suits readers
+    running alongside a DatabaseWriter (see writer.py) that owns all writes.
 
-    def __init__(self, db):
+    Set the class attribute profiler (see profiler.py) to time every statement.
+    """
+    profiler = None
+
+    def __init__(self, db, persistent=False, read_only=False):
         self.db = db
+        self.read_only = read_only
         self._attachments = []
+        self._con = None
+        self._depth = 0
+        self._flush_size = None
+        self._pending = 0
+        if persistent:
+            self.open()
 
     def attach(self, db, name):
         self._attachments.append(
             (db, name),
         )
+        if self._con is not None:
+            self._con.execute("ATTACH '{}' AS {}".format(db, name))
 
     def detach(self, db):
+        if self._con is not None:
+            for name in [a[1] for a in self._attachments if a[0] == db]:
+                self._con.execute('DETACH {}'.format(name))
         self._attachments = [a for a in self._attachments if a[0] != db]
 
     def _attach_all(self, cur):
@@ -23,12 +64,148 @@ class DatabaseWrapper(object):
             sql = "ATTACH '{}' AS {}".format(db, name)
             cur.execute(sql)
 
+    def open(self):
+        """
+        Open a long-lived connection (if not already open), attaching every
+        known database once. Calls are counted, so nested use is safe; the
+        connection closes when close() has been called as many times.
+        """
+        self._depth += 1
+        if self._con is None:
+            self._con = self._connect(cached_statements=STATEMENT_CACHE_SIZE)
+            self._con.execute('PRAGMA foreign_keys = 1')
+            self._attach_all(self._con.cursor())
+
+    def _connect(self, **kwargs):
+        con = sqlite3.connect(self.db, timeout=BUSY_TIMEOUT, **kwargs)
+        if self.read_only:
+            con.execute('PRAGMA query_only = 1')
+        return con
+
+    def close(self):
+        self._depth = max(self._depth - 1, 0)
+        if self._depth == 0 and self._con is not None:
+            self._con.close()
+            self._con = None
+
+    @property
+    def is_open(self):
+        return self._con is not None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def set_journal_mode(self, journal_mode):
+        """
+        Switch the database file to journal_mode, which persists for every later
+        connection. WAL journaling relies on shared memory and must only be used
+        for a database on local disk, never on network storage.
+        """
+        con = self._connect()
+        try:
+            return con.execute('PRAGMA journal_mode = {}'.format(journal_mode)).fetchone()[0]
+        finally:
+            con.close()
+
+    @contextmanager
+    def write_session(self, flush_size=DEFAULT_FLUSH_SIZE, journal_mode=None, synchronous='NORMAL'):
+        """
+        Group many insert/update calls into explicit transactions on one connection,
+        committing after every flush_size rows written. Whatever has been written is
+        also committed when the session ends, whether normally or by an exception,
+        so an interrupted scan loses nothing it had already done.
+
+        The journal mode is left alone unless journal_mode is given. Note that a
+        journal mode persists in the database file (see set_journal_mode).
+        A session opened inside another one simply joins it.
+        """
+        if self._flush_size is not None:
+            yield self
+            return
+
+        self.open()
+        con = self._con
+        isolation_level = con.isolation_level
+        prior_synchronous = con.execute('PRAGMA synchronous').fetchone()[0]
+        if journal_mode:
+            con.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+        if synchronous:
+            con.execute('PRAGMA synchronous = {}'.format(synchronous))
+
+        con.isolation_level = None
+        con.execute('BEGIN')
+        self._flush_size = flush_size
+        self._pending = 0
+        try:
+            yield self
+        except:
+            try:
+                con.execute('COMMIT')
+            except sqlite3.OperationalError:
+                pass # transaction already rolled back by the error
+            raise
+        else:
+            con.execute('COMMIT')
+        finally:
+            self._flush_size = None
+            self._pending = 0
+            con.isolation_level = isolation_level
+            con.execute('PRAGMA synchronous = {}'.format(prior_synchronous))
+            self.close()
+
+    def _count_written(self, num_rows):
+        """
+        Inside a write session, commit and begin anew once flush_size rows are pending.
+        """
+        if self._flush_size is None:
+            return
+        self._pending += num_rows
+        if self._pending >= self._flush_size:
+            self._con.execute('COMMIT')
+            self._con.execute('BEGIN')
+            self._pending = 0
+
+    @contextmanager
+    def _connection(self, attach=False, foreign_keys=False):
+        """
+        Yield the persistent connection if there is one, otherwise a new connection
+        that is closed afterward. Either way, commit on success and roll back on error.
+        Inside a write session, commits are left to the session instead.
+        """
+        if self._flush_size is not None:
+            yield self._con
+            return
+
+        if self._con is not None:
+            with self._con:
+                yield self._con
+            return
+
+        con = self._connect()
+        try:
+            with con:
+                if foreign_keys:
+                    con.execute('PRAGMA foreign_keys = 1')
+                if attach:
+                    self._attach_all(con.cursor())
+                yield con
+        finally:
+            con.close()
+
+    def _profile(self, sql, start, rows):
+        if self.profiler is not None:
+            self.profiler.record(self.db, sql, time.time() - start, rows)
+
     def report(self):
         """
         Print a list of tables in the database, with the number of rows in each.
         """
         import json
-        with sqlite3.connect(self.db) as con:
+        with self._connection() as con:
             cur = con.cursor()
 
             cur.execute('SELECT name FROM sqlite_master WHERE type="table"')
@@ -42,38 +219,83 @@ class DatabaseWrapper(object):
         print json.dumps(counts, sort_keys=True, indent=2)
 
 
-    def retrieve(self, sql):
+    def retrieve(self, sql, params=()):
         """
         Execute arbitrary SQL on the specified database, provided the SQL begins
-        with 'SELECT ', then return the selected rows.
+        with 'SELECT ', then return the selected rows. Values for any '?'
+        placeholders are given as a tuple in params.
         """
         assert sql.upper().startswith('SELECT ')
+        assert isinstance(params, tuple)
 
-        with sqlite3.connect(self.db) as con:
+        start = time.time()
+        with self._connection(attach=True) as con:
             cur = con.cursor()
-            self._attach_all(cur)
-
-            cur.execute(sql)
+            cur.execute(sql, params)
 
             rows = cur.fetchall()
+        self._profile(sql, start, len(rows))
         return rows
 
+    def iter_rows(self, sql, params=(), batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Like retrieve, but yield the selected rows one at a time, fetching
+        batch_size rows from SQLite at once, so that memory use does not grow
+        with the size of the result.
+        """
+        assert sql.upper().startswith('SELECT ')
+        assert isinstance(params, tuple)
+
+        seconds = 0.0
+        count = 0
+        with self._connection(attach=True) as con:
+            start = time.time()
+            cur = con.cursor()
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                seconds += time.time() - start
+                if not rows:
+                    break
+                count += len(rows)
+                for row in rows:
+                    yield row
+                start = time.time()
+        self._profile(sql, time.time() - seconds, count)
+
+    def explain(self, sql, params=()):
+        """
+        Return the rows of EXPLAIN QUERY PLAN for a SELECT statement, to check
+        which indexes SQLite would use for it.
+        """
+        assert sql.upper().startswith('SELECT ')
+        with self._connection(attach=True) as con:
+            cur = con.cursor()
+            cur.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return cur.fetchall()
+
     def _execute(self, sql, values):
         assert sql.count('?') == len(values)
         assert isinstance(values, tuple)
-        with sqlite3.connect(self.db) as con:
+        start = time.time()
+        with self._connection(attach=True, foreign_keys=True) as con:
             cur = con.cursor()
-            cur.execute('PRAGMA foreign_keys = 1')
             cur.execute(sql, values)
+            rowcount = max(cur.rowcount, 0)
+        self._profile(sql, start, rowcount)
+        self._count_written(rowcount)
+        return rowcount
 
     def _executemany(self, sql, all_values):
         assert isinstance(all_values, tuple)
         num_v = sql.count('?')
         assert all(isinstance(values, tuple) and len(values) == num_v for values in all_values)
-        with sqlite3.connect(self.db) as con:
+        start = time.time()
+        with self._connection(foreign_keys=True) as con:
             cur = con.cursor()
-            cur.execute('PRAGMA foreign_keys = 1')
             cur.executemany(sql, all_values)
+        self._profile(sql, start, len(all_values))
+        self._count_written(len(all_values))
 
 
 
@@ -81,9 +303,10 @@ class DatabaseWrapper(object):
         """
         Execute arbitrary SQL on the specified database, provided the SQL begins
         with 'INSERT INTO '. A tuple is expected for values.
+        Return the number of rows inserted.
         """
         assert sql.upper().startswith('INSERT INTO ')
-        self._execute(sql, values)
+        return self._execute(sql, values)
 
     def insert_rows(self, sql, all_values):
         """
@@ -97,10 +320,11 @@ class DatabaseWrapper(object):
         """
         Execute arbitrary SQL on the specified database, provided the SQL begins
         with 'UPDATE ' and contains ' WHERE '. A tuple is expected for values.
+        The statement may refer to attached databases. Return the number of rows changed.
         """
         assert sql.upper().startswith('UPDATE ')
         assert ' WHERE ' in sql.upper()
-        self._execute(sql, values)
+        return self._execute(sql, values)
 
     def update_rows(self, sql, all_values):
         """
@@ -112,6 +336,15 @@ class DatabaseWrapper(object):
         self._executemany(sql, all_values)
 
     
+    def delete_rows(self, sql, all_values):
+        """
+        Execute arbitrary SQL on the specified database, provided the SQL begins
+        with 'DELETE FROM ' and contains ' WHERE '. A tuple of tuples is expected for all_values.
+        """
+        assert sql.upper().startswith('DELETE FROM ')
+        assert ' WHERE ' in sql.upper()
+        self._executemany(sql, all_values)
+
     def __repr__(self):
         return 'DatabaseWrapper for {}'.format(self.db)
 
@@ -0,0 +1,170 @@
+# dst_verdicts.py
+# Whether each TAMA DST is complete and consistent with its prolog and stdout, decided
+# with one streaming pass over the stdout and kept in the processing database until
+# any of the three files changes, so later passes of the orchestrator only stat them.
+
+import collections
+import json
+import logging
+import os
+import re
+import time
+
+from database_wrapper import DatabaseWrapper
+import migrations
+
+
+default_dbfile = 'db/fadc_process.db'
+
+# match a string like "7/28/2017  UT 05:59:55.087354105" followed by the processing time (indicating success)
+TIMESTAMP = re.compile('(\d+)\/(\d+)\/(\d{4}) +UT (\d+):(\d{2}):(\d{2}\.\d+).*sec')
+PROLOG_ENTRY = re.compile('([A-Z]+_[A-Z]+) (\d+)')
+
+StdoutSummary = collections.namedtuple('StdoutSummary', ['triggers', 'first_trigger', 'last_trigger', 'first_timestamp', 'last_timestamp'])
+
+Verdict = collections.namedtuple('Verdict', ['ok', 'reason', 'tama_read', 'tama_kept', 'bytes_out', 'triggers', 'trigger_seconds', 'stdout_seconds'])
+
+
+def _seconds(hms):
+    return sum([float(hms[i]) * 60**(2-i) for i in range(3)])
+
+
+def scan_stdout(path):
+    """
+    Read TAMA's stdout once, keeping only the number of "trigger" lines, the first
+    and last of them, and the first and last TIMESTAMP matches.
+    """
+    triggers = 0
+    first_trigger = last_trigger = None
+    first_timestamp = last_timestamp = None
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('trigger'):
+                triggers += 1
+                if first_trigger is None:
+                    first_trigger = line
+                last_trigger = line
+            elif ' UT ' in line:
+                m = TIMESTAMP.search(line)
+                if m:
+                    if first_timestamp is None:
+                        first_timestamp = m.groups()
+                    last_timestamp = m.groups()
+    return StdoutSummary(triggers, first_trigger, last_trigger, first_timestamp, last_timestamp)
+
+
+def judge(dst, prolog, out, expected=None):
+    """
+    Check a DST against its prolog (one TAMA_KEPT and BYTES_OUT, the latter equal to
+    the DST's size) and stdout (one trigger line per kept trigger), and, if given,
+    the number of triggers expected. Return a Verdict; missing files make it fail.
+    """
+    return expect(_judge_files(dst, prolog, out), expected)
+
+
+def expect(verdict, expected=None):
+    """
+    Return verdict, made to fail if expected is given and differs from the triggers kept.
+    """
+    if verdict.ok and expected is not None and verdict.tama_kept != expected:
+        return verdict._replace(ok=False, reason='kept {} of {} triggers'.format(verdict.tama_kept, expected))
+    return verdict
+
+
+def _judge_files(dst, prolog, out):
+    """
+    The checks of judge() that depend only on the three files.
+    """
+    values = {'tama_read': None, 'tama_kept': None, 'bytes_out': None, 'triggers': None,
+              'trigger_seconds': None, 'stdout_seconds': None}
+
+    def verdict(reason=None):
+        return Verdict(ok=reason is None, reason=reason, **values)
+
+    try:
+        with open(prolog, 'r') as prolog_file:
+            entries = PROLOG_ENTRY.findall(prolog_file.read())
+    except IOError:
+        return verdict('no prolog')
+    kept = [int(v) for k, v in entries if k == 'TAMA_KEPT']
+    bytes_out = [int(v) for k, v in entries if k == 'BYTES_OUT']
+    read = [int(v) for k, v in entries if k == 'TAMA_READ']
+    values.update(tama_read=read[-1] if read else None, tama_kept=kept[-1] if kept else None,
+                  bytes_out=bytes_out[-1] if bytes_out else None)
+    if len(kept) != 1 or len(bytes_out) != 1:
+        return verdict('prolog lacks a single TAMA_KEPT and BYTES_OUT')
+
+    try:
+        summary = scan_stdout(out)
+    except IOError:
+        return verdict('no stdout')
+    values['triggers'] = summary.triggers
+    if summary.triggers:
+        values['trigger_seconds'] = _seconds(summary.last_trigger.split()[5].split(':')) - _seconds(summary.first_trigger.split()[5].split(':'))
+    if summary.first_timestamp is not None:
+        values['stdout_seconds'] = _seconds(summary.last_timestamp[-3:]) - _seconds(summary.first_timestamp[-3:])
+
+    try:
+        if os.stat(dst).st_size != bytes_out[0]:
+            return verdict('DST size differs from BYTES_OUT')
+    except OSError:
+        return verdict('no DST')
+    if summary.triggers != kept[0]:
+        return verdict('{} trigger lines for {} kept'.format(summary.triggers, kept[0]))
+    return verdict()
+
+
+def _state(paths):
+    """
+    The (size, mtime) of each file, or None for one that does not exist.
+    """
+    state = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            state.append([st.st_size, st.st_mtime])
+        except OSError:
+            state.append(None)
+    return json.dumps(state)
+
+
+class DstVerdicts(object):
+    """
+    Cache of judge() results in the DstVerdicts table of dbfile. What is stored
+    depends only on the state of the files, so callers expecting different trigger
+    counts (or none) share it; the expected count is compared when a verdict is read.
+    Rows written with an expected count (by earlier versions) are judged again.
+    """
+    def __init__(self, dbfile=default_dbfile):
+        migrations.migrate(dbfile, 'fadc_process')
+        self.db = DatabaseWrapper(dbfile)
+
+    def validate(self, dst, prolog, out, expected=None):
+        dst = os.path.abspath(dst)
+        state = _state([dst, prolog, out])
+        rows = self.db.retrieve('SELECT state, expected, ok, reason, tama_read, tama_kept, bytes_out, triggers, trigger_seconds, stdout_seconds FROM DstVerdicts WHERE dst=?', (dst,))
+        if rows and rows[0][0] == state and rows[0][1] is None:
+            ok, reason = rows[0][2:4]
+            verdict = Verdict(bool(ok), reason, *rows[0][4:])
+        else:
+            verdict = _judge_files(dst, prolog, out)
+            with self.db.write_session():
+                self.db.delete_rows('DELETE FROM DstVerdicts WHERE dst=?', ((dst,),))
+                self.db.insert_row('INSERT INTO DstVerdicts VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (dst, state, None, int(verdict.ok), verdict.reason) + tuple(verdict[2:]) + (time.time(),))
+        verdict = expect(verdict, expected)
+        if not verdict.ok:
+            logging.info('%s: %s', os.path.basename(dst), verdict.reason)
+        return verdict
+
+
+_default_verdicts = None
+
+def validate(dst, prolog, out, expected=None):
+    """
+    DstVerdicts.validate using the default processing database.
+    """
+    global _default_verdicts
+    if _default_verdicts is None:
+        _default_verdicts = DstVerdicts()
+    return _default_verdicts.validate(dst, prolog, out, expected)
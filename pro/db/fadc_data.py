@@ -4,11 +4,15 @@
 
 import sqlite3
 import os
-import re
-from glob import glob
 default_dbfile = 'db/fadc_data.db'
 
 from database_wrapper import DatabaseWrapper
+import log_ingest
+import migrations
+import raw_catalog
+
+# rows committed at a time by the scans below; an interruption loses at most this many
+FLUSH_SIZE = 100
 
 db = DatabaseWrapper(default_dbfile)
 
@@ -17,37 +21,45 @@ def init(dbfile=db.db):
     Create the database tables from scratch (overwriting any existing ones),
     and initialize with static data where appropriate.
     """
-    from tables import fadc_tables
+    from tables import fadc_tables, fadc_catalog_tables, fadc_daq_log_tables
     import static_data
     with sqlite3.connect(dbfile) as con:
         cur = con.cursor()
 
+        for table, structure in fadc_catalog_tables + fadc_daq_log_tables:
+            cur.execute('DROP TABLE IF EXISTS {0}'.format(table))
+
         for table, structure in fadc_tables:
             cur.execute('DROP TABLE IF EXISTS {0}'.format(table))
             cur.execute('CREATE TABLE {0}({1})'.format(table, structure))
 
         cur.executemany('INSERT INTO Sites VALUES(?, ?, ?, ?)', static_data.sites)
+
+    migrations.migrate(dbfile, 'fadc_data', reset=True)
+
+def _migrate():
+    """
+    Bring an existing database up to the current schema (with the raw-file catalog
+    and the ingested logs) before a scan uses it.
+    """
+    migrations.migrate(db.db, 'fadc_data')
         
 
 def find_new_downloads():
     """
-    Locate all paths matching /tadserv*/tafd/*/*/ctd/ and add to the database.
-    Return the number of new paths found.
+    Refresh the raw-file catalog, which locates all paths matching /tadserv*/tafd/*/*/ctd/,
+    and add any new ones to the database. Return the number of new paths found.
     """
+    _migrate()
     db_downloads = db.retrieve('SELECT path, site FROM Downloads')
     print 'Downloads already in database:', len(db_downloads)
-    tafd_list = sorted(glob('/tadserv*/tafd/'))
+    raw_catalog.refresh(db)
     new_downloads = []
-    for tafd in tafd_list:
-        ctd_list = glob(tafd + '*/*/ctd/')
-        for ctd in ctd_list:
-            site = int(ctd.split('station')[1][0]) # path contains "station0" or "station1"
-            path = ctd[:-4] # truncate "ctd/"
-            download = (path, site)
-            try:
-                db_downloads.remove(download) # This download was in DB already
-            except ValueError: # this download is new
-                new_downloads.append(download)
+    for download in raw_catalog.downloads(db):
+        try:
+            db_downloads.remove(download) # This download was in DB already
+        except ValueError: # this download is new
+            new_downloads.append(download)
     if len(db_downloads):
         print 'Downloads not found in this scan:', [d[0] for d in db_downloads]
 
@@ -82,14 +94,14 @@ def _get_paths_to_logs(db_downloads):
     """
     The same log file can be found in multiple downloads. Assemble a dict with
     log files as keys, and the value is a list of paths to each log file.
+    Logs are looked up in the catalog, whose daq-ctrl listings are refreshed
+    first for any directory that changed.
     """
     paths_to_log = {}
     print 'Getting paths to logs.'
+    raw_catalog.refresh_logs(db, [download for download, site in db_downloads])
     for download, site in db_downloads:
-        normal_log = os.path.join(download, 'daq-ctrl/y*_*.log')
-        alt_log = os.path.join(download, 'daq-ctrl/[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9].log')
-        logs = sorted(glob(normal_log) + glob(alt_log))
-        logs = _pick_sameday_log(logs)
+        logs = _pick_sameday_log(raw_catalog.log_files(db, download))
         for log in logs:
             sitelog = '{}:{}'.format(site, os.path.basename(log))
             try:
@@ -98,7 +110,7 @@ def _get_paths_to_logs(db_downloads):
                 paths_to_log[sitelog] = [log]
     return paths_to_log
 
-def _filter_incomplete_logs(orig_logs):
+def _filter_incomplete_logs(orig_logs, part_data=None):
     """
     Recursive. Looks through orig_logs to confirm that multiple files
     are actually copies of the same content. If this is true, 
@@ -106,9 +118,13 @@ def _filter_incomplete_logs(orig_logs):
     are ignored, but if multiple distinct part sets are defined by files of the same name,
     we keep the longest set(s), removing everything shorter. Then we call this
     function again on the reduced set.
+    The part lines of each log may be supplied in part_data (a dict keyed by path);
+    otherwise the files are read.
     """
     logfile = os.path.basename(orig_logs[0])
-    all_parts = {l: '\n'.join(re.findall('.*\|.*\|.*\|.*\|', open(l, 'r').read())) for l in orig_logs}
+    if part_data is None:
+        part_data = {l: log_ingest.read_part_lines(l) for l in orig_logs}
+    all_parts = {l: part_data[l] for l in orig_logs}
     unique_part_data = set(all_parts.values())
     if len(unique_part_data) == 1:
         return orig_logs, all_parts.values()[0].count('|')
@@ -124,11 +140,11 @@ def _filter_incomplete_logs(orig_logs):
                     print 'Removing', f
                     orig_logs.remove(f)
         if len(orig_logs) < count:            
-            return _filter_incomplete_logs(orig_logs)
+            return _filter_incomplete_logs(orig_logs, part_data)
         else:
             raise Exception("Different logs, same part count!")
 
-def _find_ctd_and_log(chron_logs, skip=False):
+def _find_ctd_and_log(chron_logs, skip=False, part_data=None):
     """
     For a set of logs, find the actual download that contains the files from the logged night.
     Start by checking the downloads where the logs were found. If files are in none of them,
@@ -143,7 +159,7 @@ def _find_ctd_and_log(chron_logs, skip=False):
     for log in chron_logs:
         download, logfile = log.split('/daq-ctrl/')
         ctd = download + '/ctd/event-data'
-        ctds = glob(ctd + '/DAQ-' + ymd[2:] + '*.d.bz2')
+        ctds = raw_catalog.ctd_files(db, ymd[2:] + '*', download=download + '/')
         if len(ctds) > 0:
             print ctd, log
             return ctd, log, ymd            
@@ -155,13 +171,10 @@ def _find_ctd_and_log(chron_logs, skip=False):
         print 'No CTD found for {} in {} location(s) searched. Comprehensive search now...'.format(logfile, len(chron_logs))
         site = log.split('station')[1][0]
 
-        normal_ctd = '/tadserv*/tafd/*/*/ctd/event-data/DAQ-{}??-{}-*.d.bz2'.format(ymd[2:], site)
+        ctds = raw_catalog.ctd_files(db, ymd[2:] + '??', site)
 
         if ymd.startswith('2007'): # special case before current standard was implemented
-            alt_ctd = '/tadserv*/tafd/*/*/ctd/event-data/DAQ-0{}??-{}-*.d.bz2'.format(ymd[4:], site)
-            ctds = glob(normal_ctd) + glob(alt_ctd)
-        else:
-            ctds = glob(normal_ctd)
+            ctds += raw_catalog.ctd_files(db, '0' + ymd[4:] + '??', site)
         
         if len(ctds) == 0:
             print 'Still no files found! Giving up.'
@@ -171,10 +184,12 @@ def _find_ctd_and_log(chron_logs, skip=False):
         downloads = [ctd.split('ctd/')[0] for ctd in ctds]
         if len(set(downloads)) > 1:
             print 'Found multiple matching downloads:', set(downloads)
-            allparts = re.findall('.*\|.*\|.*\|.*\|', open(log, 'r').read())
+            if part_data is None:
+                part_data = {log: log_ingest.read_part_lines(log)}
+            allparts = part_data[log].split('\n')
             
             part_ids = [p.split()[0][-2:] for p in allparts]
-            filecount = {d: sum([len(glob('{}/ctd/event-data/DAQ-*{}{}-{}-*.d.bz2'.format(d, ymd[4:], p, site))) for p in part_ids]) for d in list(set(downloads))}
+            filecount = {d: sum([len(raw_catalog.part_ctd_files(db, d, ymd[4:] + p, site)) for p in part_ids]) for d in list(set(downloads))}
             
             sorted_filecount = sorted(filecount.items(), key=lambda x: x[1], reverse=True)
             print 'Matching file counts; choosing largest:', sorted_filecount
@@ -188,46 +203,55 @@ def _find_ctd_and_log(chron_logs, skip=False):
 
 def find_new_runnights():
     """
-    Populate the Runnights table from logs in known downloads. Insert one row at a time
-    to tolerate interruptions.
+    Populate the Runnights table from logs in known downloads. Rows are committed
+    FLUSH_SIZE at a time (and on any exit) to tolerate interruptions.
     """
-    db_runnights = db.retrieve('SELECT site, logfile FROM Runnights')
-    print 'Logfiles already in database:', len(db_runnights)
-    db_sitelogs = ['{}:{}'.format(site, os.path.basename(logfile)) for site, logfile in db_runnights]
-    db_downloads = db.retrieve('SELECT path, site FROM Downloads')
-
-    paths_to_logs = _get_paths_to_logs(db_downloads)
-    print 'Unique sitelogs:', len(paths_to_logs.keys())
-
-    for sitelog, logs in sorted(paths_to_logs.items()):
-        if sitelog in db_sitelogs:
-            continue
-        try:
-            logs, maxcount = _filter_incomplete_logs(logs)
-        except:
-            print 'Error filtering', sitelog
-            continue
-
-        # order the logs by date of download, found in the path after 'tafd'
-        chron_logs = sorted(logs, key=lambda x: x.split('tafd')[1])
+    _migrate()
+    with db.write_session(flush_size=FLUSH_SIZE):
+        db_runnights = db.retrieve('SELECT site, logfile FROM Runnights')
+        print 'Logfiles already in database:', len(db_runnights)
+        db_sitelogs = ['{}:{}'.format(site, os.path.basename(logfile)) for site, logfile in db_runnights]
+        db_downloads = db.retrieve('SELECT path, site FROM Downloads')
+        raw_catalog.refresh_downloads(db, [path for path, site in db_downloads]) # searched for each log's CTD files
+
+        paths_to_logs = _get_paths_to_logs(db_downloads)
+        print 'Unique sitelogs:', len(paths_to_logs.keys())
+        db_sitelogs = set(db_sitelogs)
+        new_paths_to_logs = {k: v for k, v in paths_to_logs.items() if k not in db_sitelogs}
+        digests = log_ingest.ingest(db, [log for logs in new_paths_to_logs.values() for log in logs])
+        part_data = log_ingest.part_lines(db, digests)
+
+        for sitelog, logs in sorted(new_paths_to_logs.items()):
+            logs = [log for log in logs if log in part_data]
+            if not logs:
+                print 'Error reading', sitelog
+                continue
+            try:
+                logs, maxcount = _filter_incomplete_logs(logs, part_data)
+            except:
+                print 'Error filtering', sitelog
+                continue
 
-        try:
-            ctd, log, ymd = _find_ctd_and_log(chron_logs, skip=not bool(maxcount))
-        except:
-            print 'Error finding CTD:', chron_logs[0]
-
-        if ctd is not None:
-            download = ctd.split('ctd/')[0]
-        elif maxcount==0:
-            # log contains no parts
-            download = log.split('daq-ctrl')[0]
-        else:
-            print 'Error: neither empty log nor found data --', log
-            continue
+            # order the logs by date of download, found in the path after 'tafd'
+            chron_logs = sorted(logs, key=lambda x: x.split('tafd')[1])
 
-        site = int(sitelog[0])
-        runnight = (int(ymd), site, download, log)
-        db.insert_row('INSERT INTO Runnights VALUES(?, ?, ?, ?)', runnight)
+            try:
+                ctd, log, ymd = _find_ctd_and_log(chron_logs, skip=not bool(maxcount), part_data=part_data)
+            except:
+                print 'Error finding CTD:', chron_logs[0]
+
+            if ctd is not None:
+                download = ctd.split('ctd/')[0]
+            elif maxcount==0:
+                # log contains no parts
+                download = log.split('daq-ctrl')[0]
+            else:
+                print 'Error: neither empty log nor found data --', log
+                continue
+
+            site = int(sitelog[0])
+            runnight = (int(ymd), site, download, log)
+            db.insert_row('INSERT INTO Runnights VALUES(?, ?, ?, ?)', runnight)
 
 def _get_parts_by_runnight(db_parts):
     parts_by_runnight = {}
@@ -240,10 +264,13 @@ def _get_parts_by_runnight(db_parts):
 
     return parts_by_runnight
 
-def _get_parts_from_log(logfile, date, site):
+def _get_parts_from_log(logfile, date, site, partlines=None):
     parts = []
-    partlines = re.findall('.*\|.*\|.*\|.*\|', open(logfile, 'r').read())
-    for line in partlines:
+    if partlines is None:
+        partlines = log_ingest.read_part_lines(logfile)
+    for line in partlines.split('\n'):
+        if not line:
+            continue
         part_id, cameras, sigma, triggers =  [l.strip() for l in line.split('|')][:-1]
         try:
             part = int(part_id[-2:])
@@ -262,39 +289,43 @@ def _get_parts_from_log(logfile, date, site):
     return parts
 
 def find_new_parts():
+    _migrate()
     db_parts = db.retrieve('SELECT date, part, site FROM Parts')
     print 'Parts already in database:', len(db_parts)
     db_parts_by_runnight = _get_parts_by_runnight(db_parts)
 
-    db_runnights = db.retrieve('SELECT date, site, logfile FROM Runnights')
-    for date, site, logfile in db_runnights:
-        if (date, site) in db_parts_by_runnight.keys():
-            continue
-        print logfile
-        try:
-            logparts = tuple(_get_parts_from_log(logfile, date, site))
-        except:
-            print 'Error finding parts in', logfile
-            continue
-        db.insert_rows('INSERT INTO Parts VALUES(?, ?, ?, ?, ?, ?, ?)', logparts)
+    with db.write_session(flush_size=FLUSH_SIZE):
+        db_runnights = [r for r in db.retrieve('SELECT date, site, logfile FROM Runnights') if (r[0], r[1]) not in db_parts_by_runnight]
+        digests = log_ingest.ingest(db, [logfile for date, site, logfile in db_runnights])
+        part_data = log_ingest.part_lines(db, digests)
+        for date, site, logfile in db_runnights:
+            print logfile
+            try:
+                logparts = tuple(_get_parts_from_log(logfile, date, site, part_data.get(logfile)))
+            except:
+                print 'Error finding parts in', logfile
+                continue
+            db.insert_rows('INSERT INTO Parts VALUES(?, ?, ?, ?, ?, ?, ?)', logparts)
 
 def find_filesets():
-    db_filesets = db.retrieve('SELECT part11 FROM Filesets')
+    _migrate()
+    db_filesets = set(row[0] for row in db.iter_rows('SELECT part11 FROM Filesets'))
     print 'Filesets already in database:', len(db_filesets)
 
-    db_parts = db.retrieve('SELECT p.part11, p.daqsigma, p.daqtrig, r.download FROM Parts AS p JOIN Runnights AS r ON p.date=r.date AND p.site=r.site WHERE p.daqsigma=6.0 ORDER BY p.part11')
-    for part11, daqsigma, daqtrig, download in db_parts:
-        if (part11,) in db_filesets:
-            continue
-
-        ctdpath = os.path.join(download, 'ctd/event-data/')
-        daqname = 'DAQ-*{}-{}-???????.d.bz2'.format(str(part11)[4:10], part11 % 10)
-        ctd_daqs = glob(os.path.join(ctdpath, daqname))
-        if not ctd_daqs:
-            print 'No files found for {} ({}, {}) {}'.format(part11, daqsigma, daqtrig, download)
-            continue
-        ctdprefix = ctd_daqs[0][:-16]
-        fileset = (part11, ctdprefix)
-        print fileset
-        db.insert_row('INSERT INTO Filesets VALUES(?, ?)', fileset)
+    with db.write_session(flush_size=FLUSH_SIZE):
+        downloads = db.retrieve('SELECT DISTINCT r.download FROM Parts AS p JOIN Runnights AS r ON p.date=r.date AND p.site=r.site WHERE p.daqsigma=6.0 AND p.part11 NOT IN (SELECT part11 FROM Filesets)')
+        raw_catalog.refresh_downloads(db, [download for download, in downloads])
+        db_parts = db.iter_rows('SELECT p.part11, p.daqsigma, p.daqtrig, r.download FROM Parts AS p JOIN Runnights AS r ON p.date=r.date AND p.site=r.site WHERE p.daqsigma=6.0 ORDER BY p.part11')
+        for part11, daqsigma, daqtrig, download in db_parts:
+            if part11 in db_filesets:
+                continue
+
+            ctd_daqs = raw_catalog.part_ctd_files(db, download, str(part11)[4:10], part11 % 10)
+            if not ctd_daqs:
+                print 'No files found for {} ({}, {}) {}'.format(part11, daqsigma, daqtrig, download)
+                continue
+            ctdprefix = ctd_daqs[0][:-16]
+            fileset = (part11, ctdprefix)
+            print fileset
+            db.insert_row('INSERT INTO Filesets VALUES(?, ?)', fileset)
 
@@ -8,7 +8,7 @@ from database_wrapper import DatabaseWrapper
 
 from fadc_data import default_dbfile as rawdata_dbfile
 
-import utils
+import timecorr_index
 
 rawdb = DatabaseWrapper(rawdata_dbfile)
 
@@ -17,12 +17,15 @@ db = DatabaseWrapper(default_dbfile)
 
 def init(dbfile=db.db):
     from tables import fadc_process_tables
+    import migrations
     with sqlite3.connect(dbfile) as con:
         cur = con.cursor()
         for table, structure in fadc_process_tables:
             cur.execute('DROP TABLE IF EXISTS {0}'.format(table))
             cur.execute('CREATE TABLE {0}({1})'.format(table, structure))
 
+    migrations.migrate(dbfile, 'fadc_process', reset=True)
+
 def import_new_raw_parts():
     db_parts = db.retrieve('SELECT part, daqcams, daqtrig FROM Parts')
     print 'Parts already in processing DB:', len(db_parts)
@@ -58,14 +61,9 @@ def update_parts_with_ctd():
     for part, in db_parts_no_ctd:
         timecorr = _timecorr_path(part)
         try:
-            with open(timecorr, 'r') as tcfile:
-                tc = tcfile.readlines()
-                if len(tc):
-                    jstart = utils.get_jstart(timecorr, tc[0])
-                else:
-                    jstart = None
-                ctdtrigs.append((len(tc), jstart, part))
-        except IOError:
+            tc = timecorr_index.lookup(timecorr)
+            ctdtrigs.append((tc.lines, tc.jstart, part))
+        except (IOError, OSError):
             continue
         except:
             print 'Error in', timecorr
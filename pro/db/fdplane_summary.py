@@ -0,0 +1,86 @@
+# fdplane_summary.py
+# Summarize the gzipped stderr of an FDPlane run (events read per input file,
+# gzclose calls, missing calibration) in a single streaming pass, and remember
+# each summary in the status database so the same file is never decompressed twice.
+# This is what makes data_report incremental: the other probes only check whether
+# files exist, which is answered from cached directory listings (utils/dircache.py).
+
+import collections
+import gzip
+import logging
+import os
+import re
+
+
+EVENTS_READ = re.compile('(?<=Events read) *\d+')
+NOT_FOUND = 'not found in attached DST file'
+CHUNK_SIZE = 1 << 20
+
+FDPlaneSummary = collections.namedtuple('FDPlaneSummary', ['events', 'missing', 'gzclose'])
+
+
+def _scan_lines(lines, events, counts):
+    for line in lines:
+        events.extend(int(n) for n in EVENTS_READ.findall(line))
+        if NOT_FOUND in line:
+            counts['missing'] += 1
+        counts['gzclose'] += line.count('gzclose')
+
+
+def summarize(path, chunk_size=CHUNK_SIZE):
+    """
+    Read the gzipped file at path once, chunk by chunk, and return an FDPlaneSummary:
+    the list of "Events read" counts, whether any calibration was not found, and the
+    number of gzclose calls.
+    """
+    events = []
+    counts = {'missing': 0, 'gzclose': 0}
+    tail = ''
+    with gzip.open(path, 'rb') as gz:
+        while True:
+            chunk = gz.read(chunk_size)
+            if not chunk:
+                break
+            lines = (tail + chunk).split('\n')
+            tail = lines.pop()
+            _scan_lines(lines, events, counts)
+    _scan_lines([tail], events, counts)
+    return FDPlaneSummary(events, counts['missing'] > 0, counts['gzclose'])
+
+
+class SummaryCache(object):
+    """
+    Memoizes summarize() in the FDPlaneSummaries table of a status database.
+    A cached summary is used only while the file's mtime and size are unchanged,
+    and not at all with full=True. New summaries are written by save().
+    """
+    def __init__(self, db, full=False):
+        self.db = db
+        self._known = {}
+        rows = db.iter_rows('SELECT * FROM FDPlaneSummaries') if not full else []
+        for path, mtime, size, missing, gzclose, events in rows:
+            events = [int(n) for n in events.split(',')] if events else []
+            self._known[path] = ((mtime, size), FDPlaneSummary(events, bool(missing), gzclose))
+        self._pending = {}
+
+    def get(self, path):
+        st = os.stat(path)
+        signature = (st.st_mtime, st.st_size)
+        known = self._known.get(path)
+        if known is not None and known[0] == signature:
+            return known[1]
+        summary = summarize(path)
+        self._known[path] = (signature, summary)
+        self._pending[path] = signature + (int(summary.missing), summary.gzclose, ','.join(str(n) for n in summary.events))
+        return summary
+
+    def save(self):
+        if not self._pending:
+            return
+        logging.info('Caching %s FDPlane summaries', len(self._pending))
+        with self.db.write_session():
+            self.db.delete_rows('DELETE FROM FDPlaneSummaries WHERE path=?', tuple((path,) for path in self._pending))
+            self.db.insert_rows('INSERT INTO FDPlaneSummaries VALUES(?, ?, ?, ?, ?, ?)',
+                tuple((path,) + values for path, values in sorted(self._pending.items())),
+            )
+        self._pending = {}
@@ -0,0 +1,109 @@
+# log_ingest.py
+# Read DAQ log files at most once. Each log's "part" lines are extracted by a
+# linear scan, hashed, and stored in the FADC database; identical copies of a log
+# found in several downloads share one stored entry. A log whose (path, size, mtime)
+# is already recorded is never reopened.
+
+import hashlib
+import logging
+import os
+from multiprocessing import Pool
+
+import migrations
+
+DEFAULT_PROCESSES = 8
+
+
+def parse_part_lines(text):
+    """
+    Return the "part" lines of a DAQ log joined by newlines: each line with at
+    least four '|' characters, up to and including its last '|'. This gives the
+    same result as re.findall('.*\|.*\|.*\|.*\|', text) without backtracking.
+    """
+    part_lines = []
+    for line in text.split('\n'):
+        if line.count('|') >= 4:
+            part_lines.append(line[:line.rindex('|') + 1])
+    return '\n'.join(part_lines)
+
+
+def read_part_lines(path):
+    with open(path, 'r') as log:
+        return parse_part_lines(log.read())
+
+
+def _read_log(args):
+    """
+    Worker: parse one log. Return (path, size, mtime, digest, partlines), or None
+    if the file cannot be read.
+    """
+    path, size, mtime = args
+    try:
+        partlines = read_part_lines(path)
+    except IOError as err:
+        logging.error('Cannot read %s: %s', path, err)
+        return None
+    return path, size, mtime, hashlib.sha1(partlines).hexdigest(), partlines
+
+
+def ingest(db, paths, processes=DEFAULT_PROCESSES):
+    """
+    Make sure every log in paths is recorded in db, parsing new or changed ones
+    in a pool of worker processes. Return a dict of path: digest for each log
+    that could be read. The LogFiles and LogContents tables are created first if
+    db predates them.
+    """
+    migrations.migrate(db.db, 'fadc_data')
+    known = {}
+    for path, size, mtime, digest in db.iter_rows('SELECT path, size, mtime, digest FROM LogFiles'):
+        known[path] = (size, mtime, digest)
+
+    digests = {}
+    to_read = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        size, mtime, digest = known.get(path, (None, None, None))
+        if (size, mtime) == (st.st_size, st.st_mtime):
+            digests[path] = digest
+        else:
+            to_read.append((path, st.st_size, st.st_mtime))
+
+    if not to_read:
+        return digests
+
+    logging.info('Reading %s new or changed log(s)', len(to_read))
+    pool = Pool(processes)
+    try:
+        results = pool.map(_read_log, to_read, chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
+
+    known_digests = set(row[0] for row in db.iter_rows('SELECT digest FROM LogContents'))
+    with db.write_session():
+        for result in results:
+            if result is None:
+                continue
+            path, size, mtime, digest, partlines = result
+            if digest not in known_digests:
+                db.insert_row('INSERT INTO LogContents VALUES(?, ?)', (digest, partlines.decode('latin-1')))
+                known_digests.add(digest)
+            if path in known:
+                db.update_row('UPDATE LogFiles SET size=?, mtime=?, digest=? WHERE path=?', (size, mtime, digest, path))
+            else:
+                db.insert_row('INSERT INTO LogFiles VALUES(?, ?, ?, ?)', (path, size, mtime, digest))
+            digests[path] = digest
+    return digests
+
+
+def part_lines(db, digests):
+    """
+    Given a dict of path: digest as returned by ingest, return a dict of path: partlines.
+    """
+    contents = {}
+    for digest in set(digests.values()):
+        contents[digest] = db.retrieve('SELECT partlines FROM LogContents WHERE digest=?', (digest,))[0][0]
+    return {path: contents[digest] for path, digest in digests.items()}
@@ -0,0 +1,120 @@
+# migrations.py
+# Versioned schema changes for the FADC and status databases, applied in place
+# so that existing data is kept. The version of each database file is stored
+# in its PRAGMA user_version.
+
+import logging
+import sqlite3
+
+from tables import fadc_indexes, fadc_process_indexes, fd_daq_indexes
+from tables import fadc_catalog_tables, fadc_catalog_indexes, fadc_log_tables, fadc_daq_log_tables, fadc_daq_log_indexes
+from tables import fd_daq_ledger_tables, fd_daq_fdplane_tables, fadc_timecorr_tables, fadc_dst_verdict_tables
+from tables import job_ledger_tables, job_ledger_indexes, job_metrics_tables, job_metrics_indexes
+from tables import staging_tables, staging_indexes
+
+
+def _create_indexes(indexes):
+    return ['CREATE INDEX IF NOT EXISTS {0} ON {1}'.format(name, on) for name, on in indexes]
+
+
+def _create_tables(tables):
+    return ['CREATE TABLE IF NOT EXISTS {0}({1})'.format(table, structure) for table, structure in tables]
+
+
+# For each kind of database, a list of (version, statements) in ascending order.
+migrations = {
+    'fadc_data': [
+        (1, _create_indexes(fadc_indexes)),
+        (2, _create_tables(fadc_catalog_tables) + _create_indexes(fadc_catalog_indexes)),
+        (3, _create_tables(fadc_log_tables)),
+        (4, _create_tables(fadc_daq_log_tables) + _create_indexes(fadc_daq_log_indexes)),
+    ],
+    'fadc_process': [
+        (1, _create_indexes(fadc_process_indexes)),
+        (2, _create_tables(fadc_timecorr_tables)),
+        (3, _create_tables(fadc_dst_verdict_tables)),
+    ],
+    'tafd_status': [
+        (1, _create_indexes(fd_daq_indexes)),
+        (2, _create_tables(fd_daq_ledger_tables)),
+        (3, _create_tables(fd_daq_fdplane_tables)),
+        (4, ['ALTER TABLE ProbeLedger ADD COLUMN outcome INTEGER']),
+        (5, ['DROP TABLE IF EXISTS ProbeLedger']), # FDPlaneSummaries does its job
+    ],
+    'job_ledger': [
+        (1, _create_tables(job_ledger_tables) + _create_indexes(job_ledger_indexes)),
+        (2, ['ALTER TABLE Jobs ADD COLUMN executable TEXT', 'ALTER TABLE Jobs ADD COLUMN input_size INTEGER']),
+        (3, ['ALTER TABLE Jobs ADD COLUMN units INTEGER']),
+    ],
+    'job_metrics': [
+        (1, _create_tables(job_metrics_tables) + _create_indexes(job_metrics_indexes)),
+        (2, ['ALTER TABLE JobMetrics ADD COLUMN units INTEGER']),
+    ],
+    'staging': [
+        (1, _create_tables(staging_tables) + _create_indexes(staging_indexes)),
+    ],
+}
+
+
+def latest_version(kind):
+    return migrations[kind][-1][0]
+
+
+def get_version(dbfile):
+    with sqlite3.connect(dbfile) as con:
+        return con.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(dbfile, kind, reset=False):
+    """
+    Bring the database at dbfile up to the latest version for its kind
+    ('fadc_data', 'fadc_process', 'tafd_status', 'job_ledger', 'job_metrics',
+    or 'staging'). Each version is applied in
+    its own transaction along with the version number, so an interrupted
+    migration resumes where it stopped. Use reset=True after re-creating the
+    tables, to apply every version again. Return the final version.
+    """
+    con = sqlite3.connect(dbfile)
+    con.isolation_level = None
+    try:
+        if reset:
+            con.execute('PRAGMA user_version = 0')
+        version = con.execute('PRAGMA user_version').fetchone()[0]
+        for new_version, statements in migrations[kind]:
+            if new_version <= version:
+                continue
+            logging.info('Migrating %s (%s) from version %s to %s', dbfile, kind, version, new_version)
+            con.execute('BEGIN')
+            try:
+                for sql in statements:
+                    con.execute(sql)
+                con.execute('PRAGMA user_version = {0}'.format(new_version))
+            except:
+                con.execute('ROLLBACK')
+                raise
+            con.execute('COMMIT')
+            version = new_version
+        return version
+    finally:
+        con.close()
+
+
+def uses_index(plan, index=None):
+    """
+    Given rows from DatabaseWrapper.explain, report whether the query uses the
+    named index; with no name, whether no table is read by a full scan.
+    """
+    details = [row[-1] for row in plan]
+    if index is not None:
+        return any(index in d for d in details)
+    scans = [d for d in details if d.upper().startswith('SCAN') and 'INDEX' not in d.upper()]
+    return not scans
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dbfile')
+    parser.add_argument('kind', choices=sorted(migrations.keys()))
+    args = parser.parse_args()
+    print 'Version:', migrate(args.dbfile, args.kind)
@@ -0,0 +1,107 @@
+# profiler.py
+# Record the time spent in each SQL statement run through DatabaseWrapper,
+# log statements slower than a threshold, and summarize at process exit.
+
+import atexit
+import logging
+import os
+import sys
+
+from database_wrapper import DatabaseWrapper
+
+# frames from these files are skipped when looking for the caller of a query
+_INTERNAL_FILES = ('database_wrapper.py', 'profiler.py', 'contextlib.py')
+
+
+def _call_site():
+    """
+    Return 'file:line (function)' for the first frame outside the database wrapper.
+    Frames are walked directly, without reading any source lines, since this runs
+    for every statement.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        if filename not in _INTERNAL_FILES:
+            return '{}:{} ({})'.format(filename, frame.f_lineno, code.co_name)
+        frame = frame.f_back
+    return 'unknown'
+
+
+class QueryStats(object):
+    def __init__(self, sql):
+        self.sql = sql
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.call_sites = set()
+
+    def add(self, seconds, rows, call_site):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += rows
+        self.call_sites.add(call_site)
+
+
+class QueryProfiler(object):
+    """
+    Collects QueryStats for every distinct SQL statement. If slow_threshold
+    (in seconds) is given, each statement taking at least that long is also
+    logged as it happens.
+    """
+    def __init__(self, slow_threshold=None):
+        self.slow_threshold = slow_threshold
+        self.stats = {}
+
+    def record(self, db, sql, seconds, rows):
+        call_site = _call_site()
+        try:
+            stats = self.stats[sql]
+        except KeyError:
+            stats = self.stats[sql] = QueryStats(sql)
+        stats.add(seconds, rows, call_site)
+
+        if self.slow_threshold is not None and seconds >= self.slow_threshold:
+            logging.warn('Slow query: %.3f s, %s row(s), %s at %s: %s',
+                seconds, rows, os.path.basename(db), call_site, sql,
+            )
+
+    def summary(self, limit=20):
+        """
+        Return the most expensive statements by total time, as lines of text.
+        """
+        ranked = sorted(self.stats.values(), key=lambda s: s.seconds, reverse=True)
+        total = sum([s.seconds for s in ranked])
+        lines = ['{} statement(s), {} call(s), {:.3f} s total'.format(
+            len(ranked), sum([s.calls for s in ranked]), total,
+        )]
+        for s in ranked[:limit]:
+            lines.append('{:9.3f} s {:6} call(s) max {:.3f} s {:8} row(s) {}'.format(
+                s.seconds, s.calls, s.max_seconds, s.rows, s.sql,
+            ))
+            lines.append('            from ' + ', '.join(sorted(s.call_sites)))
+        return lines
+
+    def log_summary(self, limit=20):
+        if not self.stats:
+            return
+        logging.info('SQL profile:\n%s', '\n'.join(self.summary(limit)))
+
+
+def enable(slow_threshold=None, summary_at_exit=True):
+    """
+    Start profiling all DatabaseWrapper queries in this process and return
+    the profiler. The summary is logged at exit unless summary_at_exit is False.
+    """
+    profiler = QueryProfiler(slow_threshold)
+    DatabaseWrapper.profiler = profiler
+    if summary_at_exit:
+        atexit.register(profiler.log_summary)
+    return profiler
+
+
+def disable():
+    DatabaseWrapper.profiler = None
@@ -0,0 +1,245 @@
+# raw_catalog.py
+# Catalog of the raw FADC files (CTD and camera .d.bz2) on every /tadserv* volume,
+# stored in the RawFiles table of the FADC database so that part and fileset
+# lookups are indexed queries instead of wildcard searches over the network.
+#
+# The catalog is built by one parallel walk of the event-data directories and
+# refreshed incrementally: a directory is only re-listed if its mtime changed.
+# Lookups in particular downloads refresh those first (refresh_downloads); a
+# reader that must not write can ask which directories are stale (stale_dirs).
+# The DAQ logs in each download's daq-ctrl directory are cataloged the same way.
+
+import fnmatch
+import logging
+import os
+import re
+from glob import glob
+from multiprocessing.pool import ThreadPool
+
+VOLUMES = '/tadserv*/tafd/'
+DEFAULT_WORKERS = 16
+
+# DAQ-yymmddpp-s-tttttt.d.bz2 (CTD) or DAQ-yymmddpp-s-c-ttttttt.d.bz2 (camera c, in hex);
+# files from 2007 may have a shorter date code.
+RAW_FILE = re.compile('^DAQ-(\d+)-(\d)-(?:([0-9a-f])-)?(\d{7})\.d\.bz2$')
+EVENT_DIR = re.compile('^(ctd|camera\d{2})$')
+LOG_DIR = 'daq-ctrl'
+LOG_FILES = ['y*_*.log', '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9].log']
+
+
+def _download_event_dirs(download):
+    """
+    Return (event_dir, download) for the CTD and camera event-data directories of one
+    download (a directory like /tadservN/tafd/*/*/ containing ctd/), or none if it
+    cannot be listed.
+    """
+    try:
+        names = sorted(os.listdir(download))
+    except OSError:
+        return []
+    return [(os.path.join(download, name, 'event-data'), download) for name in names if EVENT_DIR.match(name)]
+
+
+def _find_event_dirs(volumes=VOLUMES):
+    """
+    Return (event_dir, download) for the CTD and camera event-data directories
+    of every download.
+    """
+    event_dirs = []
+    for ctd in sorted(glob(os.path.join(volumes, '*/*/ctd/'))):
+        event_dirs += _download_event_dirs(ctd[:-4]) # truncate "ctd/"
+    return event_dirs
+
+
+def _scan_dir(args):
+    """
+    Worker: list one event-data directory unless its mtime matches known_mtime.
+    Return (path, download, mtime, rows), with rows None if the directory was
+    unchanged or cannot be read.
+    """
+    path, download, known_mtime = args
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return path, download, known_mtime, None
+    if mtime == known_mtime:
+        return path, download, mtime, None
+
+    volume = path.split(os.path.sep)[1]
+    rows = []
+    for name in os.listdir(path):
+        m = RAW_FILE.match(name)
+        if not m:
+            continue
+        daqcode, site, camera, trigset = m.groups()
+        full_path = os.path.join(path, name)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            continue
+        rows.append((
+            full_path, volume, download, daqcode, daqcode[-6:], int(site),
+            int(camera, 16) if camera is not None else None,
+            int(trigset), st.st_size, st.st_mtime,
+        ))
+    return path, download, mtime, rows
+
+
+def _scan_log_dir(args):
+    """
+    Worker: like _scan_dir, for a daq-ctrl directory; rows are (path, download) of its logs.
+    """
+    path, download, known_mtime = args
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return path, download, known_mtime, None
+    if mtime == known_mtime:
+        return path, download, mtime, None
+    names = [name for name in os.listdir(path) if any(fnmatch.fnmatch(name, pattern) for pattern in LOG_FILES)]
+    return path, download, mtime, [(os.path.join(path, name), download) for name in names]
+
+
+def _rescan(db, dirs, workers, scan=_scan_dir, table='RawFiles'):
+    """
+    Re-list, in parallel, those of dirs (directory, download) whose mtime differs
+    from the catalog's, replacing their entries in table with the rows from scan.
+    Return how many were re-listed.
+    """
+    known = dict(db.retrieve('SELECT path, mtime FROM RawDirs'))
+    pool = ThreadPool(workers)
+    rescanned = 0
+    try:
+        with db.write_session():
+            jobs = [(path, download, known.get(path)) for path, download in dirs]
+            for path, download, mtime, rows in pool.imap_unordered(scan, jobs):
+                if rows is None:
+                    continue
+                rescanned += 1
+                db.delete_rows('DELETE FROM {} WHERE path GLOB ?'.format(table), ((path + '/*',),))
+                if rows:
+                    db.insert_rows('INSERT INTO {} VALUES({})'.format(table, ', '.join(['?'] * len(rows[0]))), tuple(rows))
+                db.delete_rows('DELETE FROM RawDirs WHERE path=?', ((path,),))
+                db.insert_row('INSERT INTO RawDirs VALUES(?, ?, ?)', (path, download, mtime))
+    finally:
+        pool.close()
+        pool.join()
+    return rescanned
+
+
+def refresh(db, volumes=VOLUMES, workers=DEFAULT_WORKERS):
+    """
+    Walk all event-data directories in parallel and bring the catalog in db up
+    to date, re-listing only directories whose mtime changed. Directories that
+    cannot be reached (e.g. a volume down for maintenance) keep their old entries.
+    Return the number of directories re-listed.
+    """
+    event_dirs = _find_event_dirs(volumes)
+    logging.info('Raw catalog: %s event-data directories', len(event_dirs))
+    rescanned = _rescan(db, event_dirs, workers)
+    logging.info('Raw catalog: re-listed %s directories', rescanned)
+    return rescanned
+
+
+def refresh_downloads(db, downloads, workers=DEFAULT_WORKERS):
+    """
+    Like refresh, but only for the event-data directories of the given downloads,
+    so that a lookup in them cannot miss files added or replaced since the last
+    full refresh. Each directory is only stat'ed unless it changed.
+    """
+    event_dirs = []
+    for download in sorted(set(downloads)):
+        event_dirs += _download_event_dirs(download)
+    rescanned = _rescan(db, event_dirs, workers)
+    if rescanned:
+        logging.info('Raw catalog: re-listed %s directories of %s download(s)', rescanned, len(set(downloads)))
+    return rescanned
+
+
+def refresh_logs(db, downloads, workers=DEFAULT_WORKERS):
+    """
+    Bring the catalog of DAQ logs up to date for the given downloads, re-listing
+    only the daq-ctrl directories whose mtime changed. Return how many were re-listed.
+    """
+    dirs = [(os.path.join(download, LOG_DIR), download) for download in sorted(set(downloads))]
+    rescanned = _rescan(db, dirs, workers, scan=_scan_log_dir, table='DaqLogs')
+    logging.info('Log catalog: %s daq-ctrl directories, re-listed %s', len(dirs), rescanned)
+    return rescanned
+
+
+def log_files(db, download):
+    """
+    Return the paths of the DAQ logs in a download, in order.
+    """
+    return [row[0] for row in db.retrieve('SELECT path FROM DaqLogs WHERE download=? ORDER BY path', (download,))]
+
+
+def stale_dirs(db, downloads):
+    """
+    Return the event-data directories of the given downloads that are missing from
+    the catalog or have changed since they were listed, without updating it.
+    """
+    known = dict(db.retrieve('SELECT path, mtime FROM RawDirs'))
+    stale = []
+    for download in sorted(set(downloads)):
+        for path, _ in _download_event_dirs(download):
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if known.get(path) != mtime:
+                stale.append(path)
+    return stale
+
+
+def downloads(db):
+    """
+    Return (download, site) for every download known to the catalog.
+    """
+    rows = db.retrieve("SELECT DISTINCT download FROM RawDirs WHERE path GLOB '*/ctd/event-data' ORDER BY download")
+    return [(d, int(d.split('station')[1][0])) for d, in rows] # path contains "station0" or "station1"
+
+
+def ctd_files(db, daqcode_glob, site=None, download=None):
+    """
+    Return paths of CTD files whose DAQ code matches daqcode_glob (e.g. '080709??'),
+    optionally restricted to one site and/or download.
+    """
+    sql = 'SELECT path FROM RawFiles WHERE camera IS NULL AND daqcode GLOB ?'
+    params = (daqcode_glob,)
+    if site is not None:
+        sql += ' AND site=?'
+        params += (int(site),)
+    if download is not None:
+        sql += ' AND download=?'
+        params += (download,)
+    return [row[0] for row in db.retrieve(sql + ' ORDER BY path', params)]
+
+
+def part_ctd_files(db, download, mmddpp, site):
+    """
+    Return paths of the CTD files in a download for one part, given by the last six
+    digits of its DAQ code and its site, in order of trigset.
+    """
+    sql = 'SELECT path FROM RawFiles WHERE download=? AND mmddpp=? AND site=? AND camera IS NULL ORDER BY trigset'
+    return [row[0] for row in db.retrieve(sql, (download, mmddpp, int(site)))]
+
+
+def part_raw_files(db, download, mmddpp, site):
+    """
+    Return (path, size) of every raw file, CTD and camera, in a download for one part.
+    """
+    sql = 'SELECT path, size FROM RawFiles WHERE download=? AND mmddpp=? AND site=? ORDER BY trigset, camera'
+    return db.retrieve(sql, (download, mmddpp, int(site)))
+
+
+def part_raw_sizes(db, download, mmddpp, site):
+    """
+    Return {trigset: (CTD bytes, camera bytes)} of the raw files in a download for one part.
+    """
+    sql = 'SELECT trigset, camera IS NULL, sum(size) FROM RawFiles WHERE download=? AND mmddpp=? AND site=? GROUP BY trigset, camera IS NULL'
+    sizes = {}
+    for trigset, is_ctd, size in db.retrieve(sql, (download, mmddpp, int(site))):
+        ctd, camera = sizes.get(trigset, (0, 0))
+        sizes[trigset] = (ctd + (size or 0), camera) if is_ctd else (ctd, camera + (size or 0))
+    return sizes
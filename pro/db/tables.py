@@ -52,3 +52,108 @@ fd_daq_tables = [
 
     ('PartStatus', 'part11 PRIMARY KEY, date INTEGER REFERENCES Dates, part INTEGER, site INTEGER REFERENCES Sites, status INTEGER NOT NULL'),
 ]
+
+# Secondary indexes, as (name, table(columns)). These are created on existing
+# databases by the versioned migrations in migrations.py.
+fadc_indexes = [
+    ('Parts_date_site', 'Parts(date, site)'),
+    ('Parts_daqsigma', 'Parts(daqsigma)'),
+    ('Filesets_part11', 'Filesets(part11)'),
+]
+
+fadc_process_indexes = [
+    ('Parts_ctdtrig', 'Parts(ctdtrig)'),
+    ('Parts_dsttrig', 'Parts(dsttrig)'),
+]
+
+fd_daq_indexes = [
+    ('PartStatus_status', 'PartStatus(status)'),
+    ('NightStatus_status_site', 'NightStatus(status, site)'),
+    ('NightStatus_date_site', 'NightStatus(date, site)'),
+]
+
+# Catalog of raw CTD and camera files on /tadserv*, maintained by raw_catalog.py.
+# camera is NULL for CTD files; mmddpp is the last six digits of daqcode.
+fadc_catalog_tables = [
+    ('RawDirs', 'path TEXT PRIMARY KEY, download TEXT, mtime REAL'),
+
+    ('RawFiles', 'path TEXT PRIMARY KEY, volume TEXT, download TEXT, daqcode TEXT, mmddpp TEXT, site INTEGER, camera INTEGER, trigset INTEGER, size INTEGER, mtime REAL'),
+]
+
+fadc_catalog_indexes = [
+    ('RawFiles_daqcode_site', 'RawFiles(daqcode, site)'),
+    ('RawFiles_download_mmddpp_site', 'RawFiles(download, mmddpp, site)'),
+]
+
+# DAQ logs in each download's daq-ctrl directory, also maintained by raw_catalog.py
+# (the directory's mtime is kept in RawDirs alongside those of the event-data directories).
+fadc_daq_log_tables = [
+    ('DaqLogs', 'path TEXT PRIMARY KEY, download TEXT'),
+]
+
+fadc_daq_log_indexes = [
+    ('DaqLogs_download', 'DaqLogs(download)'),
+]
+
+# DAQ logs already read by log_ingest.py: every copy of a log by path, and the
+# "part" lines of each distinct log content, keyed by their SHA-1 digest.
+fadc_log_tables = [
+    ('LogFiles', 'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT'),
+
+    ('LogContents', 'digest TEXT PRIMARY KEY, partlines TEXT'),
+]
+
+# Formerly the last-seen state of each file examined by data_report; created by an early
+# tafd_status migration and dropped by a later one (FDPlaneSummaries is what saves the re-reads).
+fd_daq_ledger_tables = [
+    ('ProbeLedger', 'path TEXT PRIMARY KEY, part11 INTEGER, mtime REAL, size INTEGER, checked REAL'),
+]
+
+# What data_report needs from each FDPlane stderr file, keyed by the file's state when it was read.
+fd_daq_fdplane_tables = [
+    ('FDPlaneSummaries', 'path TEXT PRIMARY KEY, mtime REAL, size INTEGER, missing INTEGER, gzclose INTEGER, events TEXT'),
+]
+
+# Summary of each timecorr file (one line per CTD trigger), keyed by the file's state when it was read.
+fadc_timecorr_tables = [
+    ('TimecorrIndex', 'path TEXT PRIMARY KEY, part11 INTEGER, mtime REAL, size INTEGER, lines INTEGER, first_time REAL, last_time REAL, jstart REAL'),
+]
+
+# Verdict on each TAMA DST, from its prolog and stdout, kept until any of the three files changes.
+# state holds the (size, mtime) of the DST, prolog and stdout files as JSON. expected is no longer
+# written (NULL): the expected trigger count is compared when a verdict is read.
+fadc_dst_verdict_tables = [
+    ('DstVerdicts', 'dst TEXT PRIMARY KEY, state TEXT, expected INTEGER, ok INTEGER, reason TEXT, tama_read INTEGER, tama_kept INTEGER, bytes_out INTEGER, triggers INTEGER, trigger_seconds REAL, stdout_seconds REAL, checked REAL'),
+]
+
+# Batch jobs submitted through services/jobs/tracker.py, and their exit status once known.
+job_ledger_tables = [
+    ('Jobs', 'job_id TEXT PRIMARY KEY, tag, cmd TEXT, submitted REAL, finished REAL, returncode INTEGER'),
+]
+
+job_ledger_indexes = [
+    ('Jobs_finished', 'Jobs(finished)'),
+]
+
+# Raw FADC files copied to the staging area by prep_fadc/staging.py, and when each night was last needed.
+staging_tables = [
+    ('StagedNights', 'night INTEGER PRIMARY KEY, last_used REAL'),
+
+    ('StagedFiles', 'source TEXT PRIMARY KEY, path TEXT, night INTEGER REFERENCES StagedNights, size INTEGER, checksum TEXT, staged REAL'),
+]
+
+staging_indexes = [
+    ('StagedFiles_night', 'StagedFiles(night)'),
+    ('StagedNights_last_used', 'StagedNights(last_used)'),
+]
+
+# Resources used by each measured job (see services/jobs/measure.py), shared by all runs.
+# size_class is the base-2 logarithm of input_size, rounded down. A units column (added
+# by migration) counts the like runs a job made, e.g. TAMA trigsets; NULL means one.
+job_metrics_tables = [
+    ('JobMetrics', 'job_id TEXT, executable TEXT, input_size INTEGER, size_class INTEGER, wall REAL, cpu REAL, maxrss_kb INTEGER, returncode INTEGER, finished REAL'),
+]
+
+job_metrics_indexes = [
+    ('JobMetrics_executable_class', 'JobMetrics(executable, size_class, finished)'),
+]
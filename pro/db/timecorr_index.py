@@ -0,0 +1,92 @@
+# timecorr_index.py
+# Trigger count, first and last trigger time, and jstart of each timecorr file,
+# counted once with a buffered read and kept in the processing database until
+# the file's mtime or size changes.
+
+import collections
+import logging
+import os
+
+from database_wrapper import DatabaseWrapper
+import migrations
+import utils
+
+
+default_dbfile = 'db/fadc_process.db'
+CHUNK_SIZE = 1 << 20
+
+TimecorrEntry = collections.namedtuple('TimecorrEntry', ['lines', 'first_time', 'last_time', 'jstart'])
+
+
+def _trigger_time(line):
+    """
+    Seconds after midnight of the trigger on a timecorr line (fields 2-5 are hh mm ss ns).
+    """
+    hh, mm, ss, ns = [int(t) for t in line.split()[2:6]]
+    return hh * 3600 + mm * 60 + ss + ns * 1e-9
+
+
+def scan(path, chunk_size=CHUNK_SIZE):
+    """
+    Read the timecorr file at path in fixed-size chunks and return a TimecorrEntry.
+    An empty file has no first/last time or jstart.
+    """
+    lines = 0
+    head = ''
+    tail = ''
+    with open(path, 'rb') as tc:
+        while True:
+            chunk = tc.read(chunk_size)
+            if not chunk:
+                break
+            lines += chunk.count('\n')
+            if '\n' not in head:
+                head += chunk
+            tail += chunk
+            cut = tail.rfind('\n', 0, len(tail) - 1)
+            if cut >= 0:
+                tail = tail[cut + 1:]
+    if tail and not tail.endswith('\n'):
+        lines += 1
+    if not lines:
+        return TimecorrEntry(0, None, None, None)
+    first = head.split('\n', 1)[0]
+    last = tail.rstrip('\n').rsplit('\n', 1)[-1]
+    return TimecorrEntry(lines, _trigger_time(first), _trigger_time(last), utils.get_jstart(path, first))
+
+
+class TimecorrIndex(object):
+    """
+    Cache of scan() results in the TimecorrIndex table of dbfile.
+    lookup() raises OSError if the timecorr file does not exist.
+    """
+    def __init__(self, dbfile=default_dbfile):
+        migrations.migrate(dbfile, 'fadc_process')
+        self.db = DatabaseWrapper(dbfile)
+
+    def lookup(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        rows = self.db.retrieve('SELECT mtime, size, lines, first_time, last_time, jstart FROM TimecorrIndex WHERE path=?', (path,))
+        if rows and tuple(rows[0][:2]) == (st.st_mtime, st.st_size):
+            return TimecorrEntry(*rows[0][2:])
+        logging.info('Indexing %s', path)
+        entry = scan(path)
+        part11 = ''.join([c for c in os.path.basename(path) if c.isdigit()])
+        with self.db.write_session():
+            self.db.delete_rows('DELETE FROM TimecorrIndex WHERE path=?', ((path,),))
+            self.db.insert_row('INSERT INTO TimecorrIndex VALUES(?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, int(part11), st.st_mtime, st.st_size) + tuple(entry))
+        return entry
+
+
+_default_index = None
+
+def lookup(path):
+    """
+    TimecorrIndex.lookup using the default processing database.
+    """
+    global _default_index
+    if _default_index is None:
+        _default_index = TimecorrIndex()
+    return _default_index.lookup(path)
@@ -0,0 +1,142 @@
+# writer.py
+# A single writer for an SQLite database shared by concurrent workers. Writes are
+# queued to one thread that owns the only write connection and applies them in
+# batched transactions, so that workers never contend for the write lock.
+
+import logging
+import Queue
+import threading
+import time
+
+from database_wrapper import DatabaseWrapper, DEFAULT_FLUSH_SIZE
+
+# seconds to keep collecting queued writes into the current batch
+DEFAULT_MAX_DELAY = 0.2
+
+_STOP = object()
+
+
+class WriteFuture(object):
+    """
+    The outcome of one queued write, available once the writer has committed it.
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._error = None
+
+    def _set(self, error=None):
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Block until the write has been applied; re-raise its error, if any.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for database write')
+        if self._error is not None:
+            raise self._error
+
+
+class DatabaseWriter(object):
+    """
+    Owns the write connection to dbfile in a background thread. insert_row,
+    insert_rows, update_row and update_rows take the same arguments as the
+    DatabaseWrapper methods, queue the write, and return a WriteFuture.
+    Writes arriving within max_delay of each other are committed together,
+    up to batch_size at a time.
+
+    Use as a context manager, or call close(), to flush the queue and stop:
+
+        with DatabaseWriter(dbfile) as writer:
+            writer.insert_row(sql, values)
+    """
+    def __init__(self, dbfile, batch_size=DEFAULT_FLUSH_SIZE, max_delay=DEFAULT_MAX_DELAY, journal_mode=None):
+        self.dbfile = dbfile
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.journal_mode = journal_mode
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='DatabaseWriter({})'.format(dbfile))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _submit(self, method, sql, values):
+        future = WriteFuture()
+        self._queue.put((method, sql, values, future))
+        return future
+
+    def insert_row(self, sql, values):
+        return self._submit('insert_row', sql, values)
+
+    def insert_rows(self, sql, all_values):
+        return self._submit('insert_rows', sql, all_values)
+
+    def update_row(self, sql, values):
+        return self._submit('update_row', sql, values)
+
+    def update_rows(self, sql, all_values):
+        return self._submit('update_rows', sql, all_values)
+
+    def _next_batch(self):
+        """
+        Wait for one queued write, then gather whatever else arrives within
+        max_delay. Return the batch and whether a stop was requested.
+        """
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.time() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        db = DatabaseWrapper(self.dbfile)
+        with db:
+            stop = False
+            while not stop:
+                batch, stop = self._next_batch()
+                if not batch:
+                    continue
+                done = []
+                try:
+                    with db.write_session(flush_size=self.batch_size, journal_mode=self.journal_mode):
+                        for method, sql, values, future in batch:
+                            try:
+                                getattr(db, method)(sql, values)
+                                done.append((future, None))
+                            except Exception as err:
+                                logging.error('Write failed (%s): %s %s', err, sql, values)
+                                done.append((future, err))
+                except Exception as err:
+                    logging.error('Commit of %s write(s) failed: %s', len(batch), err)
+                    done = [(future, err) for _, _, _, future in batch]
+                # report success only once the batch has been committed
+                for future, error in done:
+                    future._set(error)
+
+    def close(self):
+        """
+        Apply every write queued so far, then stop the writer thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,6 +1,8 @@
 import argparse
 import logging
 
+from db import profiler
+from services.jobs import get_executor
 from services.stereo_run import StereoRun, DEFAULT_DATE_LIST_FILE
 from step import Step, STEPS
 from utils import log
@@ -15,6 +17,10 @@ def make_stereo_happen(
         end=None,
         geo=None,
         salt_overrides=None,
+        executor=None,
+        follow=False,
+        tama_batch=None,
+        staging=False,
     ):
     log_name = log.set_up_log(console_mirror=console_mirror)
     if not console_mirror:
@@ -24,7 +30,7 @@ def make_stereo_happen(
 
     run = StereoRun(name, model, source, geo, salt_overrides)
     run.prepare_stereo_run()
-    run.stereo_run(date_list, begin, end)
+    run.stereo_run(date_list, begin, end, executor=executor, follow=follow, tama_batch=tama_batch, staging=staging)
 
     return run
 
@@ -42,7 +48,17 @@ if __name__ == '__main__':
     parser.add_argument('--override_salt_geocal', default=None)
     parser.add_argument('--override_salt_model', default=None)
     parser.add_argument('--override_salt_source', default=None)
+    parser.add_argument('--executor', choices=['mosix', 'local'], default='mosix', help='where to run batch jobs')
+    parser.add_argument('--workers', type=int, default=None, help='jobs at once for --executor=local (default: one per CPU)')
+    parser.add_argument('--follow', action='store_true', help='keep running until all submitted jobs finish, resuming each night as its jobs complete')
+    parser.add_argument('--tama-batch', type=int, default=None, help='consecutive TAMA trigsets to run in one job')
+    parser.add_argument('--tama-seconds', type=float, default=None, help='CPU-seconds budget per TAMA job, instead of --tama-batch')
+    parser.add_argument('--stage', action='store_true', help='copy raw FADC files to local scratch ahead of the TAMA jobs that read them')
+    parser.add_argument('--profile', action='store_true', help='log a summary of time spent per SQL statement')
+    parser.add_argument('--slow', type=float, default=None, help='log each SQL statement taking at least this many seconds')
     args = parser.parse_args()
+    if args.profile or args.slow is not None:
+        profiler.enable(slow_threshold=args.slow, summary_at_exit=args.profile)
     for step in [args.begin, args.end]:
         if step is not None:
             assert step in Step.names.keys()
@@ -52,6 +68,8 @@ if __name__ == '__main__':
         'lr': args.geolr,
         'md': args.geomd,
     }
+    executor_options = {'workers': args.workers} if args.executor == 'local' else {}
+    executor = get_executor(args.executor, **executor_options)
     salt_overrides = {
         'geocal': args.override_salt_geocal,
         'model': args.override_salt_model,
@@ -67,4 +85,8 @@ if __name__ == '__main__':
         end=args.end,
         geo=geo,
         salt_overrides=salt_overrides,
+        executor=executor,
+        follow=args.follow,
+        tama_batch={'trigsets': args.tama_batch, 'seconds': args.tama_seconds},
+        staging=args.stage,
     )
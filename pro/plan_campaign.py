@@ -0,0 +1,209 @@
+# plan_campaign.py
+# Plan a reprocessing campaign before launching it: enumerate every timecorr, TAMA
+# and FDPED job still to be done for a range of nights, estimate its CPU time, wall
+# time and bytes read from the job metrics history and the raw file catalog, and
+# write the jobs as a work list in dependency order, each with its expected start
+# and finish when run with a given number of jobs at once.
+
+import argparse
+import heapq
+import json
+import logging
+import os
+import sys
+from glob import glob
+
+from db import migrations, raw_catalog, timecorr_index
+from db.database_wrapper import DatabaseWrapper
+from prep_fadc import raw_to_dst
+from prep_fdped import _fdped_part_file, _files as _fdped_files
+from services.jobs.metrics import JobMetrics, METRICS_DB
+from utils import log, _timecorr_path, _camlist
+
+FADC_DB = 'db/fadc_data.db'
+
+# Executables as named in the metrics history, and their running time in seconds
+# when there is no history yet (TAMA's is per trigset).
+TIMECORR = 'getTimeTable.run'
+TAMA = raw_to_dst.tama_executable
+FDPED = 'fdped.run'
+DEFAULT_SECONDS = {TIMECORR: 120.0, TAMA: raw_to_dst.default_tama_seconds_per_trigset, FDPED: 600.0}
+DEFAULT_MEMORY_MB = {TIMECORR: 256, TAMA: 3072, FDPED: 1024}
+
+
+class Planner(object):
+    """
+    Builds the work list. Each job is a dict with its id, kind, night, part,
+    trigsets (TAMA only), the ids it depends on, and its estimates: cpu and wall
+    (seconds), bytes_in, memory_mb, and whether they come from history.
+    """
+    def __init__(self, fadc_db=FADC_DB, metrics=None, batch=None):
+        migrations.migrate(fadc_db, 'fadc_data') # for the raw-file catalog
+        self.db = DatabaseWrapper(fadc_db)
+        self.metrics = metrics or JobMetrics()
+        self.batch_size = raw_to_dst.tama_batch_size(batch, self.metrics)
+        self.jobs = []
+
+    def _estimate(self, job, executable, input_size, scale=1):
+        """
+        Fill in cpu, wall and memory_mb of job, which runs executable scale times
+        (e.g. on that many TAMA trigsets), from past runs of it, or from the defaults
+        without any.
+        """
+        typical = self.metrics.typical(executable, input_size)
+        if typical is None:
+            job['wall'] = job['cpu'] = DEFAULT_SECONDS[executable] * scale
+            job['from_history'] = False
+        else:
+            job['wall'], job['cpu'] = typical[0] * scale, typical[1] * scale
+            job['from_history'] = True
+        job['memory_mb'] = self.metrics.suggest_memory_mb(executable, input_size, default=DEFAULT_MEMORY_MB[executable])
+        job['input_size'] = input_size
+
+    def _add(self, kind, night, part, depends_on=(), **fields):
+        job = {'id': '{}-{}'.format(kind, part), 'kind': kind, 'night': night, 'part': part, 'depends_on': list(depends_on)}
+        job.update(fields)
+        self.jobs.append(job)
+        return job
+
+    def plan(self, first, last):
+        """
+        Enumerate the pending jobs of every part of the nights first to last (yyyymmdd).
+        """
+        parts = self.db.retrieve(
+            'SELECT p.part11, p.date, p.daqtrig, p.daqcams, f.ctdprefix FROM Parts AS p JOIN Filesets AS f ON p.part11=f.part11 WHERE p.date BETWEEN ? AND ? ORDER BY p.date, p.part11',
+            (first, last),
+        )
+        logging.info('Planning %s parts from %s to %s', len(parts), first, last)
+        self._check_catalog(set(raw_to_dst._download(ctdprefix) for part, night, daqtrig, daqcams, ctdprefix in parts))
+        for part, night, daqtrig, daqcams, ctdprefix in parts:
+            self._plan_part(part, night, daqtrig, daqcams, ctdprefix)
+        return self.jobs
+
+    def _check_catalog(self, downloads):
+        """
+        Warn if the raw-file catalog, read here without refreshing it, is empty or
+        out of date for any of the downloads: their bytes read would be understated.
+        """
+        if not self.db.retrieve('SELECT path FROM RawDirs LIMIT 1'):
+            logging.warn('The raw file catalog is empty; run fadc_data.find_new_downloads() first. Bytes read will be 0.')
+            return
+        stale = raw_catalog.stale_dirs(self.db, downloads)
+        if stale:
+            logging.warn('The raw file catalog is out of date for %s directories (e.g. %s); run fadc_data.find_new_downloads() for accurate bytes read.',
+                len(stale), stale[0])
+
+    def _plan_part(self, part, night, daqtrig, daqcams, ctdprefix):
+        download = raw_to_dst._download(ctdprefix)
+        raw_sizes = raw_catalog.part_raw_sizes(self.db, download, str(part)[4:10], part % 10)
+        depends_on = []
+
+        timecorr = _timecorr_path(part)
+        if os.path.exists(timecorr):
+            triggers = timecorr_index.lookup(timecorr).lines
+        else:
+            triggers = daqtrig or 0 # the timecorr will have one line per CTD trigger
+            job = self._add('timecorr', night, part,
+                bytes_in=sum(ctd for ctd, camera in raw_sizes.values()))
+            self._estimate(job, TIMECORR, None)
+            depends_on = [job['id']]
+
+        depends_on += self._plan_tama(part, night, daqcams, ctdprefix, triggers, raw_sizes, depends_on)
+
+        if not os.path.exists(_fdped_part_file(part)):
+            dsts = glob(_fdped_files(part)['dsts'])
+            num_dsts = len(range(0, triggers, 256))
+            job = self._add('fdped', night, part, depends_on,
+                bytes_in=sum(os.path.getsize(dst) for dst in dsts) if len(dsts) == num_dsts else None)
+            self._estimate(job, FDPED, num_dsts)
+
+    def _plan_tama(self, part, night, daqcams, ctdprefix, triggers, raw_sizes, depends_on):
+        """
+        Add the TAMA jobs of a part, batched as make_tama would submit them, for the
+        trigsets without a prolog on scratch. Return their ids.
+        """
+        try:
+            raw_to_dst.verify_tama_exists(part, os.path.basename(ctdprefix), update=False)
+            return []
+        except (AssertionError, OSError):
+            pass
+        output_dir, dst_template = raw_to_dst.tama_output(part, ctdprefix)
+        cams = _camlist(daqcams)
+        ids = []
+        for first in range(0, triggers, 256 * self.batch_size):
+            trigsets = range(first, min(first + 256 * self.batch_size, triggers), 256)
+            pending = [t for t in trigsets if not os.path.exists(dst_template.format(t).replace('.dst.gz', '.prolog'))]
+            if not pending:
+                continue
+            job = self._add('tama', night, part, depends_on, trigsets=pending,
+                bytes_in=sum(sum(raw_sizes.get(t, (0, 0))) for t in pending))
+            job['id'] = '{}-{:07}'.format(job['id'], first)
+            input_size = raw_to_dst.tama_input_size(triggers, pending, cams)
+            self._estimate(job, TAMA, input_size, scale=len(pending))
+            ids.append(job['id'])
+        return ids
+
+
+def schedule(jobs, concurrency):
+    """
+    Set each job's expected start and finish (seconds from the start of the
+    campaign) when run in list order on concurrency slots, no job starting before
+    those it depends on have finished. Return the total wall time.
+    """
+    finish = {}
+    slots = [0.0] * concurrency
+    for job in jobs:
+        free = heapq.heappop(slots)
+        job['start'] = max([free] + [finish[d] for d in job['depends_on']])
+        job['finish'] = finish[job['id']] = job['start'] + job['wall']
+        heapq.heappush(slots, job['finish'])
+    return max(finish.values()) if finish else 0.0
+
+
+def summary(jobs, wall, concurrency):
+    lines = []
+    for kind in ['timecorr', 'tama', 'fdped']:
+        of_kind = [job for job in jobs if job['kind'] == kind]
+        if not of_kind:
+            continue
+        guessed = len([job for job in of_kind if not job['from_history']])
+        unknown_bytes = len([job for job in of_kind if job['bytes_in'] is None])
+        lines.append('{:8} {:7} jobs {:10.1f} CPU-hours {:10.1f} GB read{}{}'.format(
+            kind, len(of_kind),
+            sum(job['cpu'] for job in of_kind) / 3600.,
+            sum(job['bytes_in'] or 0 for job in of_kind) / 1e9,
+            '  ({} estimated without history)'.format(guessed) if guessed else '',
+            '  ({} of unknown size)'.format(unknown_bytes) if unknown_bytes else '',
+        ))
+    lines.append('{} jobs, {:.1f} CPU-hours, {:.1f} GB read; {:.1f} hours at {} at once'.format(
+        len(jobs), sum(job['cpu'] for job in jobs) / 3600., sum(job['bytes_in'] or 0 for job in jobs) / 1e9,
+        wall / 3600., concurrency))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate the cost of reprocessing a range of nights and write its work list.')
+    parser.add_argument('first', type=int, help='first night (yyyymmdd)')
+    parser.add_argument('last', type=int, help='last night (yyyymmdd)')
+    parser.add_argument('-j', '--concurrency', type=int, default=64, help='jobs running at once')
+    parser.add_argument('--tama-batch', type=int, default=None, help='consecutive TAMA trigsets to run in one job')
+    parser.add_argument('--tama-seconds', type=float, default=None, help='CPU-seconds budget per TAMA job, instead of --tama-batch')
+    parser.add_argument('--fadc-db', default=FADC_DB)
+    parser.add_argument('--metrics-db', default=METRICS_DB)
+    parser.add_argument('-o', '--output', default=None, help='work list to write, one JSON job per line (default: stdout)')
+    parser.add_argument('-l', '--log', default='plan.log', help='name of log file')
+    args = parser.parse_args()
+    log.set_up_log(name=args.log)
+
+    planner = Planner(args.fadc_db, JobMetrics(args.metrics_db), {'trigsets': args.tama_batch, 'seconds': args.tama_seconds})
+    jobs = planner.plan(args.first, args.last)
+    wall = schedule(jobs, args.concurrency)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for job in jobs:
+            out.write(json.dumps(job, sort_keys=True) + '\n')
+    finally:
+        if args.output:
+            out.close()
+    print >> sys.stderr, summary(jobs, wall, args.concurrency)
@@ -6,11 +6,12 @@ import argparse
 import logging
 import os
 
+from db import timecorr_index
 from db.database_wrapper import DatabaseWrapper
 
-from prep_fadc.raw_to_dst import _call_timecorr
+from prep_fadc.raw_to_dst import _call_timecorr, tama_executable, tama_input_size
 from prep_fadc.tama_run import TamaRun
-from utils import log
+from utils import log, runner, _camlist
 
 FADC_DB = 'db/fadc_data.db'
 
@@ -40,21 +41,39 @@ class Part(object):
 
 
 def process_subpart(part, trigset, outdir, skip_run=False):
-    tama_run = TamaRun(part, trigset, outdir)
-
-
-    cmd, files = tama_run.build_cmd(part.ctd_prefix, part.daq_cams)
-    #logging.debug('TAMA command: %s', cmd)
+    return process_subparts(part, [trigset], outdir, skip_run)[0]
+
+
+def process_subparts(part, trigsets, outdir, skip_run=False):
+    """
+    Run TAMA on several trigsets back to back in one shell, each writing its
+    own DST, output and prolog files. Return the prolog data of each trigset,
+    or the exception raised while reading it.
+    """
+    tama_runs = [TamaRun(part, trigset, outdir) for trigset in trigsets]
+    cmds = []
+    for tama_run in tama_runs:
+        cmd, files = tama_run.build_cmd(part.ctd_prefix, part.daq_cams)
+        cmds.append(cmd)
+    #logging.debug('TAMA command: %s', cmds)
     if not skip_run:
-        logging.info('Please wait; creating %s', files['dst'])
-        os.system(cmd)
+        logging.info('Please wait; creating %s', ', '.join(tama_run.files['dst'] for tama_run in tama_runs))
+        ctd_triggers = timecorr_index.lookup(os.path.join(outdir, part.timecorr)).lines
+        runner.call('; '.join(cmds), executable=tama_executable, units=len(trigsets),
+            input_size=tama_input_size(ctd_triggers, trigsets, _camlist(part.daq_cams)))
     else:
         logging.warn('Skipping execution.')
 
-    return tama_run.prolog_data()
+    prolog_data = []
+    for tama_run in tama_runs:
+        try:
+            prolog_data.append(tama_run.prolog_data())
+        except Exception as err:
+            prolog_data.append(err)
+    return prolog_data
 
 
-def process_part(part=None, outdir=os.curdir, skip_run=False):
+def process_part(part=None, outdir=os.curdir, skip_run=False, batch_size=1):
     if part is None:
         logging.error('No part specified!')
         raise ValueError
@@ -73,53 +92,57 @@ def process_part(part=None, outdir=os.curdir, skip_run=False):
         logging.info('Creating %s', timecorr_file)
         _call_timecorr(part.site, outdir, ctd_prefix)
 
-    timecorr_lines = len(open(timecorr_file, 'r').readlines())
+    timecorr_lines = timecorr_index.lookup(timecorr_file).lines
     logging.info('Trigger counts: daq=%s, ctd=%s', daq_triggers, timecorr_lines)
 
     event_count_file = os.path.basename(ctd_prefix).replace('DAQ-', 'eventcounts-') + '.txt'
     event_count_file = os.path.join(outdir, event_count_file)
     event_count_buffer = ''
-    for trigset in range(0, timecorr_lines, 256):
-        expected = min([256, timecorr_lines - trigset])
-        logging.info('Processing trigset %07d (expecting %d triggers)', trigset, expected)
-        try:
-            prolog_data = process_subpart(part, trigset, outdir, skip_run)
-            is_error = 1 if int(prolog_data['TAMA_KEPT']) != expected else 0
-            event_count_buffer += '{:07} {} {} {} {}\n'.format(
-                trigset,
-                prolog_data['TAMA_KEPT'],
-                prolog_data['DURATION'],
-                prolog_data['BYTES_OUT'],
-                is_error,
-            )
-        except Exception as err:
-            logging.error(' !!! Failed to process %07d !!!: %s', trigset, err)
-            event_count_buffer += '{:07} 0 0 0 1\n'.format(trigset)
+    all_trigsets = range(0, timecorr_lines, 256)
+    for i in range(0, len(all_trigsets), batch_size):
+        trigsets = all_trigsets[i:i + batch_size]
+        logging.info('Processing trigsets %s', ', '.join('{:07}'.format(trigset) for trigset in trigsets))
+        for trigset, prolog_data in zip(trigsets, process_subparts(part, trigsets, outdir, skip_run)):
+            expected = min([256, timecorr_lines - trigset])
+            try:
+                if isinstance(prolog_data, Exception):
+                    raise prolog_data
+                is_error = 1 if int(prolog_data['TAMA_KEPT']) != expected else 0
+                event_count_buffer += '{:07} {} {} {} {}\n'.format(
+                    trigset,
+                    prolog_data['TAMA_KEPT'],
+                    prolog_data['DURATION'],
+                    prolog_data['BYTES_OUT'],
+                    is_error,
+                )
+            except Exception as err:
+                logging.error(' !!! Failed to process %07d (expected %d triggers) !!!: %s', trigset, expected, err)
+                event_count_buffer += '{:07} 0 0 0 1\n'.format(trigset)
 
     with open(event_count_file, 'w') as ecfile:
         ecfile.write(event_count_buffer)
 
 
-def process_night(night=None, site=None, outdir=os.curdir, skip_run=False):
+def process_night(night=None, site=None, outdir=os.curdir, skip_run=False, batch_size=1):
     if night is None or site is None:
         logging.error('Missing night and/or site argument')
         raise ValueError
     logging.info('Processing site %s for %s', site, night)
     db = DatabaseWrapper(FADC_DB)
-    sql = 'SELECT part11 FROM Parts WHERE date={} AND site={} AND daqsigma>=6.0'.format(night, site)
-    parts = [row[0] for row in db.retrieve(sql)]
+    sql = 'SELECT part11 FROM Parts WHERE date=? AND site=? AND daqsigma>=6.0'
+    parts = [row[0] for row in db.retrieve(sql, (night, site))]
     logging.info('Number of parts found: %s (codes: %s)', len(parts), ', '.join([str(part)[8:10] for part in parts]))
     for part in parts:
         try:
-            process_part(part, outdir, skip_run)
+            process_part(part, outdir, skip_run, batch_size)
         except Exception as err:
             logging.error('Error encountered on part %s. Message: %s', part, err)
 
 
 def _get_db_info(part):
     db = DatabaseWrapper(FADC_DB)
-    sql = 'SELECT f.ctdprefix, p.daqtrig, p.daqcams FROM Filesets AS f JOIN Parts AS p ON f.part11=p.part11 WHERE f.part11={}'.format(part)
-    rows = db.retrieve(sql)
+    sql = 'SELECT f.ctdprefix, p.daqtrig, p.daqcams FROM Filesets AS f JOIN Parts AS p ON f.part11=p.part11 WHERE f.part11=?'
+    rows = db.retrieve(sql, (part,))
     if len(rows) != 1:
         logging.error('No unique Fileset found for part11=%s. Found: %d', part, len(rows))
         raise ValueError("FilesetNotFound")
@@ -137,12 +160,13 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--site', type=int, choices=[0,1], help="site: 0 (BRM) or 1 (LR)")
     parser.add_argument('-o', '--outdir', help="location for output")
     parser.add_argument('--skip', action='store_true', help='skip the main TAMA generation and re-check output')
+    parser.add_argument('-b', '--batch', type=int, default=1, help='trigsets to run back to back in one shell')
     parser.add_argument('-l', '--log', default='process.log', help='name of log file')
     args = parser.parse_args()
     log_name = log.set_up_log(name=args.log, console_mirror=True)
     if args.part is not None:
-        process_part(args.part, args.outdir, args.skip)
+        process_part(args.part, args.outdir, args.skip, args.batch)
     elif args.night is not None and args.site is not None:
-        process_night(args.night, args.site, args.outdir, args.skip)
+        process_night(args.night, args.site, args.outdir, args.skip, args.batch)
     else:
         logging.error('Missing required arguments')
@@ -0,0 +1,120 @@
+# manifest.py
+# Per-night record of finished TAMA output, kept as tama-manifest.json in each night
+# directory. For every part it lists each DST with its size, trigger count, prolog
+# summary and checksum, along with a summary of the inputs the DSTs were made from,
+# so that checking a part is one small file read and a couple of indexed lookups.
+
+import json
+import os
+import re
+
+from prep_fadc import transfer
+
+MANIFEST = 'tama-manifest.json'
+PROLOG_ENTRY = re.compile('([A-Z]+_[A-Z]+) (\d+)')
+
+
+def prolog_summary(prolog):
+    """
+    Return the last value of each KEY_NAME entry (TAMA_READ, TAMA_KEPT, BYTES_OUT, ...) in a prolog file.
+    """
+    with open(prolog, 'r') as f:
+        return dict((key, int(value)) for key, value in PROLOG_ENTRY.findall(f.read()))
+
+
+def read(directory):
+    """
+    Return the manifest of a night directory as {part11 (string): entry}, or {} if there is none.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def part_entry(directory, daq_pref, site, trigsets, inputs):
+    """
+    Describe the DSTs of one part in directory, one per trigset, given the inputs
+    they were made from (see inputs()).
+    """
+    dsts = []
+    for trigset in trigsets:
+        dst = os.path.join(directory, '{}-{}-{:07}.dst.gz'.format(daq_pref, site, trigset))
+        summary = prolog_summary(dst.replace('.dst.gz', '.prolog'))
+        dsts.append({
+            'name': os.path.basename(dst),
+            'trigset': trigset,
+            'bytes': os.path.getsize(dst),
+            'triggers': summary.get('TAMA_KEPT'),
+            'prolog': summary,
+            'sha1': transfer.sha1sum(dst),
+        })
+    return {
+        'daq_pref': daq_pref,
+        'eventcounts': daq_pref.replace('DAQ-', 'eventcounts-') + '.txt',
+        'inputs': inputs,
+        'dsts': dsts,
+    }
+
+
+def inputs(timecorr_entry, raw_files):
+    """
+    Summary of a part's inputs: its timecorr file (a TimecorrEntry) and its raw
+    files as (path, size) pairs from the raw catalog.
+    """
+    return {
+        'timecorr_lines': timecorr_entry.lines,
+        'timecorr_first': timecorr_entry.first_time,
+        'timecorr_last': timecorr_entry.last_time,
+        'raw_files': len(raw_files),
+        'raw_bytes': sum(size or 0 for path, size in raw_files),
+    }
+
+
+def record(directory, part, entry):
+    """
+    Add or replace the entry of part in the manifest of directory.
+    """
+    manifest = read(directory)
+    manifest[str(part)] = entry
+    _write(directory, manifest)
+
+
+def invalidate(directory, part, reason):
+    """
+    Mark the entry of part in the manifest of directory, if it has one, as no longer
+    describing current output (see is_invalid) until record() replaces it. It is kept,
+    rather than removed, so that the part's old DSTs are not taken for current ones.
+    """
+    manifest = read(directory)
+    entry = manifest.get(str(part))
+    if entry is not None and not entry.get('invalid'):
+        entry['invalid'] = reason
+        _write(directory, manifest)
+
+
+def is_invalid(entry):
+    """
+    The reason an entry was invalidated, or None.
+    """
+    return entry.get('invalid')
+
+
+def changed_inputs(entry, current):
+    """
+    Return the names of the inputs whose summary differs from when entry was recorded.
+    Raw files are only compared when the catalog lists some.
+    """
+    recorded = entry.get('inputs', {})
+    names = [k for k in current if k != 'raw_bytes' and k != 'raw_files' and recorded.get(k) != current[k]]
+    if current['raw_files']:
+        names += [k for k in ['raw_files', 'raw_bytes'] if recorded.get(k) != current[k]]
+    return names
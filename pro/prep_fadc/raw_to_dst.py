@@ -3,18 +3,19 @@
 # Functions for preparing DST files from raw Telescope Array FADC data.
 
 import os
-import time
 import hashlib
-import re
+import pipes
+import shutil
 
 from glob import glob
 
-from utils import _command, _ymdps, _timecorr_path, _camlist, get_jstart
+from db import dst_verdicts, migrations, raw_catalog, timecorr_index
+from prep_fadc import manifest, staging, transfer
+from utils import runner, _command, _ymdps, _timecorr_path, _camlist
 from collections import defaultdict
 
 site_names = {'0': 'black-rock', '1': 'long-ridge'}
 site_ids = {v: k for k, v in site_names.items()}
-import subprocess
 tahome = os.getenv('TAHOME')
 tama_exe = os.path.join(tahome, 'tama/bin/tama.run')
 timecorr_exe = os.path.join(tahome, 'getTimeTable/bin/getTimeTable.run')
@@ -24,36 +25,21 @@ scratch = '/raidscratch/tstroman/prep_fadc'
 fdped_by_part = '/scratch1/fdpedv'
 fdped_by_night = os.path.join(os.getenv('RTDATA'), 'calibration', 'fdped')
 
-if not os.path.exists(scratch):
-    os.system('mkdir -p ' + scratch)
+timecorr_timeout = 1800 # seconds
+validate_timeout = 600
 
-def _get_tama_mounts():
-    """
-    Make sure remote directories locally known as /tama_0 and /tama_1
-    are mounted, and identify their remote location.
-    """
-    out, err = _command('mount')
-    #print out
-    mounts = [tuple(line.split()) for line in out.split('\n')[:-1]]
-    #tama_mounts = {}
-    #for line in mounts:
-        #if 'tama' in line:
-            
-    tama_mounts = {line[2]: line[0] for line in mounts if line[2].startswith('/tama_')}
-    assert '/tama_0' in tama_mounts.keys()
-    assert '/tama_1' in tama_mounts.keys()
-    return tama_mounts
-    
-tama_mounts =  _get_tama_mounts()
+if not os.path.exists(scratch):
+    os.makedirs(scratch)
 
 def _verify_timecorr_exists(part_code):
     """
     Check for the existence of timecorr file in the expected final location.
     """    
     timecorr = _timecorr_path(part_code)
+    _wait_published(os.path.dirname(timecorr))
     assert os.path.exists(timecorr)
 
-def verify_tama_exists(part_code, daq_pref=None):
+def verify_tama_exists(part_code, daq_pref=None, update=True):
     """
     Check for the existence of TAMA output in the expected location.
     Arguments:
@@ -61,6 +47,12 @@ def verify_tama_exists(part_code, daq_pref=None):
         daq_pref is DAQ prefix, assumed to be "DAQ-" + part_code[2:10] unless otherwise specified.
 
     Returns: nothing, but raises AssertionError in the event of failure.
+
+    Parts recorded in the night's manifest are checked against it alone; an entry
+    whose inputs have changed since it was recorded is invalidated, the part's output
+    on scratch is moved aside so that it is made again, and the part fails.
+    With update=False (for planning) the part just fails: neither the manifest, the
+    output nor the raw-file catalog is touched.
     """
     part_code=str(part_code)
     ymd, part, site = part_code[0:8], part_code[8:10], part_code[10]
@@ -70,6 +62,7 @@ def verify_tama_exists(part_code, daq_pref=None):
 
 
     tama_path = '/tama_{0}/{1}/{2}'.format(site, site_names[site], ymd)
+    _wait_published(tama_path)
     assert os.path.exists(tama_path)
 
     timecorr_file = 'y{0}m{1}d{2}p{3}_site{4}_timecorr.txt'.format(ymd[0:4],
@@ -77,11 +70,14 @@ def verify_tama_exists(part_code, daq_pref=None):
     timecorr = os.path.join(tama_path, timecorr_file)
     assert os.path.exists(timecorr)
 
+    entry = manifest.read(tama_path).get(part_code)
+    if entry is not None:
+        _verify_manifest_entry(part_code, tama_path, timecorr, entry, update)
+        return
+
 
     dsts = [os.path.basename(d) for d in glob(os.path.join(tama_path, daq_pref) + '*.dst.gz')]
-    with open(timecorr, 'r') as tc:
-        tc_lines = tc.readlines()
-        num_trig = len(tc_lines)
+    num_trig = timecorr_index.lookup(timecorr).lines
     for trigset in range(0, num_trig, 256):
         dst = '{0}-{1}-{2:07}.dst.gz'.format(daq_pref, site, trigset)
         assert dst in dsts
@@ -96,6 +92,63 @@ def verify_tama_exists(part_code, daq_pref=None):
 
 
 
+def _part_raw_files(part_code, download, refresh=True):
+    """
+    (path, size) of a part's raw files, from the raw catalog after refreshing its download.
+    """
+    db = _fadc_db()
+    if refresh:
+        raw_catalog.refresh_downloads(db, [download])
+    return raw_catalog.part_raw_files(db, download, str(part_code)[4:10], int(part_code) % 10)
+
+def _part_inputs(part_code, download, timecorr, refresh=True):
+    raw_files = []
+    if download:
+        raw_files = _part_raw_files(part_code, download, refresh)
+    return manifest.inputs(timecorr_index.lookup(timecorr), raw_files)
+
+def _verify_manifest_entry(part_code, tama_path, timecorr, entry, update=True):
+    invalid = manifest.is_invalid(entry)
+    assert not invalid, invalid
+    changed = manifest.changed_inputs(entry, _part_inputs(part_code, entry.get('download'), timecorr, update))
+    if changed:
+        reason = 'inputs changed: {}'.format(', '.join(changed))
+        if not update:
+            raise AssertionError(reason)
+        print 'inputs changed for', part_code, '({}); invalidating its manifest entry'.format(', '.join(changed))
+        manifest.invalidate(tama_path, part_code, reason)
+        _supersede_scratch_output(part_code, entry['daq_pref'])
+        raise AssertionError(reason)
+
+    names = set(os.listdir(tama_path))
+    assert entry['eventcounts'] in names
+    for dst in entry['dsts']:
+        assert dst['name'] in names, '{} missing'.format(dst['name'])
+        size = os.path.getsize(os.path.join(tama_path, dst['name']))
+        assert size == dst['bytes'], '{}: {} bytes, {} recorded'.format(dst['name'], size, dst['bytes'])
+
+def _supersede_scratch_output(part_code, daq_pref):
+    """
+    Move the TAMA output of a part on scratch (DSTs, prologs and job output) aside,
+    out of the directory that is published, so that make_tama runs TAMA again
+    instead of verifying and reusing it.
+    """
+    y, m, d, p, s = _ymdps(part_code)
+    output_dir = os.path.join(scratch, site_names[s], '{}{}{}'.format(y, m, d))
+    aside = os.path.join(scratch, 'superseded', site_names[s], '{}{}{}'.format(y, m, d))
+    pattern = '{}-{}-*'.format(daq_pref, s)
+    paths = glob(os.path.join(output_dir, pattern)) + glob(os.path.join(output_dir, 'mos', pattern))
+    for path in paths:
+        target = os.path.join(aside, os.path.relpath(path, output_dir))
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        os.rename(path, target)
+    if paths:
+        print 'moved', len(paths), 'superseded file(s) of', part_code, 'to', aside
+
+def _download(ctdprefix):
+    return ctdprefix[:ctdprefix.index('/ctd/') + 1]
+
 def _call_timecorr(site, output_dir, daq_pref):
     """
     Syntax for timecorr:
@@ -105,10 +158,11 @@ def _call_timecorr(site, output_dir, daq_pref):
     """
     cmd = '{} {} {} {}'.format(timecorr_exe, site, output_dir, daq_pref)
     print cmd
-    out, err = _command(cmd)
+    result = runner.run(cmd.split(), timeout=timecorr_timeout, executable='getTimeTable.run')
     print 'command finished'
-    assert not out
-    assert not err, err
+    assert not result.timed_out, 'timecorr timed out after {} seconds'.format(timecorr_timeout)
+    assert not result.stdout
+    assert not result.stderr, result.stderr
 
 def make_timecorr(part_code, daq_pref):
     # build the file in temporary output
@@ -121,7 +175,8 @@ def make_timecorr(part_code, daq_pref):
     
     rel_dir = os.path.join(site_names[s], '{}{}{}'.format(y, m, d))
     output_dir = os.path.join(scratch, rel_dir)
-    os.system('mkdir -p ' + output_dir)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
 
     _call_timecorr(s, output_dir, daq_pref)
     
@@ -131,30 +186,39 @@ def make_timecorr(part_code, daq_pref):
     return new_file    
 
     
-def _sync_to_tama(source):
+def _sync_to_tama(*sources):
     """
-    Infer destination path from source directory and copy with rsync.
+    Start publishing output directories to their /tama_* locations (see transfer.py),
+    alongside those of earlier nights; whatever reads them waits with _wait_published.
     """
-    tokens = source.split(os.path.sep)
-    sitename = tokens[-2]
-    key = '/tama_' + site_ids[sitename]
-    remote_path = os.path.join(tama_mounts[key], sitename)
-    cmd = 'rsync -ahP {} {}'.format(source, remote_path)
-    print cmd
-    out, err = _command(cmd)
-    print out.strip().split('\n')[-2]
-    assert not err
-    final_path = os.path.join(key, tokens[-2], tokens[-1])
-    print 'Confirming existence of', final_path
-    while not os.path.exists(final_path):
-        print 'Waiting 1 second'
-        time.sleep(1)
+    transfer.submit(sources)
+
+def _wait_published(tama_dir):
+    """
+    Wait for any output still being published to tama_dir; raise AssertionError if it failed.
+    """
+    errors = transfer.wait_for(tama_dir)
+    failed = [source for source, error in errors.items() if error is not None]
+    assert not failed, 'could not publish {}'.format(', '.join(failed))
 
 from db.database_wrapper import DatabaseWrapper
 
+fadc_dbfile = 'db/fadc_data.db'
+_fadc_db_migrated = []
+
+def _fadc_db():
+    """
+    The FADC database, brought up to the current schema (with the raw-file catalog)
+    the first time it is used.
+    """
+    if not _fadc_db_migrated:
+        migrations.migrate(fadc_dbfile, 'fadc_data')
+        _fadc_db_migrated.append(True)
+    return DatabaseWrapper(fadc_dbfile)
+
 def run_timecorr(night, _params):
-    db = DatabaseWrapper('db/fadc_data.db')
-    parts = db.retrieve('SELECT p.part11, f.ctdprefix FROM Parts AS p JOIN Filesets AS f ON p.part11=f.part11 WHERE p.date={}'.format(night))
+    db = _fadc_db()
+    parts = db.retrieve('SELECT p.part11, f.ctdprefix FROM Parts AS p JOIN Filesets AS f ON p.part11=f.part11 WHERE p.date=?', (night,))
     print 'FADC parts for {}: {}'.format(night, len(parts))
     
     create_attempts = {}
@@ -169,8 +233,7 @@ def run_timecorr(night, _params):
             create_attempts[part] = new_timecorr
     
     if create_attempts:
-        for output in set([os.path.dirname(v) for v in create_attempts.values()]):
-            _sync_to_tama(output)
+        _sync_to_tama(*set([os.path.dirname(v) for v in create_attempts.values()]))
     
         for part in create_attempts.keys():
             try:
@@ -183,38 +246,71 @@ def run_timecorr(night, _params):
     return None
 
 def _verify_dst(dst, prolog, out, err, expected_triggers):
-    error = False
-    try:
-        with open(prolog, 'r') as prolog_file:
-            prolog_content = prolog_file.read()
-        tama_kept = re.findall('(?<=TAMA_KEPT )\d+', prolog_content)
-        bytes_out = re.findall('(?<=BYTES_OUT )\d+', prolog_content)
-        assert len(tama_kept) == 1
-        assert len(bytes_out) == 1
-        assert os.stat(dst).st_size == int(bytes_out[0])
-        assert int(tama_kept[0]) == expected_triggers
-        with open(out, 'r') as out_file:
-            out_content = out_file.readlines()
-        triglines = [l for l in out_content if l.startswith('trigger')]
-        assert len(triglines) == expected_triggers
-        times = {}
-        for index in [0, -1]:
-            hms = triglines[index].split()[5].split(':')
-            times[index] = sum([float(hms[i]) * 60**(2-i) for i in range(3)])
-
-        return 'exists', (tama_kept, times[-1] - times[0], bytes_out, int(error))
-    except:
-        raise
-        return _brute_verify_dst(dst, prolog, out, err, expected_triggers)
+    verdict = dst_verdicts.validate(dst, prolog, out, expected_triggers)
+    assert verdict.ok, '{}: {}'.format(os.path.basename(dst), verdict.reason)
+    return 'exists', (verdict.tama_kept, verdict.trigger_seconds, verdict.bytes_out, 0)
 
 validate_raw_exe = os.path.join(os.getenv('TAHOME'), 'processFD', 'validate_raw.sh')
 def _brute_verify_dst(dst, prolog, out, err, expected_triggers):
     try:
         cmd = '{} {} {}'.format(validate_raw_exe, dst, expected_triggers)
-        return 'exists', subprocess.check_output(cmd.split()).strip().split()
+        return 'exists', runner.check_output(cmd.split(), timeout=validate_timeout).strip().split()
     except:
         return 'error', (0, 0, 0, 1)
 
+# TAMA as named in the job metrics, and the input size recorded with it: the triggers
+# of the largest trigset in a job times the cameras read, since TAMA's memory grows
+# with those of a single trigset however many run in the job. Its times are recorded
+# with the number of trigsets run as units, so that they compare across batch sizes.
+tama_executable = 'tama'
+
+def tama_input_size(ctd_triggers, trigsets, cams):
+    return max(min(256, ctd_triggers - trigset) for trigset in trigsets) * len(cams)
+
+# Rough TAMA CPU time for one full 256-trigger trigset, for when there is no
+# job metrics history to take it from.
+default_tama_seconds_per_trigset = 60.0
+
+def tama_seconds_per_trigset(metrics=None):
+    """
+    Mean CPU seconds per trigset of past TAMA jobs in metrics (a JobMetrics), or
+    the default without metrics or history.
+    """
+    typical = metrics.typical(tama_executable) if metrics is not None else None
+    if typical is None or not typical[1]:
+        return default_tama_seconds_per_trigset
+    return typical[1]
+
+def tama_batch_size(batch=None, metrics=None):
+    """
+    Number of consecutive trigsets to run in one TAMA job, from a dict with
+    'trigsets' (a count) or 'seconds' (a CPU-seconds budget per job, divided
+    by tama_seconds_per_trigset(metrics)).
+    Without either, every trigset is a job of its own.
+    """
+    batch = batch or {}
+    if batch.get('seconds'):
+        return max(1, int(batch['seconds'] // tama_seconds_per_trigset(metrics)))
+    return max(1, batch.get('trigsets') or 1)
+
+def _batch_cmd(tama_cmd, stdout_template, stderr_template, trigsets):
+    """
+    One shell command running TAMA on each trigset back to back, each with its
+    own stdout and stderr files, so every trigset can still be verified alone.
+    A failure in one trigset does not stop the rest.
+    """
+    calls = ['{} > {} 2> {}'.format(tama_cmd(t), stdout_template.format(t), stderr_template.format(t)) for t in trigsets]
+    return 'sh -c {}'.format(pipes.quote('; '.join(calls)))
+
+def tama_output(part, ctdprefix):
+    """
+    Return the scratch directory of a part's TAMA output and the template (by trigset)
+    of its DST paths; the prolog, stdout and stderr are named after the DST.
+    """
+    y, m, d, p, s = _ymdps(part)
+    output_dir = os.path.join(scratch, site_names[s], '{}{}{}'.format(y, m, d))
+    return output_dir, os.path.join(output_dir, os.path.basename(ctdprefix) + '-{}-{{0:07}}.dst.gz'.format(s))
+
 def make_tama(part, daqcams, ctdprefix, params):
     daq_pref = os.path.basename(ctdprefix)
     #print 'tama', part, daq_pref
@@ -223,95 +319,154 @@ def make_tama(part, daqcams, ctdprefix, params):
 
     y, m, d, p, s = _ymdps(part)
 
-    timecorr_lines = open(timecorr, 'r').readlines()
-    ctd_triggers = len(timecorr_lines)
+    tc_entry = timecorr_index.lookup(timecorr)
+    ctd_triggers = tc_entry.lines
     cams = _camlist(daqcams)
     ctd_file_template = ctdprefix + '-{}-{{0:07}}.d.bz2'.format(s)
     cam_file_template = ctdprefix.replace('/ctd/', '/camera{0:02}/') + '-{}-{{0:x}}'.format(s)
-    cam_files_template = ' '.join([cam_file_template.format(c) + '-{0:07}.d.bz2' for c in cams])
+    cam_files_templates = [cam_file_template.format(c) + '-{0:07}.d.bz2' for c in cams]
 
-    rel_dir = os.path.join(site_names[s], '{}{}{}'.format(y, m, d))
-    output_dir = os.path.join(scratch, rel_dir)
+    output_dir, dst_output_template = tama_output(part, ctdprefix)
 
     eventcounts = os.path.join(output_dir, daq_pref.replace('DAQ-', 'eventcounts-') + '.txt')
 
     mosix_dir = os.path.join(output_dir, 'mos')
-    os.system('mkdir -p ' + mosix_dir)
-    os.system('cp {} {}'.format(timecorr, output_dir))
+    if not os.path.isdir(mosix_dir):
+        os.makedirs(mosix_dir)
+    shutil.copy(timecorr, output_dir)
 
-    dst_output_template = os.path.join(output_dir, daq_pref + '-{}-{{0:07}}.dst.gz'.format(s))
     prolog_template = dst_output_template.replace('.dst.gz', '.prolog')
     tama_code = '{}{}{}{}'.format(y[2:], m, d, p)
     stdout_template = os.path.join(mosix_dir,  os.path.basename(dst_output_template).replace('.dst.gz', '.mosout'))
     stderr_template = stdout_template.replace('.mosout', '.moserr')
-    cmd_template = 'mosenv -q -J{{1}} -b -l -m3072 -e {} -o {} -r {} {} {} > {} 2> {}'.format(tama_exe, dst_output_template, tama_code, ctd_file_template, cam_files_template, stdout_template, stderr_template)
+    staging_root = params['stager'].root if params.get('stager') else staging.STAGING_ROOT
+
+    def tama_cmd(trigset):
+        raw_files = [staging.staged_path(t.format(trigset), staging_root) for t in [ctd_file_template] + cam_files_templates]
+        return '{} -o {} -r {} {}'.format(tama_exe, dst_output_template.format(trigset), tama_code, ' '.join(raw_files))
 
     file_templates = [dst_output_template,
                       prolog_template,
                       stdout_template,
                       stderr_template]
 
-    ijstart = int(get_jstart(timecorr, timecorr_lines[0]))
+    ijstart = int(tc_entry.jstart)
+    batch_size = tama_batch_size(params.get('tama_batch'), getattr(params['executor'], 'metrics', None))
     status = defaultdict(list)
     ecountsbuffer = ''
-    for trigset in range(0, ctd_triggers, 256):
-        jobstring = '{}-{:07}'.format(part, trigset)
+    for first in range(0, ctd_triggers, 256 * batch_size):
+        trigsets = range(first, min(first + 256 * batch_size, ctd_triggers), 256)
+        jobstring = '{}-{:07}'.format(part, first)
+        if batch_size > 1:
+            jobstring += '+{}'.format(batch_size)
         jobid = int(hashlib.md5(jobstring).hexdigest()[-7:], 16)
         assert jobid < 2147483648 # needs to fit inside a 32-bit signed integer
 
-        dst, prolog, out, err = [t.format(trigset) for t in file_templates]
-        if jobid in params['mosq']:
-            status['found'].append(jobstring)
-        elif os.path.exists(prolog):
-            expected_triggers = min(256, ctd_triggers - trigset)
-            jobstatus, ecline = _verify_dst(dst, prolog, out, err, expected_triggers)
-
-            if jobstatus == 'exists':
-                ecountsbuffer += '{:07} {} {} {} {}\n'.format(trigset, *ecline)
-                status['exists'].append((jobstring, output_dir))
-            elif jobstatus == 'error':
-                status['error'].append(jobstring)
+        if jobid in params['executor']:
+            status['found'] += ['{}-{:07}'.format(part, trigset) for trigset in trigsets]
+            continue
+
+        pending = []
+        for trigset in trigsets:
+            trigstring = '{}-{:07}'.format(part, trigset)
+            dst, prolog, out, err = [t.format(trigset) for t in file_templates]
+            if os.path.exists(prolog):
+                expected_triggers = min(256, ctd_triggers - trigset)
+                jobstatus, ecline = _verify_dst(dst, prolog, out, err, expected_triggers)
+
+                if jobstatus == 'exists':
+                    ecountsbuffer += '{:07} {} {} {} {}\n'.format(trigset, *ecline)
+                    status['exists'].append((trigstring, output_dir))
+                elif jobstatus == 'error':
+                    status['error'].append(trigstring)
+            else:
+                pending.append(trigset)
+                status['submitted'].append(trigstring)
+
+        if not pending:
+            continue
+        out, err = stdout_template.format(first), stderr_template.format(first)
+        if batch_size == 1:
+            cmd = tama_cmd(first)
         else:
-            cmd = cmd_template.format(trigset, jobid)
-            print cmd
-            status['submitted'].append(jobstring)
-            params['mosq'][jobid] = ('new', None)
-            subprocess.Popen(cmd, shell=True)
-            #break # temporary
+            out, err = [f.replace('.mos', '.batch.mos') for f in (out, err)]
+            cmd = _batch_cmd(tama_cmd, stdout_template, stderr_template, pending)
+        print cmd
+        input_size = tama_input_size(ctd_triggers, pending, cams)
+        memory_mb = params['executor'].memory_mb(tama_executable, input_size, default=3072)
+        params['executor'].submit(jobid, cmd, stdout=out, stderr=err, memory_mb=memory_mb, tag=int('{}{}{}'.format(y, m, d)),
+            executable=tama_executable, input_size=input_size, units=len(pending))
 
     if ecountsbuffer:
         with open(eventcounts, 'w') as ecfile:
             ecfile.write(ecountsbuffer)
 
+    trigsets = range(0, ctd_triggers, 256)
+    if len(status['exists']) == len(trigsets):
+        entry = manifest.part_entry(output_dir, daq_pref, s, trigsets, _part_inputs(part, _download(ctdprefix), timecorr))
+        entry['download'] = _download(ctdprefix)
+        manifest.record(output_dir, part, entry)
+
     for k, v in status.items():
         print '{}: {}'.format(k, len(v))
 
     return status
 
-def run_tama(night, params):
-    db = DatabaseWrapper('db/fadc_data.db')
-    parts = db.retrieve('SELECT p.part11, p.site, p.daqcams, f.ctdprefix FROM Parts AS p JOIN Filesets AS f ON p.part11=f.part11 WHERE p.date={}'.format(night))
+staging_timeout = 1800 # seconds to wait for a night's raw files to be staged before running TAMA anyway
 
-    allstatus = {0: defaultdict(list), 1: defaultdict(list)}
+def stage_parts(night, parts, stager):
+    """
+    Queue local copies of the raw files of the given parts (part11, ctdprefix), as
+    listed in the raw catalog.
+    """
+    files = []
+    for part, ctdprefix in parts:
+        files += _part_raw_files(part, _download(ctdprefix))
+    return stager.prefetch(night, files)
+
+def _parts_without_tama(night):
+    db = _fadc_db()
+    parts = db.retrieve('SELECT p.part11, p.site, p.daqcams, f.ctdprefix FROM Parts AS p JOIN Filesets AS f ON p.part11=f.part11 WHERE p.date=?', (night,))
+    missing = []
     for part, site, daqcams, ctdprefix in parts:
-        daq_pref = os.path.basename(ctdprefix)
         try:
-            verify_tama_exists(part, daq_pref)
+            verify_tama_exists(part, os.path.basename(ctdprefix))
         except AssertionError:
-            print 'no TAMA for', part, ctdprefix
-            partstatus = make_tama(part, daqcams, ctdprefix, params)
-            for k, v in partstatus.items():
-                allstatus[site][k] += v
+            missing.append((part, site, daqcams, ctdprefix))
+    return missing
+
+def prefetch_tama(night, params):
+    """
+    Start staging the raw files of every part of night still lacking TAMA output,
+    without waiting, so that they are local by the time run_tama reaches the night.
+    """
+    if params.get('stager'):
+        stage_parts(night, [(part, ctdprefix) for part, site, daqcams, ctdprefix in _parts_without_tama(night)], params['stager'])
+
+def run_tama(night, params):
+    parts = _parts_without_tama(night)
+    stager = params.get('stager')
+    if stager and parts:
+        stage_parts(night, [(part, ctdprefix) for part, site, daqcams, ctdprefix in parts], stager)
+        if not stager.wait(night, timeout=params.get('staging_timeout', staging_timeout)):
+            print 'raw files for', night, 'not all staged; the rest are read from the source'
+
+    allstatus = {0: defaultdict(list), 1: defaultdict(list)}
+    for part, site, daqcams, ctdprefix in parts:
+        print 'no TAMA for', part, ctdprefix
+        partstatus = make_tama(part, daqcams, ctdprefix, params)
+        for k, v in partstatus.items():
+            allstatus[site][k] += v
 
     report = {}
+    out_dirs = []
     for site, status in allstatus.items():
         if not status:
             continue
 
         keys = status.keys()
         if keys == ['exists']:
-            out_dir = list(set([v[1] for v in status['exists']]))[0]
-            _sync_to_tama(out_dir)
+            out_dirs.append(list(set([v[1] for v in status['exists']]))[0])
             report[site] = 'success'
             continue
 
@@ -325,6 +480,8 @@ def run_tama(night, params):
             report[site] = 'found in queue'
             continue
 
+    if out_dirs:
+        _sync_to_tama(*out_dirs)
     if all([r == 'success' for r in report.values()]):
         return None
     return str(report)
@@ -343,8 +500,8 @@ def verify_fdped_exists(parts):
 
 
 def run_fdped(night, params):
-    db = DatabaseWrapper('db/fadc_data.db')
-    parts = db.retrieve('SELECT p.part11, p.site FROM Parts AS p WHERE p.date={}'.format(night))
+    db = _fadc_db()
+    parts = db.retrieve('SELECT p.part11, p.site FROM Parts AS p WHERE p.date=?', (night,))
     print 'checking fdped for', night, len(parts)
     parts_by_site = defaultdict(list)
     for part, site in parts:
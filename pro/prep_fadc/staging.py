@@ -0,0 +1,272 @@
+# staging.py
+# Local copies of raw FADC files on RAID scratch, so that TAMA jobs read them from
+# there instead of from the /tadserv* volumes over the network. A night's files are
+# copied ahead of the jobs that need them, at a bounded rate from each source volume,
+# and every copy is verified against a checksum of the source before it is used.
+# Nights are evicted, least recently used first, to keep the total under a quota.
+#
+# A staged file lives at the same path under STAGING_ROOT as its source, and only
+# appears there once verified. It is given the source's mtime, so staged_path()
+# needs nothing but a stat of each to tell whether the source has since been replaced.
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+from db import migrations
+from db.database_wrapper import DatabaseWrapper
+
+STAGING_ROOT = '/raidscratch/tstroman/staging'
+QUOTA_BYTES = 2 * 1024**4
+VOLUME_BYTES_PER_SECOND = 40 * 1024**2 # read rate allowed from each /tadserv* volume
+DEFAULT_WORKERS = 8
+PROTECT_SECONDS = 12 * 3600 # nights used this recently are never evicted
+CHUNK_SIZE = 1024 * 1024
+TMP_SUFFIX = '.staging'
+MTIME_TOLERANCE = 1e-3 # seconds
+
+
+def _is_current(local, path):
+    """
+    Whether local is a copy of path as it is now: same size and mtime (to within
+    MTIME_TOLERANCE, as os.utime only sets microseconds).
+    """
+    try:
+        copy, source = os.stat(local), os.stat(path)
+    except OSError:
+        return False
+    return copy.st_size == source.st_size and abs(copy.st_mtime - source.st_mtime) < MTIME_TOLERANCE
+
+
+def staged_path(path, root=STAGING_ROOT):
+    """
+    Return the verified local copy of the raw file at path if there is one and its
+    source is unchanged since it was staged, otherwise path.
+    """
+    local = os.path.join(root, path.lstrip(os.path.sep))
+    return local if _is_current(local, path) else path
+
+
+def _volume(path):
+    return path.split(os.path.sep)[1]
+
+
+def _sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by every thread reading from one volume.
+    """
+    def __init__(self, bytes_per_second):
+        self.rate = float(bytes_per_second)
+        self._lock = threading.Lock()
+        self._next = time.time()
+
+    def consume(self, num_bytes):
+        """
+        Account for num_bytes just read, sleeping as long as needed to stay under the rate.
+        """
+        with self._lock:
+            now = time.time()
+            self._next = max(self._next, now) + num_bytes / self.rate
+            delay = self._next - now - 1.0 # allow a burst of one second's worth
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Stager(object):
+    """
+    Copies raw files under root in background threads. Call prefetch() with a night
+    and the files it needs (as (path, size) pairs) as early as possible, and wait()
+    for that night before building its TAMA commands; any file not staged by then
+    is simply read from its source.
+
+    Staged files and nights are recorded in root/staging.db. busy, if given, returns
+    the nights that jobs already submitted may still read, which are never evicted.
+    """
+    def __init__(self, root=STAGING_ROOT, quota_bytes=QUOTA_BYTES,
+            volume_bytes_per_second=VOLUME_BYTES_PER_SECOND, workers=DEFAULT_WORKERS, busy=None):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.busy = busy
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        dbfile = os.path.join(root, 'staging.db')
+        migrations.migrate(dbfile, 'staging')
+        self.db = DatabaseWrapper(dbfile)
+        self.db.set_journal_mode('WAL') # root is on local disk, and copy threads write concurrently
+
+        self._lock = threading.Lock()
+        self._limiters = defaultdict(lambda: RateLimiter(volume_bytes_per_second))
+        self._pool = ThreadPool(workers)
+        self._pending = defaultdict(list) # night: AsyncResult of each queued copy
+        self._queued = set()
+        self._total = self.db.retrieve('SELECT coalesce(sum(size), 0) FROM StagedFiles')[0][0]
+        self._full_warned = False
+
+    def local_path(self, path):
+        return os.path.join(self.root, path.lstrip(os.path.sep))
+
+    def prefetch(self, night, files):
+        """
+        Queue copies of the files (path, size) of a night that are not staged yet,
+        and mark the night as used now. Return the number of copies queued.
+        """
+        self._touch(night)
+        queued = 0
+        with self._lock:
+            for path, size in files:
+                if path in self._queued or _is_current(self.local_path(path), path):
+                    continue
+                self._drop(path) # any stale copy, whose source has been replaced
+                self._queued.add(path)
+                self._pending[night].append(self._pool.apply_async(self._stage, (night, path, size)))
+                queued += 1
+        if queued:
+            logging.info('Staging %s raw file(s) for %s', queued, night)
+        return queued
+
+    def wait(self, night, timeout=None):
+        """
+        Block until every copy queued for night has finished, or timeout seconds have
+        passed. Return True if none is left.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            results = list(self._pending[night])
+        for result in results:
+            result.wait(None if deadline is None else max(deadline - time.time(), 0))
+            if not result.ready():
+                return False
+        with self._lock:
+            self._pending[night] = [r for r in self._pending[night] if not r.ready()]
+            return not self._pending[night]
+
+    def _touch(self, night):
+        if not self.db.update_row('UPDATE StagedNights SET last_used=? WHERE night=?', (time.time(), night)):
+            self.db.insert_row('INSERT INTO StagedNights VALUES(?, ?)', (night, time.time()))
+
+    def _stage(self, night, path, size):
+        size = size or 0
+        try:
+            if not self._reserve(night, size):
+                return
+            try:
+                copied = self._copy(night, path)
+            except Exception:
+                copied = 0
+                raise
+            finally:
+                with self._lock:
+                    self._total += copied - size
+        except Exception as err:
+            logging.error('Could not stage %s: %s', path, err)
+        finally:
+            with self._lock:
+                self._queued.discard(path)
+
+    def _reserve(self, night, size):
+        """
+        Make room for size more bytes, evicting other nights if needed. Return False
+        if the quota cannot be met.
+        """
+        with self._lock:
+            while self._total + size > self.quota_bytes:
+                if not self._evict_one(exclude=night):
+                    if not self._full_warned:
+                        logging.warn('Staging area %s is full; reading the rest from the source volumes', self.root)
+                        self._full_warned = True
+                    return False
+            self._total += size
+            return True
+
+    def _evict_one(self, exclude):
+        """
+        Remove every staged file of the least recently used night, other than exclude,
+        those used within PROTECT_SECONDS, and busy ones (whose files are named in
+        commands of jobs still queued). Return False if there is none.
+        Called with the lock held.
+        """
+        busy = self.busy() if self.busy else ()
+        rows = self.db.retrieve(
+            'SELECT night FROM StagedNights WHERE night!=? AND last_used<? AND night IN (SELECT night FROM StagedFiles) ORDER BY last_used',
+            (exclude, time.time() - PROTECT_SECONDS),
+        )
+        nights = [night for night, in rows if night not in busy]
+        if not nights:
+            return False
+        night = nights[0]
+        files = self.db.retrieve('SELECT path, size FROM StagedFiles WHERE night=?', (night,))
+        for path, size in files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._total -= size
+        self.db.delete_rows('DELETE FROM StagedFiles WHERE night=?', ((night,),))
+        logging.info('Evicted %s staged file(s) of %s', len(files), night)
+        return True
+
+    def _drop(self, path):
+        """
+        Remove the staged copy of path, if any, and its record. Called with the lock held.
+        """
+        for local, size in self.db.retrieve('SELECT path, size FROM StagedFiles WHERE source=?', (path,)):
+            try:
+                os.remove(local)
+            except OSError:
+                pass
+            self._total -= size
+        self.db.delete_rows('DELETE FROM StagedFiles WHERE source=?', ((path,),))
+
+    def _copy(self, night, path):
+        """
+        Copy path to its local place at the volume's rate, then check the copy against
+        the source's size and checksum before moving it, with the source's mtime, where
+        staged_path() finds it. Return the size of the copy.
+        """
+        local = self.local_path(path)
+        tmp = local + TMP_SUFFIX
+        if not os.path.isdir(os.path.dirname(local)):
+            try:
+                os.makedirs(os.path.dirname(local))
+            except OSError:
+                pass # made by another thread meanwhile
+        limiter = self._limiters[_volume(path)]
+        digest = hashlib.sha1()
+        size = 0
+        before = os.stat(path)
+        with open(path, 'rb') as src:
+            with open(tmp, 'wb') as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), ''):
+                    limiter.consume(len(chunk))
+                    digest.update(chunk)
+                    dst.write(chunk)
+                    size += len(chunk)
+                dst.flush()
+                os.fsync(dst.fileno())
+        checksum = digest.hexdigest()
+        after = os.stat(path)
+        if (size, before.st_mtime) != (after.st_size, after.st_mtime) or _sha1(tmp) != checksum:
+            os.remove(tmp)
+            raise IOError('copy of {} does not match its source'.format(path))
+        os.utime(tmp, (after.st_atime, after.st_mtime))
+        os.rename(tmp, local)
+        with self._lock:
+            self.db.delete_rows('DELETE FROM StagedFiles WHERE source=?', ((path,),))
+            self.db.insert_row('INSERT INTO StagedFiles VALUES(?, ?, ?, ?, ?, ?)', (path, local, night, size, checksum, time.time()))
+        return size
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
@@ -1,16 +1,14 @@
 import logging
 import os
-import re
 from datetime import datetime
 
+from db import dst_verdicts
+from prep_fadc.staging import staged_path
+
 TAMA_EXE = os.path.join(os.getenv('TAHOME'), 'tama', 'bin', 'tama.run')
 EXPECTED_TAMA_STDERR = 2
 
 
-# match a string like "7/28/2017  UT 05:59:55.087354105" followed by the processing time (indicating success)
-TIMESTAMP = re.compile('(\d+)\/(\d+)\/(\d{4}) +UT (\d+):(\d{2}):(\d{2}\.\d+).*sec')
-
-
 class PrologError(Exception):
     pass
 
@@ -28,11 +26,6 @@ def _camlist(daq_cams):
     return [i for i in range(12) if (daq_cams >> i) % 2]
 
 
-def _time(timestamp): # works with TIMESTAMP matches
-    hour, minute, second = [float(t) for t in timestamp[-3:]]
-    return hour*3600 + minute*60 + second
-
-
 class TamaRun(object):
     def __init__(self, part, trigset, outdir):
         self.part = part
@@ -42,7 +35,7 @@ class TamaRun(object):
         self.files = None
 
     def build_cmd(self, ctd_prefix, daq_cams):
-        ctd_file = ctd_prefix + '-{}-{:07}.d.bz2'.format(self.part.site, self.trigset)
+        ctd_file = staged_path(ctd_prefix + '-{}-{:07}.d.bz2'.format(self.part.site, self.trigset))
         output_dst = os.path.join(
             self.outdir,
             '{}-{}-{:07}.dst.gz'.format(
@@ -53,7 +46,7 @@ class TamaRun(object):
         )
         stdout, stderr, prolog = (output_dst.replace('.dst.gz', suffix) for suffix in ['.out', '.err', '.prolog'])
         cam_file_template = ctd_prefix.replace('/ctd/', '/camera{0:02}/') + '-{0}-{{0:x}}-{1:07}.d.bz2'.format(self.part.site, self.trigset)
-        cam_files = ' '.join([cam_file_template.format(c) for c in _camlist(daq_cams)])
+        cam_files = ' '.join([staged_path(cam_file_template.format(c)) for c in _camlist(daq_cams)])
 
         self.files = {
             'dst' : output_dst,
@@ -84,25 +77,25 @@ class TamaRun(object):
             stderr = err_file.readlines()
         logging.info('Lines of stderr: expected=%s, actual=%s', EXPECTED_TAMA_STDERR, len(stderr))
 
-        try:
-            with open(self.files['log'], 'r') as log_file:
-                prolog = log_file.read()
-            prolog_data = dict([tuple(r.split()) for r in re.findall('[A-Z]+_[A-Z]+ \d+', prolog)[-4:]])
-            logging.info('Prolog report: read=%s, kept=%s, bytes=%s',
-                prolog_data['TAMA_READ'],
-                prolog_data['TAMA_KEPT'],
-                prolog_data['BYTES_OUT'],
-            )
-        except Exception as err:
-            logging.error('Encountered error reading prolog: %s', err)
+        verdict = dst_verdicts.validate(self.files['dst'], self.files['log'], self.files['out'])
+        if verdict.tama_kept is None or verdict.bytes_out is None:
+            logging.error('Encountered error reading prolog: %s', verdict.reason)
             raise PrologError
+        logging.info('Prolog report: read=%s, kept=%s, bytes=%s',
+            verdict.tama_read,
+            verdict.tama_kept,
+            verdict.bytes_out,
+        )
+        if verdict.stdout_seconds is None:
+            logging.error('No processing timestamps in %s', self.files['out'])
+            raise MissingOutputError
 
-        with open(self.files['out'], 'r') as out_file:
-            stdout = out_file.read()
-        times = TIMESTAMP.findall(stdout)
-
-        duration = _time(times[-1]) - _time(times[0])
-        prolog_data['DURATION'] = duration
+        prolog_data = {
+            'TAMA_READ': verdict.tama_read,
+            'TAMA_KEPT': verdict.tama_kept,
+            'BYTES_OUT': verdict.bytes_out,
+            'DURATION': verdict.stdout_seconds,
+        }
 
         return prolog_data
 
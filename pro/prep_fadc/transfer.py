@@ -0,0 +1,284 @@
+# transfer.py
+# Publish output directories from scratch to the /tama_* volumes, many directories at
+# once but only a few at a time to each volume. Every file is checked against the
+# source's size and SHA-1 after copying, and the list of what was verified is left in
+# the destination as a manifest, so a finished directory is recognized without reading
+# it again and an interrupted one resumes where it stopped.
+#
+# Processing code submits directories to one engine shared by the whole process
+# (submit) and waits for a destination only when it is about to read it (wait_for).
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+from utils import tama
+
+MANIFEST = '.transfer-manifest.json'
+PARTIAL_SUFFIX = '.part'
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_WORKERS = 8
+PER_DESTINATION = 2 # directories copied to one /tama_* volume at a time
+
+
+class TransferError(Exception):
+    pass
+
+
+def sha1sum(path, limit=None):
+    """
+    SHA-1 of the file at path, or of its first limit bytes.
+    """
+    digest = hashlib.sha1()
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def _files(directory):
+    """
+    Return the relative path of every file under directory, other than transfer's own.
+    """
+    relpaths = []
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            if name == MANIFEST or name.endswith(PARTIAL_SUFFIX):
+                continue
+            relpaths.append(os.path.relpath(os.path.join(root, name), directory))
+    return relpaths
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + PARTIAL_SUFFIX, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(path + PARTIAL_SUFFIX, path)
+
+
+def tama_destination(source):
+    """
+    The /tama_* directory for an output directory on scratch ending in site name and night.
+    """
+    source = os.path.normpath(source)
+    night = os.path.basename(source)
+    sitename = os.path.basename(os.path.dirname(source))
+    for site_dir in tama.values():
+        if os.path.basename(os.path.normpath(site_dir)) == sitename:
+            return os.path.join(site_dir, night)
+    raise ValueError('No TAMA volume for {}'.format(source))
+
+
+def _copy_file(source, dest, size, checksum):
+    """
+    Copy source to dest through a partial file, continuing from an earlier partial copy
+    if its contents still match the source, and rename it into place once verified.
+    """
+    partial = dest + PARTIAL_SUFFIX
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    if offset > size or (offset and sha1sum(partial) != sha1sum(source, offset)):
+        offset = 0
+    with open(source, 'rb') as src:
+        with open(partial, 'ab' if offset else 'wb') as dst:
+            src.seek(offset)
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), ''):
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+    if os.path.getsize(partial) != size or sha1sum(partial) != checksum:
+        os.remove(partial)
+        raise TransferError('copy of {} does not match its source'.format(source))
+    shutil.copystat(source, partial)
+    os.rename(partial, dest)
+
+
+def sync(source, dest):
+    """
+    Make dest hold a verified copy of every file under source. The destination
+    manifest records [size, sha1, mtime] of each source file copied; a file whose
+    size and mtime still match is skipped without being read, and one whose
+    checksum still matches is not copied again. Return the number of files copied.
+    """
+    done = read_manifest(dest)
+    copied = 0
+    changed = False
+    for relpath in sorted(_files(source)):
+        path = os.path.join(source, relpath)
+        target = os.path.join(dest, relpath)
+        st = os.stat(path)
+        known = done.get(relpath) or [None, None]
+        published = os.path.exists(target) and os.path.getsize(target) == st.st_size
+        if published and known[0] == st.st_size and known[2:] == [st.st_mtime]:
+            continue
+        checksum = sha1sum(path)
+        if not (published and known[:2] == [st.st_size, checksum]):
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            _copy_file(path, target, st.st_size, checksum)
+            copied += 1
+        done[relpath] = [st.st_size, checksum, st.st_mtime]
+        changed = True
+        if copied and copied % 50 == 0:
+            _write_manifest(dest, done) # so that an interruption does not lose the record
+    if changed:
+        _write_manifest(dest, done)
+    return copied
+
+
+class TransferEngine(object):
+    """
+    Runs sync() for many directories on a pool of workers, with at most per_destination
+    of them writing to the same volume (the first component of the destination path).
+    A directory submitted again while still being copied is synced once more afterwards.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, per_destination=PER_DESTINATION):
+        self._pool = ThreadPool(workers)
+        self._slots = defaultdict(lambda: threading.BoundedSemaphore(per_destination))
+        self._source_locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        self._results = defaultdict(list) # source: [(dest, AsyncResult)]
+
+    def _volume_slot(self, dest):
+        with self._lock:
+            return self._slots[os.path.normpath(dest).split(os.path.sep)[1]]
+
+    def _sync(self, source, dest):
+        with self._lock:
+            source_lock = self._source_locks[source]
+        with source_lock:
+            with self._volume_slot(dest):
+                copied = sync(source, dest)
+        logging.info('Published %s to %s (%s file(s) copied)', source, dest, copied)
+        return copied
+
+    def submit(self, source, dest=None):
+        """
+        Queue a copy of source to dest (default: its /tama_* directory). Return dest.
+        """
+        dest = dest or tama_destination(source)
+        with self._lock:
+            self._results[source].append((dest, self._pool.apply_async(self._sync, (source, dest))))
+        return dest
+
+    def wait(self, sources=None, dest=None):
+        """
+        Wait for the given sources (default: all submitted, or all those going to
+        dest) and return {source: error}, with error None for each one published
+        successfully.
+        """
+        with self._lock:
+            if sources is None:
+                sources = self._results.keys()
+            results = [(source, d, result) for source in sources for d, result in self._results.get(source, [])
+                       if dest is None or os.path.normpath(d) == os.path.normpath(dest)]
+        errors = {}
+        for source, d, result in results:
+            try:
+                result.get()
+                errors.setdefault(source, None)
+            except Exception as err:
+                logging.error('Could not publish %s to %s: %s', source, d, err)
+                errors[source] = err
+        with self._lock:
+            for source, d, result in results:
+                self._results[source].remove((d, result))
+                if not self._results[source]:
+                    del self._results[source]
+        return errors
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+_engine = []
+_engine_lock = threading.Lock()
+
+def _shared_engine():
+    with _engine_lock:
+        if not _engine:
+            _engine.append(TransferEngine())
+            atexit.register(shutdown) # worker threads are daemons: never exit mid-copy
+        return _engine[0]
+
+
+def submit(sources):
+    """
+    Queue every source directory for publishing to its /tama_* directory on the
+    engine shared by this process, without waiting. Return their destinations.
+    """
+    engine = _shared_engine()
+    return [engine.submit(source) for source in sources]
+
+
+def wait_for(dest):
+    """
+    Wait for every directory submitted to the shared engine for dest, if any.
+    Return {source: error} as TransferEngine.wait does.
+    """
+    with _engine_lock:
+        engine = _engine[0] if _engine else None
+    return engine.wait(dest=dest) if engine is not None else {}
+
+
+def shutdown():
+    """
+    Wait for everything submitted to the shared engine and stop it.
+    Return {source: error} as TransferEngine.wait does.
+    """
+    with _engine_lock:
+        engine = _engine.pop() if _engine else None
+    if engine is None:
+        return {}
+    try:
+        return engine.wait()
+    finally:
+        engine.close()
+
+
+def publish(sources, workers=DEFAULT_WORKERS, per_destination=PER_DESTINATION):
+    """
+    Publish every source directory to its /tama_* directory concurrently.
+    Return {source: error} as TransferEngine.wait does.
+    """
+    engine = TransferEngine(workers, per_destination)
+    try:
+        for source in sources:
+            engine.submit(source)
+        return engine.wait()
+    finally:
+        engine.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Publish night directories from scratch to the /tama_* volumes.')
+    parser.add_argument('sources', nargs='+', help='directories like .../black-rock/yyyymmdd')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('-d', '--per-destination', type=int, default=PER_DESTINATION)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    errors = publish(args.sources, args.workers, args.per_destination)
+    failed = [source for source, error in errors.items() if error is not None]
+    if failed:
+        print 'Failed:', ' '.join(sorted(failed))
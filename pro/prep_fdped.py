@@ -2,11 +2,13 @@ import argparse
 import logging
 import os
 import re
+from glob import glob
 
-from utils import log
+from utils import log, runner
 
 FDPED_BIN = os.path.join(os.getenv('TAHOME'), 'fdped', 'bin', 'fdped.run')
 FDPED_OUT = '/scratch1/fdpedv'
+FDPED_TIMEOUT = 4 * 3600 # seconds
 YMDPS = re.compile('(\d{4})(\d{2})(\d{2})(\d{2})(\d)')
 TIMECORRS = {
     '0': '/tama_{4}/black-rock/{0}{1}{2}/y{0}m{1}d{2}p{3}_site{4}_timecorr.txt',
@@ -34,12 +36,13 @@ def run_fdped(part11):
     if not os.path.exists(outdir):
         os.makedirs(outdir)
 
-    cmd = '{fdped} -o {peddst} -t {timecorr} {dsts} > {out} 2> {err}'.format(
-        fdped=FDPED_BIN,
-        **format_kwargs
-    )
-    logging.info('cmd: %s', cmd)
-    os.system(cmd)
+    dsts = sorted(glob(format_kwargs['dsts'])) or [format_kwargs['dsts']]
+    cmd = [FDPED_BIN, '-o', format_kwargs['peddst'], '-t', timecorr] + dsts
+    logging.info('cmd: %s > %s 2> %s', ' '.join(cmd), format_kwargs['out'], format_kwargs['err'])
+    result = runner.run(cmd, stdout=format_kwargs['out'], stderr=format_kwargs['err'], capture=False,
+        timeout=FDPED_TIMEOUT, input_size=len(dsts))
+    if result.timed_out:
+        logging.error('FDPED timed out for %s', part11)
     peddst = format_kwargs['peddst']
     out = format_kwargs['out']
     err = format_kwargs['err']
@@ -17,7 +17,7 @@ def process_night(night, params, start_code=None, end_code=None):
     step if it is possible. Otherwise it will begin at the last known
     checkpoint for the night.
     """
-    if night in params['mosq']:
+    if night in params['executor']:
         return 'found in queue'
 
     if isinstance(start_code, str):
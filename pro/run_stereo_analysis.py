@@ -4,17 +4,24 @@
 # TODO: Documentation!
 import logging
 import os
+import Queue
 import shutil
-import subprocess
 
-from datetime import datetime
 from glob import glob
 
 from db.database_wrapper import DatabaseWrapper
+from db.writer import DatabaseWriter
 from db import tafd_analysis
+from prep_fadc import raw_to_dst
 from prep_fadc.raw_to_dst import _command
+from prep_fadc import transfer
+from prep_fadc.staging import Stager
 from process_night import process_night
-from step import steps
+from services.jobs import get_executor
+from services.jobs.metrics import JobMetrics
+from services.jobs.tracker import JobTracker
+from step import Step, STEPS, steps
+from utils import runner
 
 event_interval = 5.0 # average seconds between events
 # TODO: use database for these
@@ -33,34 +40,15 @@ ignorable_night_reasons = [
 ]
 
 
-mosq_poll_interval = 15 # seconds
-def _get_mosix_jobs():
-    """
-    Obtain a list of queued/running mosix jobs and return a dict with
-    job IDs as keys, and lists of (process name, status) as values.
-    """
-    mosq = subprocess.check_output('mosq -j listall'.split())
-    jobs = {}
-    for line in mosq.strip().split('\n')[1:]:
-        l = line.split()
-        pid, pri, jobid = [l[i] for i in [0, 4, 5]]
-        jobid = int(jobid)
-        try:
-            jobs[jobid].append((pid, pri))
-        except KeyError:
-            jobs[jobid] = [(pid, pri)]
-
-    return jobs
-
-def _setup_run_get_dates(stereo_run, analysis_db):
+def _setup_run_get_dates(stereo_run, analysis_db, executor, tama_batch=None):
     date_status = _build_date_list(stereo_run, analysis_db)
-    params = _build_params(stereo_run)
+    params = _build_params(stereo_run, executor, tama_batch)
 
     return date_status, params
 
 
 def _build_date_list(stereo_run, analysis_db, disregard_ignore=False):
-    ignore_nights = {d: 'ignored: '+r for d,r in analysis_db.retrieve("SELECT date, reason FROM StereoIgnoreNights WHERE modelsource='{}'".format(stereo_run.modelsource))}
+    ignore_nights = {d: 'ignored: '+r for d,r in analysis_db.retrieve('SELECT date, reason FROM StereoIgnoreNights WHERE modelsource=?', (stereo_run.modelsource,))}
 
     if disregard_ignore:
         logging.warn('Nights that would normally be ignored: %s', len(ignore_nights))
@@ -74,63 +62,108 @@ def _build_date_list(stereo_run, analysis_db, disregard_ignore=False):
     date_status.update(ignore_nights)
     return date_status
 
-def _build_params(stereo_run):
+def _build_params(stereo_run, executor, tama_batch=None):
     trump_template = None
     if stereo_run.params.is_mc:
         trump_template = stereo_run.trump_template
         assert os.path.exists(trump_template)
         assert os.path.exists(stereo_run.log_path)
 
-    mosq = _get_mosix_jobs()
-    params = {'model': stereo_run.params.model, 'source': stereo_run.specific_run, 'is_mc': trump_template, 'path': stereo_run.run_path, 'mosq': mosq, 'stereo_run': stereo_run}
+    params = {'model': stereo_run.params.model, 'source': stereo_run.specific_run, 'is_mc': trump_template, 'path': stereo_run.run_path, 'executor': executor, 'stereo_run': stereo_run, 'tama_batch': tama_batch}
 
     return params
 
-def run(stereo_run, begin, end):
-    # Initialization
-    model = stereo_run.params.model
-    source = stereo_run.specific_run
-    dbfile = os.path.join(stereo_run.analysis_path, 'tafd_analysis.db')
-    if not os.path.exists(dbfile):
-        base_properties = (
-            ('ROOTPATH', stereo_run.rootpath),
-            ('ANALYSIS', stereo_run.name),
-            ('DESCRIPTION', 'GDAS atmosphere, "joint" geometry, calibration 1.4, correct molecular atmosphere lookup'),
-            ('DATAPATH', stereo_run.tafd_data),
-        )
-
-        tafd_analysis.init(
-            dbfile=dbfile,
-            properties=base_properties,
-        )
-
-    analysis_db = DatabaseWrapper(dbfile)
-
-    date_status, params = _setup_run_get_dates(stereo_run, analysis_db)
-    mosq_age = datetime.utcnow()
-
-
-    dates = sorted([d for d,v in date_status.items() if not v.startswith('ignored')])
-
-    for date in dates:
-        now = datetime.utcnow()
-        if (now - mosq_age).total_seconds() > mosq_poll_interval:
-            logging.info('Updating mosq list')
-            mosq = _get_mosix_jobs()
-            mosq_age = now
-            params['mosq'] = mosq
+def _includes_step(begin, end, name):
+    step_id = Step.names[name]
+    return (begin is None or Step.names[begin] <= step_id) and (end is None or step_id <= Step.names[end])
 
+follow_timeout = 60 # seconds to wait for a job completion before checking again
+def run(stereo_run, begin, end, executor=None, follow=False, tama_batch=None, staging=False):
+    """
+    Process every night of the run once. With follow=True, keep going until no
+    submitted job is left, processing each night again as soon as its last job finishes.
+    tama_batch sets how many trigsets go into each TAMA job (see raw_to_dst.tama_batch_size).
+    With staging=True, raw files are copied to local scratch one night ahead of TAMA.
+    """
+    # Initialization
+    logs = os.path.join(stereo_run.run_path, 'logs')
+    metrics = JobMetrics()
+    runner.metrics = metrics # programs run locally are measured too
+    tracker = JobTracker(executor or get_executor('mosix'), os.path.join(logs, 'jobs.db'), os.path.join(logs, 'sentinels'),
+        metrics=metrics)
+    writer = None
+    stager = None
+    try:
+        completed = Queue.Queue()
+        tracker.on_complete(lambda job_id, returncode, tag: completed.put(tag))
+        model = stereo_run.params.model
+        source = stereo_run.specific_run
+        dbfile = os.path.join(stereo_run.analysis_path, 'tafd_analysis.db')
+        if not os.path.exists(dbfile):
+            base_properties = (
+                ('ROOTPATH', stereo_run.rootpath),
+                ('ANALYSIS', stereo_run.name),
+                ('DESCRIPTION', 'GDAS atmosphere, "joint" geometry, calibration 1.4, correct molecular atmosphere lookup'),
+                ('DATAPATH', stereo_run.tafd_data),
+            )
+
+            tafd_analysis.init(
+                dbfile=dbfile,
+                properties=base_properties,
+            )
+
+        analysis_db = DatabaseWrapper(dbfile, read_only=True)
+        writer = DatabaseWriter(dbfile)
+
+        date_status, params = _setup_run_get_dates(stereo_run, analysis_db, tracker, tama_batch)
+        stage_ahead = staging and _includes_step(begin, end, STEPS.RUN_TAMA)
+        if stage_ahead:
+            params['stager'] = stager = Stager(busy=tracker.active_tags) # queued TAMA commands name staged files
+
+        def _process(date):
+            try:
+                date_status[date] = process_night(date, params, start_code=begin, end_code=end)
+            except Exception as e:
+                date_status[date] = 'exception'
+                logging.warn('Exception encountered: %s', e)
+                #raise
+
+            if date_status[date] in ignorable_night_reasons:
+                logging.info('This date will be ignored in future runs: %s.', date)
+                writer.insert_row('INSERT INTO StereoIgnoreNights VALUES(?, ?, ?)', (date, date_status[date], stereo_run.modelsource))
+
+        dates = sorted([d for d,v in date_status.items() if not v.startswith('ignored')])
+
+        if stage_ahead and dates:
+            raw_to_dst.prefetch_tama(dates[0], params)
+        for i, date in enumerate(dates):
+            if stage_ahead and i + 1 < len(dates):
+                raw_to_dst.prefetch_tama(dates[i + 1], params)
+            _process(date)
+
+        while follow and tracker.active():
+            try:
+                date = completed.get(timeout=follow_timeout)
+            except Queue.Empty:
+                # a job killed before writing its sentinel would otherwise be waited for forever
+                try:
+                    tracker.reconcile()
+                except Exception as err:
+                    logging.warn('Could not reconcile jobs with the executor: %s', err)
+                continue
+            if date in dates and date not in tracker.active_tags():
+                logging.info('All jobs finished for %s; processing again', date)
+                _process(date)
+    finally:
+        # the writer thread is a daemon: without close() its queued inserts are lost
         try:
-            date_status[date] = process_night(date, params, start_code=begin, end_code=end)
-        except Exception as e:
-            date_status[date] = 'exception'
-            logging.warn('Exception encountered: %s', e)
-            #raise
-
-        if date_status[date] in ignorable_night_reasons:
-            logging.info('This date will be ignored in future runs: %s.', date)
-            analysis_db.insert_row('INSERT INTO StereoIgnoreNights VALUES(?, ?, ?)', (date, date_status[date], stereo_run.modelsource))
-
+            if writer is not None:
+                writer.close()
+        finally:
+            if stager is not None:
+                stager.close()
+            transfer.shutdown() # output still being published to /tama_*
+            tracker.close()
     return date_status, params
 
 def report(date_status):
@@ -12,7 +12,7 @@ def compile_dump_profs(stereo_run, cwd, destination):
 def compile_dump_tuples(stereo_run, cwd, destination):
     template_name = 'dumpst_template.c'
     dedx_model = stereo_run.params.dedx_model
-    db_vars = stereo_run.db.retrieve('SELECT p_mec_a0, p_mec_a1, p_mec_a2 FROM Models WHERE dedx_model={}'.format(dedx_model))[0]
+    db_vars = stereo_run.db.retrieve('SELECT p_mec_a0, p_mec_a1, p_mec_a2 FROM Models WHERE dedx_model=?', (dedx_model,))[0]
     replacements = {
         '_META_REPLACE_MEC_A0_': str(db_vars[0]),
         '_META_REPLACE_MEC_A1_': str(db_vars[1]),
@@ -6,7 +6,7 @@ import subprocess as sp
 DEDX_VARS = re.compile('(?:^ +const real_t )(c\d|shower_average)(?= =)')
 def modify_utafd(cwd, stereo_run):
     dedx_model = stereo_run.params.dedx_model
-    db_vars = stereo_run.db.retrieve('SELECT c1, c2, c3, c4, c5, alpha_avg, name FROM Models WHERE dedx_model={}'.format(dedx_model))[0]
+    db_vars = stereo_run.db.retrieve('SELECT c1, c2, c3, c4, c5, alpha_avg, name FROM Models WHERE dedx_model=?', (dedx_model,))[0]
     replacements = {
         'c1': db_vars[0],
         'c2': db_vars[1],
@@ -0,0 +1,74 @@
+# services/jobs
+# Run shell commands as batch jobs through an interchangeable backend ("executor"):
+# the MOSIX cluster, a pool of processes on this machine, or a fake for tests.
+# Every executor offers the same submit/poll/cancel API, identifying jobs by an
+# ID chosen by the caller (MOSIX requires a positive integer below 2**31).
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+UNKNOWN = 'unknown'
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class Executor(object):
+    """
+    Base class for executors. Subclasses implement submit, poll and cancel.
+    """
+    def submit(self, job_id, cmd, stdout=None, stderr=None, memory_mb=None, tag=None, executable=None, input_size=None, units=None):
+        """
+        Queue the shell command cmd under job_id, writing its output to the stdout and
+        stderr files (stderr=None sends both to stdout). memory_mb is the most memory
+        the job may need. tag is kept only by executors that report completions
+        (see tracker.py), and executable, input_size and units (the name of the program
+        run, a measure of its input, and how many like runs of it the job makes) only by
+        those that record job metrics. Return job_id.
+        """
+        raise NotImplementedError
+
+    def memory_mb(self, executable, input_size=None, default=None):
+        """
+        Return the memory to request for a run of executable on input_size. Executors
+        that record job metrics base this on past runs; others return default.
+        """
+        return default
+
+    def poll(self, job_id):
+        """
+        Return the state of job_id: QUEUED, RUNNING, DONE, FAILED, CANCELLED, or UNKNOWN.
+        """
+        raise NotImplementedError
+
+    def cancel(self, job_id):
+        raise NotImplementedError
+
+    def active(self):
+        """
+        Return the set of IDs of jobs that are queued or running.
+        """
+        raise NotImplementedError
+
+    def __contains__(self, job_id):
+        return job_id in self.active()
+
+    def close(self):
+        pass
+
+
+def get_executor(name='mosix', **kwargs):
+    """
+    Make an executor by name: 'mosix', 'local', or 'fake'. Keyword arguments go to its constructor.
+    """
+    if name == 'mosix':
+        from .mosix import MosixExecutor
+        return MosixExecutor(**kwargs)
+    if name == 'local':
+        from .local import LocalExecutor
+        return LocalExecutor(**kwargs)
+    if name == 'fake':
+        from .fake import FakeExecutor
+        return FakeExecutor(**kwargs)
+    raise ValueError('Unknown executor: {}'.format(name))
@@ -0,0 +1,42 @@
+# fake.py
+# Executor that runs nothing, for exercising job submission logic in tests.
+
+from . import Executor, QUEUED, RUNNING, DONE, FAILED, CANCELLED, UNKNOWN, ACTIVE_STATES
+
+
+class FakeExecutor(Executor):
+    """
+    Records each submission in submitted, as (job_id, cmd, stdout, stderr, memory_mb).
+    Jobs stay QUEUED until start() or finish() is called for them, unless outcome is
+    given: a function of (job_id, cmd) returning the exit status each job finishes with
+    as soon as it is submitted (0 for DONE, anything else for FAILED).
+    """
+    def __init__(self, outcome=None):
+        self.outcome = outcome
+        self.submitted = []
+        self.returncodes = {}
+        self._states = {}
+
+    def submit(self, job_id, cmd, stdout=None, stderr=None, memory_mb=None, tag=None, executable=None, input_size=None, units=None):
+        self.submitted.append((job_id, cmd, stdout, stderr, memory_mb))
+        self._states[job_id] = QUEUED
+        if self.outcome is not None:
+            self.finish(job_id, self.outcome(job_id, cmd))
+        return job_id
+
+    def start(self, job_id):
+        self._states[job_id] = RUNNING
+
+    def finish(self, job_id, returncode=0):
+        self.returncodes[job_id] = returncode
+        self._states[job_id] = DONE if returncode == 0 else FAILED
+
+    def poll(self, job_id):
+        return self._states.get(job_id, UNKNOWN)
+
+    def cancel(self, job_id):
+        if self._states.get(job_id) in ACTIVE_STATES:
+            self._states[job_id] = CANCELLED
+
+    def active(self):
+        return set(job_id for job_id, state in self._states.items() if state in ACTIVE_STATES)
@@ -0,0 +1,111 @@
+# local.py
+# Executor running jobs as subprocesses of this machine, a bounded number at a
+# time, each limited in CPU time and memory with setrlimit.
+
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import subprocess
+import threading
+from multiprocessing.pool import ThreadPool
+
+from . import Executor, QUEUED, RUNNING, DONE, FAILED, CANCELLED, UNKNOWN, ACTIVE_STATES
+
+
+def _limits(memory_mb, cpu_seconds):
+    """
+    A preexec_fn for subprocess that applies the memory and CPU-time limits in the child,
+    and puts it in a process group of its own so that cancel() reaches everything it starts.
+    """
+    def apply():
+        os.setsid()
+        if memory_mb:
+            size = int(memory_mb) * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (size, size))
+        if cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_seconds), int(cpu_seconds)))
+    return apply
+
+
+class LocalExecutor(Executor):
+    """
+    Runs up to workers jobs at once (default: one per CPU). Each job gets an address-space
+    limit of its memory_mb (or default_memory_mb) and a CPU-time limit of cpu_seconds.
+    Pending jobs are started in submission order.
+    """
+    def __init__(self, workers=None, default_memory_mb=None, cpu_seconds=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.default_memory_mb = default_memory_mb
+        self.cpu_seconds = cpu_seconds
+        self._pool = ThreadPool(self.workers)
+        self._lock = threading.Lock()
+        self._states = {}
+        self._procs = {}
+        self.returncodes = {}
+
+    def submit(self, job_id, cmd, stdout=None, stderr=None, memory_mb=None, tag=None, executable=None, input_size=None, units=None):
+        with self._lock:
+            assert self._states.get(job_id) not in ACTIVE_STATES, 'job {} already active'.format(job_id)
+            self._states[job_id] = QUEUED
+        self._pool.apply_async(self._run, (job_id, cmd, stdout, stderr, memory_mb or self.default_memory_mb))
+        return job_id
+
+    def _run(self, job_id, cmd, stdout, stderr, memory_mb):
+        with self._lock:
+            if self._states.get(job_id) != QUEUED:
+                return # cancelled before it started
+            self._states[job_id] = RUNNING
+        out = open(stdout or '/dev/null', 'w')
+        err = open(stderr, 'w') if stderr else subprocess.STDOUT
+        try:
+            proc = subprocess.Popen(cmd, shell=True, stdout=out, stderr=err, close_fds=True,
+                preexec_fn=_limits(memory_mb, self.cpu_seconds))
+            with self._lock:
+                self._procs[job_id] = proc
+            returncode = proc.wait()
+        except OSError as error:
+            logging.error('Could not start job %s: %s', job_id, error)
+            returncode = None
+        finally:
+            out.close()
+            if stderr:
+                err.close()
+        with self._lock:
+            self._procs.pop(job_id, None)
+            self.returncodes[job_id] = returncode
+            if self._states.get(job_id) != CANCELLED:
+                self._states[job_id] = DONE if returncode == 0 else FAILED
+
+    def poll(self, job_id):
+        with self._lock:
+            return self._states.get(job_id, UNKNOWN)
+
+    def cancel(self, job_id):
+        with self._lock:
+            if self._states.get(job_id) not in ACTIVE_STATES:
+                return
+            self._states[job_id] = CANCELLED
+            proc = self._procs.get(job_id)
+        if proc is not None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass # already exited
+
+    def active(self):
+        with self._lock:
+            return set(job_id for job_id, state in self._states.items() if state in ACTIVE_STATES)
+
+    def wait(self):
+        """
+        Block until every submitted job has finished. The executor takes no more jobs.
+        """
+        self._pool.close()
+        self._pool.join()
+
+    def close(self):
+        for job_id in self.active():
+            self.cancel(job_id)
+        self.wait()
@@ -0,0 +1,59 @@
+# measure.py
+# Run a shell command and write its wall time, CPU time, peak resident set size and
+# exit status as JSON. tracker.py wraps jobs with this script, so it runs on whichever
+# node runs the job and must not import anything from this repository.
+#
+# Usage: python measure.py OUTFILE COMMAND
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def measure(cmd):
+    """
+    Run cmd with sh and wait for it with wait4, which reports the resources used by
+    it and by every descendant it waited for. Return a dict of the measurements.
+    """
+    start = time.time()
+    proc = subprocess.Popen(['/bin/sh', '-c', cmd])
+    _, status, usage = os.wait4(proc.pid, 0)
+    if os.WIFSIGNALED(status):
+        returncode = 128 + os.WTERMSIG(status) # as the shell reports it
+    else:
+        returncode = os.WEXITSTATUS(status)
+    return {
+        'wall': time.time() - start,
+        'cpu': usage.ru_utime + usage.ru_stime,
+        'maxrss_kb': usage.ru_maxrss, # kilobytes on Linux
+        'returncode': returncode,
+    }
+
+
+def read(path):
+    """
+    Return the measurements written to path, or None if there are none.
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def main(argv):
+    if len(argv) != 3:
+        sys.stderr.write('Usage: python measure.py OUTFILE COMMAND\n')
+        return 2
+    outfile, cmd = argv[1:]
+    result = measure(cmd)
+    with open(outfile + '.tmp', 'w') as f:
+        json.dump(result, f)
+    os.rename(outfile + '.tmp', outfile)
+    return result['returncode']
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,122 @@
+# metrics.py
+# History of measured job resources (see measure.py), and memory requests sized
+# from it instead of fixed guesses.
+
+import logging
+import math
+import time
+
+from db import migrations
+from db.database_wrapper import DatabaseWrapper
+
+METRICS_DB = 'db/job_metrics.db'
+
+PERCENTILE = 95 # of past peak RSS to request
+HEADROOM = 1.25 # factor applied on top of the percentile
+MIN_SAMPLES = 5 # successful runs needed before the history is trusted
+MAX_SAMPLES = 200 # most recent runs considered
+MIN_MEMORY_MB = 64
+
+
+def size_class(input_size):
+    """
+    Runs are compared with others whose input size is within the same power of two.
+    """
+    if input_size is None:
+        return None
+    return int(math.log(max(input_size, 1), 2))
+
+
+def percentile(values, p):
+    """
+    The p-th percentile of the sorted list values, interpolating between neighbors.
+    """
+    rank = (len(values) - 1) * p / 100.
+    low = int(math.floor(rank))
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class JobMetrics(object):
+    """
+    Wall time, CPU time and peak RSS of every measured job, by executable and input size.
+    """
+    def __init__(self, dbfile=METRICS_DB):
+        migrations.migrate(dbfile, 'job_metrics')
+        self.db = DatabaseWrapper(dbfile)
+
+    def record(self, job_id, executable, input_size, measured, units=None):
+        """
+        Store the measurements (a dict read by measure.read) of one finished job,
+        which made units like runs of executable (one if None), e.g. TAMA trigsets.
+        """
+        self.db.insert_row('INSERT INTO JobMetrics VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            str(job_id),
+            executable,
+            input_size,
+            size_class(input_size),
+            measured['wall'],
+            measured['cpu'],
+            measured['maxrss_kb'],
+            measured['returncode'],
+            time.time(),
+            units,
+        ))
+
+    def peak_rss_kb(self, executable, input_size=None, limit=MAX_SAMPLES):
+        """
+        Return the sorted peak RSS values of the most recent successful runs of
+        executable on inputs of the same size class.
+        """
+        rows = self.db.retrieve(
+            'SELECT maxrss_kb FROM JobMetrics WHERE executable=? AND size_class IS ? AND returncode=0 ORDER BY finished DESC LIMIT ?',
+            (executable, size_class(input_size), limit),
+        )
+        return sorted(row[0] for row in rows)
+
+    def suggest_memory_mb(self, executable, input_size=None, default=None,
+            p=PERCENTILE, headroom=HEADROOM, min_samples=MIN_SAMPLES):
+        """
+        Return the memory in MB to request for executable on input_size: the p-th
+        percentile of past peak RSS times headroom, or default with too little history.
+        """
+        values = self.peak_rss_kb(executable, input_size)
+        if len(values) < min_samples:
+            return default
+        memory_mb = max(int(math.ceil(percentile(values, p) * headroom / 1024.)), MIN_MEMORY_MB)
+        logging.debug('Memory for %s (input size %s): %s MB from %s runs', executable, input_size, memory_mb, len(values))
+        return memory_mb
+
+    def typical(self, executable, input_size=None, limit=MAX_SAMPLES):
+        """
+        Return (mean wall, mean cpu, runs) of the most recent successful runs of
+        executable on inputs of the same size class, or of any size if there are
+        none of that class; None if executable has never run successfully.
+        Times are per unit (see record), so one TAMA trigset however they were batched.
+        """
+        for cls_clause, params in [('AND size_class IS ?', (size_class(input_size),)), ('', ())]:
+            rows = self.db.retrieve(
+                'SELECT avg(wall), avg(cpu), count() FROM (SELECT wall / ifnull(units, 1) AS wall, cpu / ifnull(units, 1) AS cpu FROM JobMetrics WHERE executable=? {} AND returncode=0 ORDER BY finished DESC LIMIT ?)'.format(cls_clause),
+                (executable,) + params + (limit,),
+            )
+            if rows and rows[0][2]:
+                return rows[0]
+        return None
+
+    def summary(self):
+        """
+        Return (executable, size_class, runs, mean wall, mean cpu, max peak RSS in kB) for each kind of job.
+        """
+        return self.db.retrieve(
+            'SELECT executable, size_class, count(), avg(wall), avg(cpu), max(maxrss_kb) FROM JobMetrics GROUP BY executable, size_class ORDER BY executable, size_class'
+        )
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Summarize recorded job metrics.')
+    parser.add_argument('dbfile', nargs='?', default=METRICS_DB)
+    args = parser.parse_args()
+    for executable, cls, runs, wall, cpu, maxrss in JobMetrics(args.dbfile).summary():
+        print '{:20} size 2^{:<4} {:6} runs  wall {:8.1f} s  cpu {:8.1f} s  peak {:8.1f} MB'.format(
+            str(executable), str(cls), runs, wall, cpu, maxrss / 1024.)
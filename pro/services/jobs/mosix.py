@@ -0,0 +1,94 @@
+# mosix.py
+# Executor submitting jobs to the MOSIX cluster with mosenv, and reading their
+# state from "mosq -j listall".
+
+import logging
+import subprocess
+import time
+
+from . import Executor, QUEUED, RUNNING, DONE, CANCELLED, UNKNOWN
+
+POLL_INTERVAL = 15 # seconds between reads of the MOSIX queue
+SUBMIT_GRACE = 300 # seconds a submitted job may take to appear in the MOSIX queue
+DEFAULT_MEMORY_MB = 1024
+
+
+def list_jobs():
+    """
+    Obtain a list of queued/running mosix jobs and return a dict with
+    job IDs as keys, and lists of (process name, status) as values.
+    """
+    mosq = subprocess.check_output('mosq -j listall'.split())
+    jobs = {}
+    for line in mosq.strip().split('\n')[1:]:
+        l = line.split()
+        pid, pri, jobid = [l[i] for i in [0, 4, 5]]
+        jobid = int(jobid)
+        try:
+            jobs[jobid].append((pid, pri))
+        except KeyError:
+            jobs[jobid] = [(pid, pri)]
+
+    return jobs
+
+
+class MosixExecutor(Executor):
+    """
+    The queue is read at most once per poll_interval seconds; jobs listed by mosq
+    count as running, and jobs submitted but not yet listed as queued, until they
+    are listed or submit_grace seconds have passed. A job this executor has seen
+    that is no longer listed is reported DONE, since MOSIX keeps no exit status;
+    check its output to tell success from failure.
+    """
+    def __init__(self, poll_interval=POLL_INTERVAL, submit_grace=SUBMIT_GRACE):
+        self.poll_interval = poll_interval
+        self.submit_grace = submit_grace
+        self._jobs = {}
+        self._read_at = None
+        self._submitted = {} # job ID: time submitted
+        self._seen = set()
+        self._cancelled = set()
+
+    def _queue(self):
+        now = time.time()
+        if self._read_at is None or now - self._read_at > self.poll_interval:
+            logging.info('Updating mosq list')
+            self._jobs = list_jobs()
+            self._read_at = now
+            # mosenv may take a while to register a job; until then it only counts as submitted
+            for job_id, submitted_at in self._submitted.items():
+                if job_id in self._jobs or now - submitted_at > self.submit_grace:
+                    del self._submitted[job_id]
+            self._seen.update(self._jobs)
+        return self._jobs
+
+    def submit(self, job_id, cmd, stdout=None, stderr=None, memory_mb=None, tag=None, executable=None, input_size=None, units=None):
+        assert 0 < job_id < 2147483648 # needs to fit inside a 32-bit signed integer
+        # run by /bin/sh, where '&>' would put mosenv in the background instead
+        redirect = '> {} 2> {}'.format(stdout, stderr) if stderr else '> {0} 2>&1'.format(stdout or '/dev/null')
+        mos_cmd = 'mosenv -q -J{} -b -l -m{} -e {} {}'.format(job_id, memory_mb or DEFAULT_MEMORY_MB, cmd, redirect)
+        logging.debug('Submitting: %s', mos_cmd)
+        subprocess.Popen(mos_cmd, shell=True)
+        self._submitted[job_id] = time.time()
+        self._seen.add(job_id)
+        self._cancelled.discard(job_id)
+        return job_id
+
+    def poll(self, job_id):
+        if job_id in self._cancelled:
+            return CANCELLED
+        queue = self._queue()
+        if job_id in self._submitted:
+            return QUEUED
+        if job_id in queue:
+            return RUNNING
+        return DONE if job_id in self._seen else UNKNOWN
+
+    def cancel(self, job_id):
+        subprocess.call('moskillall -J{}'.format(job_id).split())
+        self._cancelled.add(job_id)
+        self._submitted.pop(job_id, None)
+        self._jobs.pop(job_id, None)
+
+    def active(self):
+        return set(self._queue()) | set(self._submitted)
@@ -0,0 +1,239 @@
+# tracker.py
+# Follow batch jobs to completion without asking the scheduler. Each command is
+# wrapped so that it leaves a sentinel file holding its exit status; submissions
+# and outcomes are kept in a local SQLite ledger, so jobs still running are
+# recognized across restarts of the orchestrator. Given a JobMetrics, each job is
+# also measured (see measure.py) and its resources recorded when it finishes.
+
+import logging
+import os
+import pipes
+import sys
+import threading
+import time
+
+from db import migrations
+from db.database_wrapper import DatabaseWrapper
+
+from . import Executor, QUEUED, RUNNING, DONE, FAILED, CANCELLED, UNKNOWN
+from . import measure
+
+SENTINEL_SUFFIX = '.exit'
+METRICS_SUFFIX = '.metrics'
+MEASURE_SCRIPT = os.path.splitext(os.path.abspath(measure.__file__))[0] + '.py'
+WATCH_INTERVAL = 1.0 # seconds between listings of the sentinel directory
+
+
+class JobTracker(Executor):
+    """
+    Wraps another executor. Submitted jobs are recorded in the ledger at ledger_file,
+    and a background thread watches sentinel_dir (which must be visible to the nodes
+    running the jobs) for their exit-status files. Functions registered with
+    on_complete are called from that thread as callback(job_id, returncode, tag)
+    as soon as each job's sentinel appears; use wait() to block until then.
+
+    Job IDs are compared as strings in the ledger; tag is any value the caller wants
+    back on completion (e.g. the night a job belongs to).
+
+    With metrics (a JobMetrics), every job runs under measure.py, its wall time, CPU time
+    and peak RSS are recorded under the executable, input_size and units given to submit, and
+    memory_mb() sizes requests from that history. The executable defaults to the
+    first word of the command.
+    """
+    def __init__(self, executor, ledger_file, sentinel_dir, watch_interval=WATCH_INTERVAL, metrics=None):
+        self.executor = executor
+        self.metrics = metrics
+        self.sentinel_dir = sentinel_dir
+        self.watch_interval = watch_interval
+        if not os.path.isdir(sentinel_dir):
+            os.makedirs(sentinel_dir)
+        migrations.migrate(ledger_file, 'job_ledger')
+        self.ledger = DatabaseWrapper(ledger_file)
+
+        self._callbacks = []
+        self._condition = threading.Condition()
+        self._pending = {}
+        for job_id, tag in self.ledger.retrieve('SELECT job_id, tag FROM Jobs WHERE finished IS NULL'):
+            self._pending[job_id] = (job_id, tag)
+        if self._pending:
+            logging.info('%s job(s) from the ledger still pending', len(self._pending))
+
+        self._stop = threading.Event()
+        self._watcher = threading.Thread(target=self._watch, name='JobTracker')
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def _sentinel(self, job_id):
+        return os.path.join(self.sentinel_dir, str(job_id) + SENTINEL_SUFFIX)
+
+    def _metrics_file(self, job_id):
+        return os.path.join(self.sentinel_dir, str(job_id) + METRICS_SUFFIX)
+
+    def _wrap(self, job_id, cmd):
+        """
+        Run cmd in a subshell (so that even its own exit is caught), then write its
+        exit status to the sentinel atomically.
+        """
+        sentinel = self._sentinel(job_id)
+        if self.metrics is not None:
+            cmd = '{} {} {} {}'.format(sys.executable, MEASURE_SCRIPT, pipes.quote(self._metrics_file(job_id)), pipes.quote(cmd))
+        script = '(\n{0}\n)\nrc=$?\necho $rc > {1}.tmp && mv {1}.tmp {1}\nexit $rc'.format(cmd, pipes.quote(sentinel))
+        return 'sh -c {}'.format(pipes.quote(script))
+
+    def on_complete(self, callback):
+        self._callbacks.append(callback)
+
+    def memory_mb(self, executable, input_size=None, default=None):
+        if self.metrics is None:
+            return default
+        return self.metrics.suggest_memory_mb(executable, input_size, default)
+
+    def submit(self, job_id, cmd, stdout=None, stderr=None, memory_mb=None, tag=None, executable=None, input_size=None, units=None):
+        for path in [self._sentinel(job_id), self._metrics_file(job_id)]:
+            if os.path.exists(path):
+                os.remove(path)
+        if executable is None and cmd.split():
+            executable = os.path.basename(cmd.split()[0])
+        with self._condition:
+            self._pending[str(job_id)] = (job_id, tag)
+        self.ledger.delete_rows('DELETE FROM Jobs WHERE job_id=?', ((str(job_id),),))
+        self.ledger.insert_row(
+            'INSERT INTO Jobs(job_id, tag, cmd, submitted, executable, input_size, units) VALUES(?, ?, ?, ?, ?, ?, ?)',
+            (str(job_id), tag, cmd, time.time(), executable, input_size, units),
+        )
+        return self.executor.submit(job_id, self._wrap(job_id, cmd), stdout=stdout, stderr=stderr, memory_mb=memory_mb)
+
+    def _watch(self):
+        while not self._stop.wait(self.watch_interval):
+            try:
+                self.check()
+            except Exception as err:
+                logging.error('Error checking job sentinels: %s', err)
+
+    def check(self):
+        """
+        Record every job whose sentinel has appeared, and call the callbacks for it.
+        Runs in the watcher thread, but may also be called directly.
+        """
+        try:
+            names = os.listdir(self.sentinel_dir)
+        except OSError:
+            return
+        finished = []
+        with self._condition:
+            for name in names:
+                key = name[:-len(SENTINEL_SUFFIX)]
+                if name.endswith(SENTINEL_SUFFIX) and key in self._pending:
+                    finished.append((key, self._pending.pop(key)))
+        for key, (job_id, tag) in finished:
+            sentinel = os.path.join(self.sentinel_dir, key + SENTINEL_SUFFIX)
+            try:
+                with open(sentinel, 'r') as f:
+                    returncode = int(f.read().strip())
+            except (IOError, ValueError):
+                returncode = None
+            self._finish(key, job_id, tag, returncode)
+            os.remove(sentinel)
+
+    def _finish(self, key, job_id, tag, returncode):
+        self.ledger.update_row('UPDATE Jobs SET finished=?, returncode=? WHERE job_id=?', (time.time(), returncode, key))
+        logging.info('Job %s finished with status %s', job_id, returncode)
+        if self.metrics is not None:
+            self._record_metrics(key)
+        with self._condition:
+            self._condition.notify_all()
+        for callback in self._callbacks:
+            try:
+                callback(job_id, returncode, tag)
+            except Exception as err:
+                logging.error('Error in completion callback for job %s: %s', job_id, err)
+
+    def _record_metrics(self, key):
+        path = os.path.join(self.sentinel_dir, key + METRICS_SUFFIX)
+        measured = measure.read(path)
+        if measured is None:
+            return
+        rows = self.ledger.retrieve('SELECT executable, input_size, units FROM Jobs WHERE job_id=?', (key,))
+        executable, input_size, units = rows[0] if rows else (None, None, None)
+        try:
+            self.metrics.record(key, executable, input_size, measured, units)
+        except Exception as err:
+            logging.error('Could not record metrics of job %s: %s', key, err)
+        else:
+            os.remove(path)
+
+    def poll(self, job_id):
+        key = str(job_id)
+        with self._condition:
+            pending = key in self._pending
+        if pending:
+            return RUNNING if self.executor.poll(job_id) == RUNNING else QUEUED
+        rows = self.ledger.retrieve('SELECT finished, returncode FROM Jobs WHERE job_id=?', (key,))
+        if not rows:
+            return UNKNOWN
+        finished, returncode = rows[0]
+        if returncode == 0:
+            return DONE
+        return CANCELLED if finished is not None and returncode is None else FAILED
+
+    def cancel(self, job_id):
+        self.executor.cancel(job_id)
+        with self._condition:
+            entry = self._pending.pop(str(job_id), None)
+        if entry is not None:
+            self._finish(str(job_id), entry[0], entry[1], None)
+
+    def reconcile(self):
+        """
+        Ask the executor once which jobs it still has, and mark any pending job it has
+        lost (e.g. killed before writing its sentinel) as finished with no exit status.
+        """
+        self.check()
+        active = set(str(job_id) for job_id in self.executor.active())
+        with self._condition:
+            lost = [(key, entry) for key, entry in self._pending.items() if key not in active]
+            for key, entry in lost:
+                del self._pending[key]
+        for key, (job_id, tag) in lost:
+            logging.warn('Job %s is no longer known to the executor', job_id)
+            self._finish(key, job_id, tag, None)
+
+    def active(self):
+        with self._condition:
+            return set(job_id for job_id, tag in self._pending.values())
+
+    def active_tags(self):
+        """
+        Return the set of tags of jobs not yet finished.
+        """
+        with self._condition:
+            return set(tag for job_id, tag in self._pending.values())
+
+    def __contains__(self, job_id):
+        with self._condition:
+            return str(job_id) in self._pending
+
+    def wait(self, job_ids=None, timeout=None):
+        """
+        Block until the given jobs (default: all pending) have finished, or timeout
+        seconds have passed. Return True if they all finished.
+        """
+        keys = None if job_ids is None else set(str(job_id) for job_id in job_ids)
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while True:
+                remaining = set(self._pending) if keys is None else keys & set(self._pending)
+                if not remaining:
+                    return True
+                if deadline is not None and time.time() >= deadline:
+                    return False
+                wait = self.watch_interval * 10 if deadline is None else min(self.watch_interval * 10, deadline - time.time())
+                self._condition.wait(max(wait, 0))
+
+    def close(self):
+        """
+        Stop watching for sentinels. The wrapped executor, and any jobs it is running, are left alone.
+        """
+        self._stop.set()
+        self._watcher.join()
+        self.check()
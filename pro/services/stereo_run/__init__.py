@@ -94,9 +94,9 @@ class StereoRun(object):
         self._build_templates()
         logging.info("TODO: generate plan for run, report to user")
 
-    def stereo_run(self, date_list, begin, end):
+    def stereo_run(self, date_list, begin, end, executor=None, follow=False, tama_batch=None, staging=False):
         self.dates = self._read_date_list(date_list)
-        date_status, params = run_stereo_analysis.run(self, begin, end)
+        date_status, params = run_stereo_analysis.run(self, begin, end, executor=executor, follow=follow, tama_batch=tama_batch, staging=staging)
         self.status_dates = run_stereo_analysis.report(date_status)
 
     def _read_date_list(self, date_list):
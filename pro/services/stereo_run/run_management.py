@@ -9,13 +9,11 @@ def find_or_create_base_run(stereo_run, supplied_name):
     db = stereo_run.db
     params = stereo_run.params
 
-    sql = 'SELECT name, path FROM StereoRuns WHERE fdplaneconfig=\"{0}\" AND model=\"{1}\"'.format(
-            params.fdplane_config,
-            params.model,
-    )
-    logging.debug('sql: %s', sql)
+    sql = 'SELECT name, path FROM StereoRuns WHERE fdplaneconfig=? AND model=?'
+    sql_params = (params.fdplane_config, params.model)
+    logging.debug('sql: %s %s', sql, sql_params)
 
-    matching_runs = db.retrieve(sql)
+    matching_runs = db.retrieve(sql, sql_params)
 
     name_match_paths = []
     for name, path in matching_runs:
@@ -58,14 +56,14 @@ def find_or_create_specific_run(stereo_run):
 
     is_mc = params.is_mc
     if is_mc:
-        sql = 'SELECT name, species FROM MCStereoRuns WHERE stereorun_path=\"{0}\"'.format(base_run)
+        sql = 'SELECT name, species FROM MCStereoRuns WHERE stereorun_path=?'
         run_name = '{}-{}'.format(params.name, params.dtime)
     else:
-        sql = 'SELECT name FROM DataStereoRuns WHERE stereorun_path=\"{0}\"'.format(base_run)
+        sql = 'SELECT name FROM DataStereoRuns WHERE stereorun_path=?'
         run_name = params.name
-    logging.debug('sql: %s', sql)
+    logging.debug('sql: %s (%s)', sql, base_run)
 
-    matching_runs = db.retrieve(sql)
+    matching_runs = db.retrieve(sql, (base_run,))
     for row in matching_runs:
         if row[0] == run_name:
             logging.info('Found a matching specific run for %s', run_name)
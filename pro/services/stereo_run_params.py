@@ -21,7 +21,7 @@ class StereoRunParams(object):
 
         self.geometry_dsts = self._find_geometry_dsts()
         self.model = model or self._pick_model()
-        self.dedx_model = self.db.retrieve('SELECT dedx_model FROM Models where name="{}"'.format(self.model))[0][0]
+        self.dedx_model = self.db.retrieve('SELECT dedx_model FROM Models where name=?', (self.model,))[0][0]
 
         self.is_mc = is_mc
         if self.is_mc:
@@ -45,9 +45,9 @@ class StereoRunParams(object):
     def _validate_fdplane_cfg(self, config):
         if not config:
             raise Exception(u'Bad config: {0}'.format(config))
-        sql = 'SELECT calibration, geometryset FROM FDPlaneConfigs where name="{0}"'.format(config)
-        logging.debug("sql: %s", sql)
-        fdpcs = self.db.retrieve(sql)
+        sql = 'SELECT calibration, geometryset FROM FDPlaneConfigs where name=?'
+        logging.debug("sql: %s (%s)", sql, config)
+        fdpcs = self.db.retrieve(sql, (config,))
         if not fdpcs:
             logging.error("no FDPlaneConfigs found named %s", config)
             raise Exception
@@ -75,7 +75,7 @@ class StereoRunParams(object):
     def _generate_name(self):
         if not self.is_mc:
             return "nature"
-        species = self.db.retrieve('SELECT name FROM Species WHERE corsika_id={0}'.format(self.species))[0][0]
+        species = self.db.retrieve('SELECT name FROM Species WHERE corsika_id=?', (self.species,))[0][0]
         return 'mc-{0}'.format(species)
 
     def _find_geometry_dsts(self):
@@ -83,9 +83,8 @@ class StereoRunParams(object):
             dsts_by_site = self.geometry.items()
         else:
             dsts_by_site = self.db.retrieve(
-                'SELECT S.shortname, G.dstfile FROM SiteGeometry G JOIN Sites S ON G.site=S.ID WHERE G.geometryset="{0}"'.format(
-                    self.geometry
-                )
+                'SELECT S.shortname, G.dstfile FROM SiteGeometry G JOIN Sites S ON G.site=S.ID WHERE G.geometryset=?',
+                (self.geometry,),
             )
         dsts = {
             site: os.path.join(
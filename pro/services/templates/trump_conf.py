@@ -65,7 +65,7 @@ standard_replacements = {
 def render_template(stereo_run):
     template = os.path.join(stereo_run.run_path, standard_template_name)
     if not os.path.exists(template):
-        showlib = stereo_run.db.retrieve('SELECT dstfile FROM Showlibs WHERE model=\"{0}\" AND species={1}'.format(
+        showlib = stereo_run.db.retrieve('SELECT dstfile FROM Showlibs WHERE model=? AND species=?', (
             stereo_run.params.model,
             stereo_run.params.species,
         ))[0][0]
@@ -6,9 +6,8 @@
 import logging
 import os
 import re
-import subprocess
 
-from utils import _command
+from utils import runner
 
 # This is produced every time we read a DST file. Strip it from stderr.
 dst_stderr = ' $$$ dst_get_block_ : End of input file reached\n'
@@ -19,18 +18,13 @@ def analyze_and_dump(night, params):
     path = os.path.join(analysis, str(night))
 
     if not os.path.isdir(path): # path may not exist!
-        os.system('mkdir -p {}'.format(path))
+        os.makedirs(path)
 
     stdout = os.path.join(path, 'stereo_log.out.txt')
     stderr = stdout.replace('out.txt', 'err.txt')
-    cmd = 'python {} {} > {} 2> {}'.format(stereo_exe, path, stdout, stderr)
-    #print cmd
-    #return None
-    #out, err = _command(cmd)
-    a = subprocess.Popen(cmd, shell=True)
-    a.wait()
-    out = open(stdout, 'r').read()
-    err = open(stderr, 'r').read()
+    result = runner.run(['python', stereo_exe, path], stdout=stdout, stderr=stderr, executable='stereo.py')
+    out = result.stdout
+    err = result.stderr
 
     if 'Fatal error' in out:
         logging.error('Analysis failed for %s', night)
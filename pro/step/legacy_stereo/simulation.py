@@ -7,7 +7,6 @@
 from prep_fadc.raw_to_dst import _command
 import os
 from glob import glob
-import subprocess
 import re
 from db.fadc_process import _ymdps
 
@@ -48,7 +47,8 @@ def run_trump_sim(night, params):
     analysis = params['path']
     trump_path = os.path.join(analysis, str(night), 'trump')
 
-    if not glob(os.path.join(trump_path, '*.conf')):
+    confs = glob(os.path.join(trump_path, '*.conf'))
+    if not confs:
         return 'no TRUMP conf found'
 
     moslog = os.path.join(analysis, 'logs', 'trump-{}.mosout'.format(night))
@@ -61,17 +61,16 @@ def run_trump_sim(night, params):
         else:
             os.remove(moslog)
 
-    cmd = 'mosenv -q -J{night} -b -l -m320 -e python $TSTA/pro/stereo/simulation/run_simulation.py {trump_path} -geobr {geobr} -geolr {geolr} {no_md} &> {moslog}'.format(
-        night=night,
+    cmd = 'python $TSTA/pro/stereo/simulation/run_simulation.py {trump_path} -geobr {geobr} -geolr {geolr} {no_md}'.format(
         trump_path=trump_path,
         geobr=geometry_dsts['br'],
         geolr=geometry_dsts['lr'],
         no_md='--no_md' if params['stereo_run'].params.skip_md else '',
-        moslog=moslog,
     )
 
-    params['mosq'][night] = ('new', None)
-    subprocess.Popen(cmd, shell=True)
+    memory_mb = params['executor'].memory_mb('run_simulation', len(confs), default=320)
+    params['executor'].submit(night, cmd, stdout=moslog, memory_mb=memory_mb, tag=night,
+        executable='run_simulation', input_size=len(confs))
     return 'added to queue'
 
 def run_md_sim(night, params):
@@ -2,6 +2,8 @@ import argparse
 import os
 import re
 
+from utils import runner
+
 conv_1mev_to_50kev = (1.0 - 0.05*0.045) / (1.0 - 0.045)
 
 def jdn(ymd, sec):
@@ -42,10 +44,11 @@ def make_evt(rtsf, evtfile):
     if len(matches)==0:
         exit(0)
 
-    rtss = os.popen('$TRUMP/bin/rtsparser.run -gluyspect -trigger {0}'.format(rtsf))
+    rtss = runner.check_output('$TRUMP/bin/rtsparser.run -gluyspect -trigger {0}'.format(rtsf),
+        executable='rtsparser.run')
     oldt = ""
     n = 0
-    events = rtss.readlines()
+    events = rtss.splitlines()
     print 'Simulation event count: {0}'.format(len(events))
     for event in events:
         field = re.split('[\s]+', event.strip())
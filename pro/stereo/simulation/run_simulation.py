@@ -5,12 +5,12 @@
 import argparse
 import os
 import re
-import subprocess as sp
 
 from glob import glob
 
 from prep_md import prep_md_sim
 from run_trump import run_trump
+from utils import runner
 
 
 def simulate_night(trump_path, geo_files):
@@ -57,14 +57,13 @@ def generate_mc2k12_mc(md_in, md_dir):
     dst = os.path.join(md_dir, os.path.basename(md_in).replace('.txt_md.in', '.md-sim.dst.gz'))
     outfile = md_in.replace('.txt_md.in', '.utafd.out')
 
-    cmd = '{} -o {} {} &> {}'.format(mc2k12_exe, dst, md_in, outfile)
-    print cmd
-    sp.check_output(cmd, shell=True)
+    cmd = [mc2k12_exe, '-o', dst, md_in]
+    print ' '.join(cmd), '>', outfile
+    runner.run(cmd, stdout=outfile, stderr=runner.STDOUT, capture=False, check=True, executable='mc2k12_main')
     return dst, outfile
 
 def filter_md_output(dst):
-    cmd = 'dstlist {}'.format(dst)
-    output = sp.check_output(cmd, shell=True)
+    output = runner.check_output(['dstlist', dst])
     lines = output.split('\n')[0:]
     events_with_hraw1 = []
     for i, line in enumerate(lines):
@@ -78,8 +77,7 @@ def filter_md_output(dst):
     with open(want, 'w') as wantfile:
         wantfile.write('\n'.join(map(str, events_with_hraw1)))
         wantfile.write('\n')
-    cmd = 'dstsplit -w {} -o {} {}'.format(want, new_dst, dst)
-    sp.check_output(cmd, shell=True)
+    runner.check_output(['dstsplit', '-w', want, '-o', new_dst, dst])
     return new_dst
 
 
@@ -88,16 +86,16 @@ def run_pass2(dst, outfile):
     dst2 = dst.replace('.dst.gz', '.ps2.dst.gz')
 # TODO: see if this needs to be made local
     pass2_exe = '/home/tstroman/UTAFD/build/std-build/release/bin/stps2_main'
-    cmd = '{} -det 34 -o {} {} >> {} 2>&1'.format(pass2_exe, dst2, dst, outfile)
-    sp.check_output(cmd, shell=True)
+    runner.run([pass2_exe, '-det', '34', '-o', dst2, dst], stdout=outfile, stderr=runner.STDOUT, append=True,
+        capture=False, check=True)
     return dst2
 
 def run_pass3(dst2, outfile):
     dst3 = dst2.replace('.md.ps2.dst.gz', '.down.dst.gz')
 # TODO: see if this needs to be made local
     pass3_exe = '/home/tstroman/UTAFD/build/std-build/release/bin/stpln_main'
-    cmd = '{} -det 34 -o {} {} >> {} 2>&1'.format(pass3_exe, dst3, dst2, outfile)
-    sp.check_output(cmd, shell=True)
+    runner.run([pass3_exe, '-det', '34', '-o', dst3, dst2], stdout=outfile, stderr=runner.STDOUT, append=True,
+        capture=False, check=True)
     return dst3
 
 if __name__ == '__main__':
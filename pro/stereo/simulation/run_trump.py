@@ -1,12 +1,12 @@
 import os
 import re
 import shutil
-import subprocess as sp
 
 from collections import defaultdict
 from glob import glob
 
 import utils
+from utils import runner
 
 class NoRTSFile(Exception):
     pass
@@ -48,8 +48,9 @@ def generate_trump_mc(trump_path, regenerate=False):
 
     if regenerate or not os.path.exists(output):
         new_run = True
-        cmd = '{} *.conf &> {}'.format(trump_exe, output)
-        sp.check_output(cmd, shell=True, cwd=trump_path)
+        confs = sorted(os.path.basename(conf) for conf in glob(os.path.join(trump_path, '*.conf')))
+        runner.run([trump_exe] + confs, cwd=trump_path, stdout=output, stderr=runner.STDOUT, capture=False,
+            check=True, executable='trump.run', input_size=len(confs))
 
         rts_files = glob(os.path.join(trump_path, '*', '*.rts'))
         if not rts_files:
@@ -94,8 +95,7 @@ def split_mono_fd_output(site_paths):
         if os.path.getsize(dst) < 100: # TODO: store this elsewhere instead of hard-coding here
             break
 
-        cmd = 'dstdump -{site}raw {dst}'.format(site=site, dst=dst)
-        dump = sp.check_output(cmd, shell=True, stderr=sp.STDOUT)
+        dump = runner.check_output(['dstdump', '-{}raw'.format(site), dst], stderr=runner.STDOUT)
 
         events_by_part = defaultdict(list)
         for i, part in enumerate(re.findall('[0-9]+(?=  event_code)', dump)):
@@ -107,21 +107,21 @@ def split_mono_fd_output(site_paths):
                 want.write('\n'.join(map(str, events)))
 
             output = dst.replace('.dst.gz', 'p{}.dst.gz'.format(part))
-            cmd = 'dstsplit -w {} -o {} {}'.format(eventlist, output, dst)
-            sp.check_output(cmd, shell=True)
+            runner.check_output(['dstsplit', '-w', eventlist, '-o', output, dst])
 
         break
 
 
 def run_fdplane(site_paths, geo_files):
+    fdplane_exe = os.path.join(os.getenv('TAHOME'), 'fdplane', 'bin', 'fdplane.run')
     for site, site_path in site_paths.items():
         dsts = glob(os.path.join(site_path, '*p??.dst.gz'))
         geo = geo_files[site]
         for dst in dsts:
             base_dst = os.path.basename(dst)
-            out = base_dst.replace('dst.gz', 'fdplane.out')
-            cmd = '$TAHOME/fdplane/bin/fdplane.run -geo {} -output 1000 {} &> {}'.format(geo, base_dst, out)
-            sp.check_output(cmd, shell=True, cwd=site_path)
+            out = os.path.join(site_path, base_dst.replace('dst.gz', 'fdplane.out'))
+            runner.run([fdplane_exe, '-geo', geo, '-output', '1000', base_dst], cwd=site_path, stdout=out,
+                stderr=runner.STDOUT, capture=False, check=True)
         junk_dsts = glob(os.path.join(site_path, '*d??.dst.gz'))
         for dst in junk_dsts:
             os.remove(dst)
@@ -1,9 +1,17 @@
 import os
-import subprocess as sp
+import sys
 
 from distutils import spawn as distutils__spawn
 from math import log10
 
+# This module shadows the pro/utils package for the scripts in this directory,
+# so the shared subprocess runner is imported from there by path. pro itself goes
+# last on the path, so that the runner finds the job metrics history to record in.
+_PRO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir)
+sys.path.append(os.path.join(_PRO_DIR, 'utils'))
+sys.path.append(_PRO_DIR)
+import runner
+
 FIELDS = [
     'event',
     'species',
@@ -43,8 +51,7 @@ def rts_to_ROOT(rts):
         assert os.path.exists(exe), 'Not found: {}'.format(exe)
     assert distutils__spawn.find_executable('root'), 'ROOT appears not to be installed'
 
-    cmd = '{rtsparser} -Etslpcgu {rts}'.format(rtsparser=rts_parser_exe, rts=rts)
-    output = sp.check_output(cmd, shell=True)
+    output = runner.check_output([rts_parser_exe, '-Etslpcgu', rts])
     lines = output.split('\n')[:-1]
 
     buf = ''
@@ -57,8 +64,7 @@ def rts_to_ROOT(rts):
     with open(temp_file, 'w') as rts_txt:
         rts_txt.write(buf)
 
-    cmd = 'root -l -b -q "{0}(\\"{1}\\")"'.format(rts_to_root_exe, temp_file)
-    sp.check_output(cmd, shell=True)
+    runner.check_output(['root', '-l', '-b', '-q', '{0}("{1}")'.format(rts_to_root_exe, temp_file)])
     os.remove(temp_file)
 
 def _format_rts_line(line, last_event):
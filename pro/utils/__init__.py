@@ -3,8 +3,11 @@
 # Utilities for use in several functions/modules.
 
 import datetime
+import logging
 import os
-import subprocess
+import sqlite3
+
+from . import runner
 
 
 class Constants(object):
@@ -26,9 +29,8 @@ def _command(cmd):
     """
     Given a command as though typed in the shell, execute that command and return (stdout, stderr)
     """
-    p = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    p.wait()
-    return p.communicate()
+    result = runner.run(cmd.split())
+    return result.stdout, result.stderr
 
 tama = {'0': '/tama_0/black-rock/', '1': '/tama_1/long-ridge/'}
 
@@ -47,12 +49,23 @@ def _camlist(daqcams):
 j0 = datetime.datetime(2007, 7, 1)
 def get_jstart(timecorr, trig=None):
     if trig is None:
+        from db import timecorr_index
         try:
-            with open(timecorr, 'r') as tc:
-                trig = tc.readlines()[0]
-        except:
+            return timecorr_index.lookup(timecorr).jstart
+        except (IOError, OSError):
             print 'Could not get first trigger from', timecorr
             return None
+        except sqlite3.Error as err:
+            # no usable index (e.g. not run from the pro directory): read the first line instead
+            logging.warn('Timecorr index unavailable (%s); reading %s', err, timecorr)
+            try:
+                with open(timecorr, 'r') as tc:
+                    trig = tc.readline()
+            except (IOError, OSError):
+                trig = ''
+            if not trig:
+                print 'Could not get first trigger from', timecorr
+                return None
     hh, mm, ss, ns = [int(t) for t in trig.split()[2:6]]
     mus = int(ns/1000)
 
@@ -0,0 +1,57 @@
+# dircache.py
+# Answer many file-existence questions with one directory listing per directory,
+# instead of one stat (and one network round trip) per file.
+
+import os
+from multiprocessing.pool import ThreadPool
+
+DEFAULT_THREADS = 16
+
+
+def _list(path):
+    try:
+        return path, frozenset(os.listdir(path))
+    except OSError:
+        return path, None
+
+
+class DirectoryCache(object):
+    """
+    Remembers the contents of each directory it lists. A listing is taken when
+    a directory is first asked about, or ahead of time with prefetch(), and is
+    not refreshed; make a new cache to see later changes.
+    """
+    def __init__(self):
+        self._listings = {}
+
+    def listdir(self, path):
+        """
+        Return the set of names in the directory, or None if it cannot be listed.
+        """
+        path = os.path.normpath(path)
+        try:
+            return self._listings[path]
+        except KeyError:
+            _, names = _list(path)
+            self._listings[path] = names
+            return names
+
+    def exists(self, path):
+        directory, name = os.path.split(os.path.normpath(path))
+        names = self.listdir(directory)
+        return names is not None and name in names
+
+    def prefetch(self, directories, threads=DEFAULT_THREADS):
+        """
+        List all the given directories not yet cached, using a pool of threads.
+        """
+        todo = sorted(set(os.path.normpath(d) for d in directories) - set(self._listings))
+        if not todo:
+            return
+        pool = ThreadPool(max(1, min(threads, len(todo))))
+        try:
+            for path, names in pool.imap_unordered(_list, todo):
+                self._listings[path] = names
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,128 @@
+# ephemeris.py
+# Moonless dark hours at the Telescope Array site, computed locally for any range of
+# nights with low-precision solar and lunar positions (Astronomical Almanac formulas,
+# good to ~0.01 degree for the Sun and ~0.3 degree for the Moon; a minute or two of rise time).
+# Requires NumPy.
+
+import datetime
+
+import numpy as np
+
+
+# Central Laser Facility, near the center of the TA surface detector array
+LATITUDE = 39.29693
+LONGITUDE = -112.90875 # degrees east
+
+TWILIGHT = -18.0 # Sun altitude (degrees) at the end of astronomical twilight
+STEP_MINUTES = 1.0
+
+# A night is labeled by the UTC date on which it becomes dark (as the TA wiki and DAQ logs do),
+# and runs from local noon (19:00 UTC) the day before to local noon that day.
+NIGHT_START_UTC_HOURS = -5.0
+
+J2000 = datetime.datetime(2000, 1, 1, 12)
+
+
+def _days_since_j2000(dates):
+    """
+    Days from J2000.0 to 00:00 UTC of each yyyymmdd date.
+    """
+    return np.array([
+        (datetime.datetime(d // 10000, d // 100 % 100, d % 100) - J2000).total_seconds() / 86400.
+        for d in dates
+    ])
+
+
+def _sind(x):
+    return np.sin(np.radians(x))
+
+
+def _cosd(x):
+    return np.cos(np.radians(x))
+
+
+def _altitude(n, ra, dec, latitude, longitude):
+    """
+    Altitude in degrees of an object at right ascension ra and declination dec (degrees),
+    n days after J2000.0 (UT), for an observer at latitude and longitude.
+    """
+    lst = 280.46061837 + 360.98564736629 * n + longitude
+    hour_angle = lst - ra
+    return np.degrees(np.arcsin(_sind(latitude) * _sind(dec) + _cosd(latitude) * _cosd(dec) * _cosd(hour_angle)))
+
+
+def sun_altitude(n, latitude=LATITUDE, longitude=LONGITUDE):
+    """
+    Geometric altitude of the Sun in degrees, n days after J2000.0 (any array shape).
+    """
+    mean_longitude = 280.460 + 0.9856474 * n
+    anomaly = 357.528 + 0.9856003 * n
+    ecliptic_longitude = mean_longitude + 1.915 * _sind(anomaly) + 0.020 * _sind(2 * anomaly)
+    obliquity = 23.439 - 0.0000004 * n
+    ra = np.degrees(np.arctan2(_cosd(obliquity) * _sind(ecliptic_longitude), _cosd(ecliptic_longitude)))
+    dec = np.degrees(np.arcsin(_sind(obliquity) * _sind(ecliptic_longitude)))
+    return _altitude(n, ra, dec, latitude, longitude)
+
+
+def moon_altitude(n, latitude=LATITUDE, longitude=LONGITUDE):
+    """
+    Geocentric altitude of the Moon in degrees, n days after J2000.0 (any array shape),
+    and its horizontal parallax in degrees.
+    """
+    t = n / 36525.
+    ecliptic_longitude = (218.32 + 481267.881 * t
+        + 6.29 * _sind(135.0 + 477198.87 * t) - 1.27 * _sind(259.3 - 413335.36 * t)
+        + 0.66 * _sind(235.7 + 890534.22 * t) + 0.21 * _sind(269.9 + 954397.74 * t)
+        - 0.19 * _sind(357.5 + 35999.05 * t) - 0.11 * _sind(186.5 + 966404.03 * t))
+    ecliptic_latitude = (5.13 * _sind(93.3 + 483202.02 * t) + 0.28 * _sind(228.2 + 960400.89 * t)
+        - 0.28 * _sind(318.3 + 6003.15 * t) - 0.17 * _sind(217.6 - 407332.21 * t))
+    parallax = (0.9508 + 0.0518 * _cosd(135.0 + 477198.87 * t) + 0.0095 * _cosd(259.3 - 413335.36 * t)
+        + 0.0078 * _cosd(235.7 + 890534.22 * t) + 0.0028 * _cosd(269.9 + 954397.74 * t))
+
+    x = _cosd(ecliptic_latitude) * _cosd(ecliptic_longitude)
+    y = 0.9175 * _cosd(ecliptic_latitude) * _sind(ecliptic_longitude) - 0.3978 * _sind(ecliptic_latitude)
+    z = 0.3978 * _cosd(ecliptic_latitude) * _sind(ecliptic_longitude) + 0.9175 * _sind(ecliptic_latitude)
+    ra = np.degrees(np.arctan2(y, x))
+    dec = np.degrees(np.arcsin(z))
+    return _altitude(n, ra, dec, latitude, longitude), parallax
+
+
+def nights(dates, step_minutes=STEP_MINUTES, latitude=LATITUDE, longitude=LONGITUDE):
+    """
+    For each yyyymmdd date, the hours of astronomical night (Sun below TWILIGHT) and of
+    moonless astronomical night (also no part of the Moon above the horizon), sampled
+    every step_minutes over the whole range at once. Return two arrays of hours.
+    """
+    steps = int(round(24 * 60 / step_minutes))
+    start = _days_since_j2000(dates) + NIGHT_START_UTC_HOURS / 24.
+    n = start[:, np.newaxis] + (np.arange(steps) + 0.5) * (step_minutes / 1440.)
+
+    night = sun_altitude(n, latitude, longitude) < TWILIGHT
+    moon, parallax = moon_altitude(n, latitude, longitude)
+# the Moon rises when its upper limb, lifted by refraction, reaches the horizon
+    moonless = moon < 0.7275 * parallax - 0.5667
+
+    hours = step_minutes / 60.
+    return night.sum(axis=1) * hours, (night & moonless).sum(axis=1) * hours
+
+
+def dark_hours(dates, **kwargs):
+    """
+    Moonless dark hours for each yyyymmdd date, as {date: hours} rounded like the wiki (0.01 hour).
+    """
+    dates = list(dates)
+    _, dark = nights(dates, **kwargs)
+    return {date: round(float(hours), 2) for date, hours in zip(dates, dark)}
+
+
+def date_range(start, end):
+    """
+    Every yyyymmdd date from start up to but not including end.
+    """
+    day = datetime.date(start // 10000, start // 100 % 100, start % 100)
+    stop = datetime.date(end // 10000, end // 100 % 100, end % 100)
+    dates = []
+    while day < stop:
+        dates.append(int(day.strftime('%Y%m%d')))
+        day += datetime.timedelta(days=1)
+    return dates
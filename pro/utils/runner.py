@@ -0,0 +1,210 @@
+# runner.py
+# Run external programs without the pitfalls of os.system and friends: output is
+# read as it is produced (so a chatty program can never fill a pipe and hang), to a
+# string, a file and/or a callback per line; a wall-clock timeout kills the whole
+# process group; and the exit status, CPU time and peak RSS are taken from wait4.
+#
+# Only the standard library is imported when loading, so that scripts run on cluster
+# nodes from other directories (see stereo/simulation/utils.py) can import this module
+# alone; the job metrics history is only looked for on the first run.
+
+import collections
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+STDOUT = subprocess.STDOUT
+KILL_GRACE = 5.0 # seconds between SIGTERM and SIGKILL after a timeout
+
+# Set to an object with a record(job_id, executable, input_size, measured, units) method
+# (such as services.jobs.metrics.JobMetrics) to record every run, or to False to record
+# nothing. Left None, the first run opens the history in pro/db if it can be imported.
+metrics = None
+_metrics_lock = threading.Lock()
+_PRO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+Result = collections.namedtuple('Result', ['returncode', 'stdout', 'stderr', 'wall', 'cpu', 'maxrss_kb', 'timed_out'])
+
+
+class CommandError(subprocess.CalledProcessError):
+    """
+    Raised by run(check=True) and check_output for a nonzero exit status or a timeout.
+    """
+    def __init__(self, cmd, result):
+        subprocess.CalledProcessError.__init__(self, result.returncode, cmd, result.stdout)
+        self.result = result
+
+    def __str__(self):
+        if self.result.timed_out:
+            return "Command '{}' timed out after {:.0f} seconds".format(self.cmd, self.result.wall)
+        return subprocess.CalledProcessError.__str__(self)
+
+
+def _pump(pipe, sinks):
+    """
+    Copy lines from pipe to every sink until it closes.
+    """
+    try:
+        for line in iter(pipe.readline, ''):
+            for sink in sinks:
+                sink(line)
+    finally:
+        pipe.close()
+
+
+def _sinks(path, callback, capture, append):
+    """
+    Return the functions to hand each line to, the list collecting captured lines
+    (or None), and any file opened for writing.
+    """
+    sinks = []
+    lines = [] if capture else None
+    handle = None
+    if path is not None:
+        handle = open(path, 'a' if append else 'w')
+        sinks.append(handle.write)
+    if callback is not None:
+        sinks.append(callback)
+    if lines is not None:
+        sinks.append(lines.append)
+    return sinks, lines, handle
+
+
+def _kill(proc, timed_out):
+    timed_out.set()
+    for sig, wait in [(signal.SIGTERM, KILL_GRACE), (signal.SIGKILL, 0)]:
+        try:
+            os.killpg(proc.pid, sig)
+        except OSError:
+            return # already gone
+        deadline = time.time() + wait
+        while time.time() < deadline:
+            if proc.returncode is not None:
+                return
+            time.sleep(0.1)
+
+
+def run(cmd, cwd=None, env=None, stdout=None, stderr=None, on_stdout=None, on_stderr=None,
+        append=False, capture=True, timeout=None, check=False, executable=None, input_size=None, units=None):
+    """
+    Run cmd (a string for the shell, or a list of arguments) and return a Result.
+
+    Each of stdout and stderr may name a file to write (or with append, add) to and
+    have a function to call with every line (on_stdout, on_stderr); with capture, its
+    text is also returned in the Result. stderr=STDOUT merges it into stdout. After timeout seconds the process
+    and everything it started are terminated, and the Result has timed_out set.
+    With check, raise CommandError unless the command exits with status 0.
+
+    Unless the module's metrics is False, the run is recorded there under executable
+    (default: the program's name), input_size and units (see JobMetrics.record).
+    """
+    shell = isinstance(cmd, basestring)
+    merge = stderr is STDOUT
+    out_sinks, out_lines, out_file = _sinks(stdout, on_stdout, capture, append)
+    err_sinks, err_lines, err_file = _sinks(None if merge else stderr, on_stderr, capture and not merge, append)
+
+    start = time.time()
+    try:
+        proc = subprocess.Popen(cmd, shell=shell, cwd=cwd, env=env, close_fds=True,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT if merge else subprocess.PIPE,
+            preexec_fn=os.setsid)
+    except OSError:
+        for handle in [out_file, err_file]:
+            if handle is not None:
+                handle.close()
+        raise
+    pumps = [threading.Thread(target=_pump, args=(proc.stdout, out_sinks))]
+    if not merge:
+        pumps.append(threading.Thread(target=_pump, args=(proc.stderr, err_sinks)))
+    for pump in pumps:
+        pump.daemon = True
+        pump.start()
+
+    timed_out = threading.Event()
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, _kill, (proc, timed_out))
+        timer.daemon = True
+        timer.start()
+    try:
+        while True:
+            try:
+                _, status, usage = os.wait4(proc.pid, 0)
+                break
+            except OSError as err:
+                if err.errno != 4: # EINTR
+                    raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+    returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    proc.returncode = returncode # reaped here, so that Popen does not try again
+    for pump in pumps:
+        pump.join()
+    for handle in [out_file, err_file]:
+        if handle is not None:
+            handle.close()
+
+    result = Result(
+        returncode=returncode,
+        stdout=''.join(out_lines) if out_lines is not None else None,
+        stderr=''.join(err_lines) if err_lines is not None else None,
+        wall=time.time() - start,
+        cpu=usage.ru_utime + usage.ru_stime,
+        maxrss_kb=usage.ru_maxrss,
+        timed_out=timed_out.is_set(),
+    )
+    _record(cmd, result, executable, input_size, units)
+    if check and (returncode != 0 or result.timed_out):
+        raise CommandError(cmd, result)
+    return result
+
+
+def _default_metrics():
+    """
+    Return the module's metrics, opening the job metrics history of this checkout
+    (whatever the working directory) the first time; False if it is unavailable.
+    """
+    global metrics
+    with _metrics_lock:
+        if metrics is None:
+            try:
+                from services.jobs.metrics import JobMetrics, METRICS_DB
+                metrics = JobMetrics(os.path.join(_PRO_DIR, METRICS_DB))
+            except Exception as err: # not importable from here, or the database cannot be opened
+                logging.debug('Not recording metrics of local runs: %s', err)
+                metrics = False
+    return metrics
+
+
+def _record(cmd, result, executable, input_size, units):
+    recorder = metrics if metrics is not None else _default_metrics()
+    if not recorder:
+        return
+    if executable is None:
+        words = cmd.split() if isinstance(cmd, basestring) else cmd
+        executable = os.path.basename(words[0]) if words else None
+    measured = {'wall': result.wall, 'cpu': result.cpu, 'maxrss_kb': result.maxrss_kb, 'returncode': result.returncode}
+    try:
+        recorder.record('local-{}'.format(os.getpid()), executable, input_size, measured, units)
+    except Exception as err:
+        logging.error('Could not record metrics of %s: %s', executable, err)
+
+
+def check_output(cmd, **kwargs):
+    """
+    Like subprocess.check_output: return the command's output, raising CommandError
+    (a CalledProcessError) if it fails. Takes the keyword arguments of run().
+    """
+    return run(cmd, check=True, **kwargs).stdout
+
+
+def call(cmd, **kwargs):
+    """
+    Like os.system, but without capturing anything by default: return the exit status.
+    """
+    kwargs.setdefault('capture', False)
+    return run(cmd, **kwargs).returncode
@@ -1,13 +1,57 @@
-import urllib2
-import time
+# tawiki.py
+# Fetch pages from the members-only TA wiki. Every page is kept in an on-disk
+# cache and revalidated with If-None-Match/If-Modified-Since, over one
+# keep-alive connection per thread. In offline mode pages come only from the cache.
 
+import base64
+import hashlib
+import httplib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+from multiprocessing.pool import ThreadPool
 
-from auth_ta import tawiki_username, tawiki_password
+try:
+  from auth_ta import tawiki_username, tawiki_password
+except ImportError:
+  tawiki_username = tawiki_password = None # offline mode only
 
 sites = ['brm', 'lr', 'md']
 
 
-WIKI = 'http://www.telescopearray.org/tawiki/index.php'
+WIKI = os.getenv('TAWIKI_URL', 'http://www.telescopearray.org/tawiki/index.php')
+CACHE_DIR = os.getenv('TAWIKI_CACHE', os.path.expanduser('~/.tawiki_cache'))
+OFFLINE = bool(os.getenv('TAWIKI_OFFLINE'))
+TIMEOUT = 60 # seconds
+DEFAULT_THREADS = 4
+MAX_REDIRECTS = 5
+
+_local = threading.local()
+_fetched = {} # url -> page, for pages already fetched or revalidated by this process
+_fetched_lock = threading.Lock()
+
+
+def configure(base_url=None, cache_dir=None, offline=None):
+  '''
+  Override the wiki location (e.g. a local stand-in server), the cache
+  directory, or offline mode, for the rest of this process.
+  '''
+  global WIKI, CACHE_DIR, OFFLINE
+  if base_url is not None:
+    WIKI = base_url
+  if cache_dir is not None:
+    CACHE_DIR = cache_dir
+  if offline is not None:
+    OFFLINE = offline
+  with _fetched_lock:
+    _fetched.clear()
+
+
 def get_page(year):
   '''
   Download the "run logs and signups" MediaWiki page for the requested year 
@@ -23,26 +67,163 @@ def get_page(year):
   return _get_wiki_resource(tadurl)
 
 
+def get_pages(years, threads=DEFAULT_THREADS):
+  '''
+  get_page for each year, fetching up to threads pages at once. Return {year: html}.
+  '''
+  return dict(zip(years, _map(get_page, years, threads)))
+
+
+def _map(function, args, threads):
+  args = list(args)
+  if threads <= 1 or len(args) <= 1:
+    return [function(arg) for arg in args]
+  pool = ThreadPool(min(threads, len(args)))
+  try:
+    return pool.map(function, args)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _cache_paths(url):
+  key = hashlib.sha1(url).hexdigest()
+  return os.path.join(CACHE_DIR, key + '.html'), os.path.join(CACHE_DIR, key + '.json')
+
+
+def _read_cache(url):
+  page_path, meta_path = _cache_paths(url)
+  try:
+    with open(meta_path, 'r') as meta_file:
+      meta = json.load(meta_file)
+    with open(page_path, 'rb') as page_file:
+      return page_file.read(), meta
+  except (IOError, ValueError):
+    return None, {}
+
+
+def _write_cache(url, page, meta):
+  if not os.path.isdir(CACHE_DIR):
+    try:
+      os.makedirs(CACHE_DIR)
+    except OSError:
+      pass # made by another thread
+  page_path, meta_path = _cache_paths(url)
+  for path, content in [(page_path, page), (meta_path, json.dumps(meta))]:
+    tmp = '{}.{}.{}'.format(path, os.getpid(), threading.current_thread().ident)
+    with open(tmp, 'wb') as f:
+      f.write(content)
+    os.rename(tmp, path)
+
+
+def _connection(scheme, netloc):
+  '''
+  This thread's keep-alive connection to the wiki host, opened if necessary.
+  '''
+  if getattr(_local, 'key', None) != (scheme, netloc):
+    if getattr(_local, 'con', None) is not None:
+      _local.con.close()
+    cls = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+    _local.con = cls(netloc, timeout=TIMEOUT)
+    _local.key = (scheme, netloc)
+  return _local.con
+
+
+def _request(url, headers):
+  '''
+  GET url on the shared connection, following redirects. Return (status, headers, body).
+  A connection dropped by the server between requests is reopened once.
+  '''
+  for _ in range(MAX_REDIRECTS + 1):
+    parts = urlparse.urlsplit(url)
+    path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+    for attempt in range(2):
+      con = _connection(parts.scheme, parts.netloc)
+      try:
+        con.request('GET', path, headers=headers)
+        response = con.getresponse()
+        body = response.read()
+        break
+      except (httplib.HTTPException, socket.error):
+        con.close()
+        _local.key = None
+        if attempt:
+          raise
+    if response.status in (301, 302, 303, 307) and response.getheader('location'):
+      url = urlparse.urljoin(url, response.getheader('location'))
+      continue
+    return response.status, response, body
+  raise urllib2.HTTPError(url, response.status, 'too many redirects', None, None)
+
+
 def _get_wiki_resource(tadurl):
-# this authentication procedure is based on the HOWTO
-# at https://docs.python.org/2/howto/urllib2.html
+  '''
+  Return the page at tadurl, from this process's memory if already fetched,
+  otherwise from the wiki (revalidating any cached copy), otherwise, when
+  offline or the wiki cannot be reached, from the cache alone.
+  '''
+  with _fetched_lock:
+    if tadurl in _fetched:
+      return _fetched[tadurl]
+
+  cached, meta = _read_cache(tadurl)
+  if OFFLINE:
+    if cached is None:
+      raise IOError('Offline, and not in wiki cache: {}'.format(tadurl))
+    page = cached
+  else:
+    page = _fetch(tadurl, cached, meta)
+
+  with _fetched_lock:
+    _fetched[tadurl] = page
+  return page
+
 
-    authwiki = urllib2.HTTPPasswordMgrWithDefaultRealm()
+def _fetch(tadurl, cached, meta):
+  headers = {}
+  if tawiki_username is not None:
+    credentials = base64.b64encode('{}:{}'.format(tawiki_username, tawiki_password))
+    headers['Authorization'] = 'Basic ' + credentials
+  if cached is not None:
+    if meta.get('etag'):
+      headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+      headers['If-Modified-Since'] = meta['last_modified']
 
-    authwiki.add_password(
-        None, WIKI,
-        tawiki_username, tawiki_password)
-      
-    handler = urllib2.HTTPBasicAuthHandler(authwiki)
-    opener = urllib2.build_opener(handler)
+  try:
+    status, response, body = _request(tadurl, headers)
+  except (httplib.HTTPException, socket.error) as err:
+    if cached is None:
+      raise
+    logging.warn('Using cached copy of %s: %s', tadurl, err)
+    return cached
 
-    return opener.open(tadurl).read()
+  if status == 304 and cached is not None:
+    logging.debug('Not modified: %s', tadurl)
+    return cached
+  if status != 200:
+    raise urllib2.HTTPError(tadurl, status, response.reason, response.msg, None)
+
+  _write_cache(tadurl, body, {
+    'url': tadurl,
+    'etag': response.getheader('etag'),
+    'last_modified': response.getheader('last-modified'),
+    'fetched': time.time(),
+  })
+  return body
 
 
 def get_log_page(log_file):
     tadurl = WIKI + '/{}'.format(log_file)
     return _get_wiki_resource(tadurl)
 
+
+def get_log_pages(log_files, threads=DEFAULT_THREADS):
+  '''
+  get_log_page for each log file, fetching up to threads pages at once. Return {log_file: html}.
+  '''
+  return dict(zip(log_files, _map(get_log_page, log_files, threads)))
+
   
   
 def find_log_dates(html,site):
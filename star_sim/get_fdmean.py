@@ -16,8 +16,10 @@ assert TSTA is not None
 sys.path.append(os.path.join(TSTA, 'pro'))
 
 from db.database_wrapper import DatabaseWrapper
+from db.timecorr_index import TimecorrIndex
 from utils import _timecorr_path, _camlist
 raw_db = DatabaseWrapper(os.path.join(TSTA, 'pro', 'db', 'fadc_data.db'))
+tc_index = TimecorrIndex(os.path.join(TSTA, 'pro', 'db', 'fadc_process.db'))
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser()
@@ -31,7 +33,7 @@ output = args.output_dir
 force_rebuild = args.force_rebuild
 
 # Retrieve part info from database and validate result
-dbpart = raw_db.retrieve('SELECT p.daqcams, p.site, f.ctdprefix FROM Parts AS p JOIN Filesets AS f ON p.part11=f.part11 WHERE p.part11={}'.format(part))
+dbpart = raw_db.retrieve('SELECT p.daqcams, p.site, f.ctdprefix FROM Parts AS p JOIN Filesets AS f ON p.part11=f.part11 WHERE p.part11=?', (part,))
 
 assert len(dbpart) == 1
 daqcams, site, ctdprefix = dbpart[0]
@@ -60,9 +62,7 @@ os.system('mkdir -p {}'.format(logdir))
 
 # Read the number of triggers in the raw data files
 assert os.path.exists(tcfile)
-with open(tcfile, 'r') as tc:
-    tclines = tc.readlines()
-num_triggers = len(tclines)
+num_triggers = tc_index.lookup(tcfile).lines
 print num_triggers
 
 # Loop over raw data files, organized in 256-trigger chunks, with TAMA calls